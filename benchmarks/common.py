@@ -0,0 +1,90 @@
+""" Helpers shared by the benchmarks. """
+from __future__ import print_function
+
+import json
+import platform
+import sys
+import time
+
+import transaction
+
+
+def package_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('voteit.liquid').version
+    except Exception: #pragma : no cover
+        return None
+
+
+class Timer(object):
+    """ Collects timings as result dicts.
+
+        with timer('represent', operations = 1000):
+            ...
+    """
+
+    def __init__(self):
+        self.results = []
+
+    def __call__(self, name, operations = 1, **extra):
+        return _Timing(self, name, operations, extra)
+
+
+class _Timing(object):
+
+    def __init__(self, timer, name, operations, extra):
+        self.timer = timer
+        self.result = dict(extra, name = name, operations = operations)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self.result
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            seconds = time.time() - self.start
+            self.result['seconds'] = round(seconds, 6)
+            operations = self.result['operations']
+            self.result['ms_per_operation'] = operations and round(seconds * 1000.0 / operations, 4) or None
+            self.timer.results.append(self.result)
+
+
+def commit_size(storage):
+    """ Commit the current transaction and return the number of stored objects
+        and the size of their pickles.
+    """
+    transaction.commit()
+    tid = storage.lastTransaction()
+    objects = 0
+    size = 0
+    for txn in storage.iterator(tid, tid):
+        for record in txn:
+            objects += 1
+            size += len(record.data)
+    return objects, size
+
+
+def write_results(name, params, results, output = None):
+    """ Write the results as JSON to output, or stdout if output is None. """
+    data = {'benchmark': name,
+            'version': package_version(),
+            'python': platform.python_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': params,
+            'results': results}
+    text = json.dumps(data, indent = 2, sort_keys = True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return data
+
+
+def add_output_argument(parser):
+    parser.add_argument('--output', help = "Write JSON results to this file instead of stdout")
+
+
+def main_argv(argv):
+    return argv is None and sys.argv or argv
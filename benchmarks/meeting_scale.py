@@ -0,0 +1,198 @@
+""" Delegation and vote propagation at meeting scale.
+
+    Builds a synthetic meeting stored in ZODB and times:
+
+    - churn: delegators picking and releasing representatives
+    - propagation: representatives voting in ongoing polls, with votes added for their delegators
+    - view: RepresentationView, rendering its template and pages of representatives.json
+    - commit size: objects and pickle bytes written by the transactions above
+
+    Results are written as JSON so runs against different versions can be compared.
+
+    python benchmarks/meeting_scale.py --users 10000 --representatives 500 --polls 50 --output results.json
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+
+from pyramid import testing
+from pyramid.renderers import render
+from webob.etag import NoETag
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+import transaction
+from voteit.core.models.poll import Poll
+from voteit.core.models.user import User
+from voteit.core.models.vote import Vote
+from voteit.core.security import unrestricted_wf_transition_to
+from voteit.core.testing_helpers import active_poll_fixture
+
+from voteit.liquid.interfaces import IRepresentatives
+
+from common import add_output_argument
+from common import commit_size
+from common import main_argv
+from common import Timer
+from common import write_results
+
+
+def setup_config(args):
+    config = testing.setUp(request = testing.DummyRequest(if_none_match = NoETag))
+    config.registry.settings['voteit.liquid.type'] = args.type
+    config.registry.settings['voteit.liquid.storage'] = args.storage_layout
+    config.include('arche.testing')
+    config.include('voteit.liquid')
+    config.include('pyramid_chameleon')
+    config.include('voteit.core.plugins.majority_poll')
+    root = active_poll_fixture(config)
+    #active_poll_fixture may clear registry.settings
+    config.registry.settings['voteit.liquid.type'] = args.type
+    config.registry.settings['voteit.liquid.storage'] = args.storage_layout
+    return config, root
+
+
+def open_db(args, tmpdir):
+    if args.filestorage:
+        return DB(FileStorage(os.path.join(tmpdir, 'Data.fs')))
+    return DB(MappingStorage())
+
+
+def build_meeting(config, root, args, rnd, timer):
+    meeting = root['meeting']
+    ai = meeting['ai']
+    userids = ['user%05d' % i for i in range(args.users)]
+    representatives = userids[:args.representatives]
+    with timer('setup_users', operations = len(userids)):
+        for userid in userids:
+            root.users[userid] = User()
+            meeting.add_groups(userid, ['role:Voter'])
+    repr = IRepresentatives(meeting)
+    with timer('setup_delegations', operations = len(userids) - len(representatives)):
+        for userid in representatives:
+            repr.enable_representative(userid)
+        for userid in userids[args.representatives:]:
+            repr.represent(rnd.choice(representatives), userid)
+    polls = [ai['poll']]
+    for i in range(1, args.polls):
+        ai['poll%s' % i] = poll = Poll()
+        polls.append(poll)
+    for poll in polls:
+        poll.set_field_value('poll_plugin', 'majority_poll')
+        if poll.get_workflow_state() != 'ongoing':
+            unrestricted_wf_transition_to(poll, 'ongoing')
+    return meeting, userids, representatives, polls
+
+
+def bench_churn(meeting, userids, representatives, storage, rnd, timer, args):
+    repr = IRepresentatives(meeting)
+    delegators = userids[args.representatives:]
+    commits = []
+    with timer('churn', operations = args.churn) as result:
+        for i in range(args.churn):
+            userid = rnd.choice(delegators)
+            if i % 10 == 0:
+                repr.release(userid)
+            else:
+                repr.represent(rnd.choice(representatives), userid)
+            if i % args.batch == args.batch - 1:
+                commits.append(commit_size(storage))
+        commits.append(commit_size(storage))
+    result['commits'] = len(commits)
+    result['commit_objects'] = sum([x[0] for x in commits])
+    result['commit_bytes'] = sum([x[1] for x in commits])
+
+
+def bench_propagation(config, meeting, representatives, polls, storage, rnd, timer, args):
+    repr = IRepresentatives(meeting)
+    voting = rnd.sample(representatives, min(args.voting, len(representatives)))
+    expected = sum([repr.count(userid) for userid in voting]) * len(polls)
+    commits = []
+    with timer('propagation', operations = len(voting) * len(polls), proxy_votes = expected) as result:
+        for poll in polls:
+            for userid in voting:
+                config.testing_securitypolicy(userid = userid)
+                vote = Vote(creators = [userid])
+                vote.set_vote_data({'proposal': rnd.choice('abc')}, notify = False)
+                poll[userid] = vote
+            commits.append(commit_size(storage))
+    result['commit_objects'] = sum([x[0] for x in commits])
+    result['commit_bytes'] = sum([x[1] for x in commits])
+    result['votes'] = sum([len(poll) for poll in polls])
+
+
+def bench_view(config, meeting, userids, rnd, timer, args):
+    from voteit.liquid.views import RepresentationView
+    from voteit.liquid.views import RepresentativesJSON
+    sample = [rnd.choice(userids) for i in range(args.views)]
+    with timer('representation_view', operations = len(sample)):
+        for userid in sample:
+            config.testing_securitypolicy(userid = userid, permissive = True)
+            RepresentationView(meeting, testing.DummyRequest(if_none_match = NoETag))()
+    with timer('representation_render', operations = len(sample)):
+        for userid in sample:
+            config.testing_securitypolicy(userid = userid, permissive = True)
+            request = testing.DummyRequest(if_none_match = NoETag, is_xhr = True)
+            view = RepresentationView(meeting, request)
+            values = view()
+            values.update({'view': view, 'context': meeting, 'request': request})
+            render('voteit.liquid:templates/representation.pt', values, request = request)
+    for sort in ('name', 'weight'):
+        with timer('representatives_json_%s' % sort, operations = args.views):
+            after = None
+            for i in range(args.views):
+                params = {'sort': sort}
+                if after:
+                    params['after'] = after
+                response = RepresentativesJSON(meeting, testing.DummyRequest(params = params))()
+                after = response['next']
+
+
+def run(args):
+    rnd = random.Random(args.seed)
+    timer = Timer()
+    tmpdir = tempfile.mkdtemp()
+    db = open_db(args, tmpdir)
+    try:
+        conn = db.open()
+        config, root = setup_config(args)
+        conn.root()['app_root'] = root
+        meeting, userids, representatives, polls = build_meeting(config, root, args, rnd, timer)
+        with timer('setup_commit') as result:
+            result['commit_objects'], result['commit_bytes'] = commit_size(db.storage)
+        bench_churn(meeting, userids, representatives, db.storage, rnd, timer, args)
+        bench_propagation(config, meeting, representatives, polls, db.storage, rnd, timer, args)
+        bench_view(config, meeting, userids, rnd, timer, args)
+    finally:
+        transaction.abort()
+        testing.tearDown()
+        db.close()
+        shutil.rmtree(tmpdir)
+    return timer.results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark delegation and vote propagation at meeting scale.")
+    parser.add_argument('--users', type = int, default = 10000)
+    parser.add_argument('--representatives', type = int, default = 500)
+    parser.add_argument('--polls', type = int, default = 50)
+    parser.add_argument('--voting', type = int, default = 50, help = "Representatives voting in each poll")
+    parser.add_argument('--churn', type = int, default = 5000, help = "Number of represent/release operations")
+    parser.add_argument('--batch', type = int, default = 100, help = "Churn operations per transaction")
+    parser.add_argument('--views', type = int, default = 100, help = "Number of view calls")
+    parser.add_argument('--type', default = 'simple', help = "voteit.liquid.type")
+    parser.add_argument('--storage-layout', default = 'default', help = "voteit.liquid.storage")
+    parser.add_argument('--filestorage', action = 'store_true', help = "Use a FileStorage instead of a MappingStorage")
+    parser.add_argument('--seed', type = int, default = 1)
+    add_output_argument(parser)
+    args = parser.parse_args(main_argv(argv)[1:])
+    results = run(args)
+    params = dict(vars(args))
+    params.pop('output')
+    return write_results('meeting_scale', params, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
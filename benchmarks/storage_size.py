@@ -0,0 +1,130 @@
+""" Compare the size of the delegation storage layouts.
+
+    Builds the same delegations in a meeting with each layout, commits them to a
+    FileStorage and reports the number of stored objects, the size of their pickles
+    and the memory used by the loaded structures (where tracemalloc is available).
+
+    python benchmarks/storage_size.py --representatives 100 --delegators 10000 --output size.json
+"""
+import argparse
+import os
+import shutil
+import tempfile
+
+from BTrees.OOBTree import OOBTree
+from ZODB import DB
+from ZODB.FileStorage import FileStorage
+import transaction
+from voteit.core.models.meeting import Meeting
+
+from voteit.liquid.compact import CompactRepresentatives
+from voteit.liquid.models import Representatives
+
+from common import add_output_argument
+from common import main_argv
+from common import write_results
+
+
+def build_tuples(meeting, delegations):
+    """ The layout before delegators were stored in an OOTreeSet. """
+    data = meeting.__representatives_data__ = OOBTree()
+    reverse = meeting.__representatives_data_dev__ = OOBTree()
+    for (representative, delegators) in delegations.items():
+        data[representative] = tuple(delegators)
+        for delegator in delegators:
+            reverse[delegator] = representative
+
+
+def build_default(meeting, delegations):
+    repr = Representatives(meeting)
+    for (representative, delegators) in delegations.items():
+        repr[representative] = delegators
+
+
+def build_compact(meeting, delegations):
+    repr = CompactRepresentatives(meeting)
+    for (representative, delegators) in delegations.items():
+        repr[representative] = delegators
+
+
+LAYOUTS = (('tuple', build_tuples),
+           ('default', build_default),
+           ('compact', build_compact),)
+
+
+def make_delegations(representatives, delegators):
+    delegations = {}
+    for i in range(delegators):
+        representative = 'representative%05d' % (i % representatives)
+        delegations.setdefault(representative, []).append('delegator%07d' % i)
+    return delegations
+
+
+def load_all(obj):
+    """ Load the BTree or set obj and everything in it. """
+    getattr(obj, '_p_activate', lambda: None)()
+    if hasattr(obj, 'values'):
+        for value in obj.values():
+            load_all(value)
+    elif hasattr(obj, 'keys'):
+        list(obj.keys())
+
+
+def measure(name, build, delegations, path):
+    storage = FileStorage(path)
+    db = DB(storage)
+    conn = db.open()
+    conn.root()['meeting'] = meeting = Meeting()
+    build(meeting, delegations)
+    transaction.commit()
+    conn.close()
+    objects = 0
+    pickle_bytes = 0
+    for txn in storage.iterator():
+        for record in txn:
+            objects += 1
+            pickle_bytes += len(record.data)
+    memory = None
+    try:
+        import tracemalloc
+    except ImportError: #pragma : no cover
+        pass
+    else:
+        db.cacheMinimize()
+        conn = db.open()
+        meeting = conn.root()['meeting']
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        meeting._p_activate()
+        for (attr, value) in list(meeting.__dict__.items()):
+            if attr.startswith('__representatives_'):
+                load_all(value)
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        conn.close()
+    db.close()
+    return {'name': name,
+            'objects': objects,
+            'pickle_bytes': pickle_bytes,
+            'memory_bytes': memory}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Compare the size of the delegation storage layouts.")
+    parser.add_argument('--representatives', type = int, default = 100)
+    parser.add_argument('--delegators', type = int, default = 10000)
+    add_output_argument(parser)
+    args = parser.parse_args(main_argv(argv)[1:])
+    delegations = make_delegations(args.representatives, args.delegators)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        results = [measure(name, build, delegations, os.path.join(tmpdir, '%s.fs' % name))
+                   for (name, build) in LAYOUTS]
+    finally:
+        shutil.rmtree(tmpdir)
+    params = {'representatives': args.representatives, 'delegators': args.delegators}
+    return write_results('storage_size', params, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ README = open(os.path.join(here, 'README.rst')).read()
 CHANGES = open(os.path.join(here, 'CHANGES.rst')).read()
 
 requires = (
+    'Arche',
     'pyramid',
     'voteit.core',
     )
@@ -32,5 +33,10 @@ setup(name='voteit.liquid',
       tests_require= requires,
       test_suite="voteit.liquid",
       entry_points = """\
+      [console_scripts]
+      voteit_liquid_worker = voteit.liquid.deferred:main
+      voteit_liquid_delegations = voteit.liquid.bulk:main
+      voteit_liquid_verify = voteit.liquid.verify:main
+      voteit_liquid_expire = voteit.liquid.expiry:main
       """,
       )
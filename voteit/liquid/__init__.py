@@ -1,17 +1,28 @@
 from logging import getLogger
 
+from arche.models.evolver import BaseEvolver
 from pyramid.i18n import TranslationStringFactory
 
 
 _ = TranslationStringFactory('voteit.liquid')
 logger = getLogger(__name__)
 
+
+class LiquidEvolver(BaseEvolver):
+    name = 'voteit.liquid'
+    sw_version = 4
+    initial_db_version = 0
+
+
 def includeme(config):
     ld_type = config.registry.settings.get('voteit.liquid.type', None)
     if ld_type:
         logger.info("voteit.liquid model set to '%s'" % ld_type)
+        config.include('.instrumentation')
         config.include('.models')
         config.include('.views')
         config.include('.schemas')
+        config.include('.subscribers')
+        config.add_evolver(LiquidEvolver)
     else:
         logger.warn("'voteit.liquid.type' must be set if you want to include this plugin.")
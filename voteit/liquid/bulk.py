@@ -0,0 +1,280 @@
+""" Import and export of delegations as CSV or JSON Lines.
+
+    Each row is a representative and a delegator:
+
+    CSV
+        representative,delegator - an optional header with those names is skipped.
+    JSON Lines
+        {"representative": "jane", "delegator": "james"} or ["jane", "james"]
+
+    Files are read and written a row at a time. An import is validated as a whole
+    before anything is changed, and then applied in chunked transactions
+    with one aggregated event per chunk.
+
+    voteit_liquid_delegations etc/production.ini /meeting export --output delegations.csv
+    voteit_liquid_delegations etc/production.ini /meeting import delegations.csv
+"""
+import argparse
+import csv
+import json
+import sys
+
+from pyramid.paster import bootstrap
+from pyramid.traversal import find_resource
+import transaction
+
+from voteit.liquid import logger
+from voteit.liquid.interfaces import IRepresentatives
+
+
+CSV_HEADER = ['representative', 'delegator']
+FORMATS = ('csv', 'jsonl')
+
+
+def read_csv(stream):
+    """ Iterator of (line, representative, delegator). """
+    for (i, row) in enumerate(csv.reader(stream)):
+        row = [x.strip() for x in row]
+        if not any(row) or (i == 0 and row == CSV_HEADER):
+            continue
+        if len(row) != 2 or not all(row):
+            raise ValueError("Line %s: expected representative,delegator" % (i + 1))
+        yield (i + 1, row[0], row[1])
+
+
+def read_jsonl(stream):
+    """ Iterator of (line, representative, delegator). """
+    for (i, text) in enumerate(stream):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            raise ValueError("Line %s: invalid JSON" % (i + 1))
+        if isinstance(row, dict):
+            row = [row.get('representative', None), row.get('delegator', None)]
+        if not isinstance(row, list) or len(row) != 2 or not all(row):
+            raise ValueError("Line %s: expected representative and delegator" % (i + 1))
+        yield (i + 1, row[0], row[1])
+
+
+def write_csv(pairs, stream):
+    writer = csv.writer(stream)
+    writer.writerow(CSV_HEADER)
+    for pair in pairs:
+        writer.writerow(pair)
+
+
+def write_jsonl(pairs, stream):
+    for (representative, delegator) in pairs:
+        stream.write(json.dumps({'representative': representative, 'delegator': delegator}))
+        stream.write('\n')
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+
+def validate(repr, rows, enable = False):
+    """ Check rows of (line, representative, delegator) against the current
+        representatives and each other. If enable is true, representatives
+        who aren't enabled yet are allowed.
+
+        Returns a tuple of (representative, delegator) and a list of (line, error message).
+    """
+    pairs = []
+    lines = {}
+    errors = []
+    new_representatives = set()
+    for (line, key, item) in rows:
+        if key == item:
+            errors.append((line, "%s can't represent themselves" % key))
+        elif item in lines:
+            errors.append((line, "%s is already delegated on line %s" % (item, lines[item])))
+        elif key not in repr and not enable:
+            errors.append((line, "%s is not a representative" % key))
+        else:
+            lines[item] = line
+            pairs.append((key, item))
+            if key not in repr:
+                new_representatives.add(key)
+    if hasattr(repr, 'max_depth'):
+        errors.extend(_check_chains(repr, pairs, lines))
+    else:
+        for (key, item) in pairs:
+            if item in repr or item in new_representatives:
+                errors.append((lines[item], "%s is a representative and can't be represented" % item))
+    errors.sort()
+    return tuple(pairs), errors
+
+
+def _check_chains(repr, pairs, lines):
+    """ Cycles and chain length for representatives that may be represented,
+        as they would be once pairs are stored.
+    """
+    parent = dict([(item, key) for (key, item) in pairs])
+    children = {}
+    for (key, item) in pairs:
+        children.setdefault(key, []).append(item)
+
+    def representative_of(userid):
+        if userid in parent:
+            return parent[userid]
+        return repr.represented_by(userid)
+
+    def delegators_of(userid):
+        for delegator in repr.get(userid, ()):
+            if delegator not in parent:
+                yield delegator
+        for delegator in children.get(userid, ()):
+            yield delegator
+
+    errors = []
+    for (key, item) in pairs:
+        seen = set([item])
+        current = key
+        links = 0
+        while current is not None and current not in seen:
+            seen.add(current)
+            links += 1
+            current = representative_of(current)
+        if current is not None:
+            errors.append((lines[item], "%s representing %s would cause a cycle" % (key, item)))
+            continue
+        height = 0
+        level = [item]
+        while level:
+            level = [x for userid in level for x in delegators_of(userid) if x not in seen]
+            seen.update(level)
+            if level:
+                height += 1
+        if links + height > repr.max_depth:
+            errors.append((lines[item], "%s representing %s would make a chain longer than %s" %
+                           (key, item, repr.max_depth)))
+    return errors
+
+
+def _top_down(pairs):
+    """ pairs ordered so the delegation of each representative comes before
+        the delegations to them. Pairs must be validated, so there are no cycles.
+    """
+    parent = dict([(item, key) for (key, item) in pairs])
+    depths = {}
+
+    def depth(userid):
+        if userid not in depths:
+            depths[userid] = userid in parent and depth(parent[userid]) + 1 or 0
+        return depths[userid]
+
+    return sorted(pairs, key = lambda pair: depth(pair[0]))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def import_delegations(meeting, rows, enable = False, chunk_size = 500, retries = 5,
+                       request = None, tm = transaction.manager):
+    """ Validate rows and store the delegations, chunk_size delegations per transaction.
+        Returns a tuple of stored (representative, delegator) and a list of
+        (line, error message). Nothing is stored if there are errors.
+
+        Delegators are released in the same transaction as they're represented again,
+        so if an import fails part way, the chunks stored before are complete and
+        everyone else still has their old representative. Running the import again
+        finishes it.
+    """
+    pairs, errors = validate(IRepresentatives(meeting), rows, enable = enable)
+    if errors:
+        return (), errors
+    for attempt in tm.attempts(retries):
+        with attempt:
+            repr = IRepresentatives(meeting)
+            for key in sorted(set([key for (key, item) in pairs])):
+                if key not in repr:
+                    repr.enable_representative(key)
+    ordered = pairs
+    if hasattr(IRepresentatives(meeting), 'max_depth'):
+        #Representatives further up are stored first, so the chain above each new
+        #representative is already final and a chunk can't close a cycle with
+        #delegations a later chunk replaces. Delegators moving away from below someone
+        #are only released with their own chunk though, so if that makes a chain too
+        #long part way, use a chunk_size that fits the whole import.
+        ordered = _top_down(pairs)
+    done = 0
+    for chunk in _chunks(ordered, chunk_size):
+        for attempt in tm.attempts(retries):
+            with attempt:
+                if request is not None:
+                    request._liquid_authorized = {}
+                IRepresentatives(meeting).represent_many(chunk)
+        done += len(chunk)
+        logger.info("Stored %s of %s delegations" % (done, len(pairs)))
+    return pairs, errors
+
+
+def export_delegations(meeting, stream, format = 'csv'):
+    WRITERS[format](IRepresentatives(meeting).delegations(), stream)
+
+
+def _guess_format(filename, format):
+    if format:
+        return format
+    if filename and filename.endswith('.jsonl'):
+        return 'jsonl'
+    return 'csv'
+
+
+def main(argv = sys.argv):
+    parser = argparse.ArgumentParser(description = "Import or export delegations of a meeting.")
+    parser.add_argument('config_uri', help = "Paster ini file")
+    parser.add_argument('meeting', help = "Path to the meeting, like /my-meeting")
+    parser.add_argument('--format', choices = FORMATS, help = "Default is from the file name, or csv")
+    subparsers = parser.add_subparsers(dest = 'command')
+    export_parser = subparsers.add_parser('export', help = "Write all delegations")
+    export_parser.add_argument('--output', help = "File to write to. Default is stdout.")
+    import_parser = subparsers.add_parser('import', help = "Add delegations from a file")
+    import_parser.add_argument('filename', help = "File to read, or - for stdin")
+    import_parser.add_argument('--enable', action = 'store_true',
+                               help = "Make users representatives if they aren't already")
+    import_parser.add_argument('--chunk', type = int, default = 500, help = "Delegations per transaction")
+    import_parser.add_argument('--dry-run', action = 'store_true', help = "Only validate the file")
+    args = parser.parse_args(argv[1:])
+    env = bootstrap(args.config_uri)
+    try:
+        meeting = find_resource(env['root'], args.meeting)
+        if args.command == 'export':
+            format = _guess_format(args.output, args.format)
+            stream = args.output and open(args.output, 'w') or sys.stdout
+            try:
+                export_delegations(meeting, stream, format)
+            finally:
+                if stream is not sys.stdout:
+                    stream.close()
+            return 0
+        format = _guess_format(args.filename, args.format)
+        stream = args.filename == '-' and sys.stdin or open(args.filename)
+        try:
+            rows = READERS[format](stream)
+            if args.dry_run:
+                pairs, errors = validate(IRepresentatives(meeting), rows, enable = args.enable)
+            else:
+                pairs, errors = import_delegations(meeting, rows, enable = args.enable, chunk_size = args.chunk,
+                                                   request = env['request'])
+        except ValueError as exc:
+            print(exc)
+            return 1
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        for (line, message) in errors:
+            print("Line %s: %s" % (line, message))
+        if errors:
+            print("Nothing was stored")
+            return 1
+        print("%s %s delegations" % (args.dry_run and "Validated" or "Stored", len(pairs)))
+        return 0
+    finally:
+        env['closer']()
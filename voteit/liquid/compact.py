@@ -0,0 +1,294 @@
+""" Representatives stored with integer ids.
+
+    Userids are interned to integers per meeting, and the delegations are kept in
+    IOBTree/IIBTree/IITreeSet structures. Userids are only used at the
+    IRepresentatives API. The few delegations that expire are indexed by userid.
+    Enable with 'voteit.liquid.storage = compact'.
+    Not available for the 'chained' type.
+
+    The storage is separate from the default one, so switching an existing site
+    means exporting and importing the delegations.
+"""
+from random import randint
+
+from BTrees.IIBTree import IIBTree
+from BTrees.IIBTree import IITreeSet
+from BTrees.IOBTree import IOBTree
+from BTrees.Length import Length
+from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from persistent import Persistent
+from voteit.core.models.interfaces import IMeeting
+from zope.component import adapter
+from zope.event import notify
+from zope.interface import implementer
+
+from voteit.liquid.events import DelegationWillBeDisabled
+from voteit.liquid.events import RepresentativeEnabled
+from voteit.liquid.instrumentation import instrumented
+from voteit.liquid.interfaces import IRepresentatives
+from voteit.liquid.models import DANGLING_REVERSE
+from voteit.liquid.models import DUPLICATE_DELEGATOR
+from voteit.liquid.models import MISSING_REVERSE
+from voteit.liquid.models import Representatives
+
+
+#Largest key of the 32 bit integer BTrees
+MAX_ID = 2 ** 31 - 1
+
+
+@implementer(IRepresentatives)
+@adapter(IMeeting)
+class CompactRepresentatives(Representatives):
+    """ Same as Representatives, but stores integer ids instead of userids. """
+    storage = (('__representatives_compact_ids__', OIBTree),
+               ('__representatives_compact_userids__', IOBTree),
+               ('__representatives_compact_data__', IOBTree),
+               ('__representatives_compact_reverse__', IIBTree),
+               ('__representatives_compact_counts__', IOBTree),
+               ('__representatives_compact_total__', Length),
+               ('__representatives_compact_version__', Length),
+               ('__representatives_compact_shared__', IITreeSet),
+               ('__representatives_compact_expires__', OOBTree),
+               ('__representatives_compact_expiry__', OOTreeSet),)
+
+    @property
+    def ids_data(self):
+        """ Userid to integer id. Ids are never reused. """
+        return self._storage('__representatives_compact_ids__')
+
+    @property
+    def userids_data(self):
+        """ Integer id to userid. """
+        return self._storage('__representatives_compact_userids__')
+
+    @property
+    def data(self):
+        """ Id of the representative to an IITreeSet with the ids of their delegators. """
+        return self._storage('__representatives_compact_data__')
+
+    @property
+    def reverse_data(self):
+        """ Id of the delegator to id of the representative. """
+        return self._storage('__representatives_compact_reverse__')
+
+    @property
+    def counts_data(self):
+        return self._storage('__representatives_compact_counts__')
+
+    @property
+    def total_data(self):
+        return self._storage('__representatives_compact_total__')
+
+    @property
+    def version_data(self):
+        return self._storage('__representatives_compact_version__')
+
+    @property
+    def shared_data(self):
+        return self._storage('__representatives_compact_shared__')
+
+    @property
+    def expires_data(self):
+        return self._storage('__representatives_compact_expires__')
+
+    @property
+    def expiry_data(self):
+        return self._storage('__representatives_compact_expiry__')
+
+    _nextid = None
+
+    def _id(self, userid):
+        return self.ids_data.get(userid, None)
+
+    def _intern(self, userid):
+        """ Id of userid, assigning a new one if needed. """
+        id = self.ids_data.get(userid, None)
+        if id is None:
+            #Like zope.intid: start somewhere random, so two transactions adding users
+            #don't pick the same id and conflict, then count up from there
+            userids = self.userids_data
+            id = self._nextid
+            while id is None or id > MAX_ID or id in userids:
+                id = randint(1, MAX_ID)
+            self._nextid = id + 1
+            userids[id] = userid
+            self.ids_data[userid] = id
+        return id
+
+    def _userids(self, ids):
+        userids = self.userids_data
+        return tuple(sorted([userids[id] for id in ids]))
+
+    @instrumented('representatives.enable_representative')
+    def enable_representative(self, key):
+        if key not in self:
+            self.init_storage()
+            self.release(key)
+            key_id = self._intern(key)
+            self.data[key_id] = IITreeSet()
+            self._add_counters(key_id)
+            self.version_data.change(1)
+            event = RepresentativeEnabled(self.context, representative = key)
+            notify(event)
+
+    def _representative(self, key):
+        id = self._id(key)
+        if id is None or id not in self.reverse_data:
+            return None
+        return self.userids_data[self.reverse_data[id]]
+
+    def _counter(self, key):
+        id = self._id(key)
+        return id is not None and self.counts_data.get(id, None) or None
+
+    def snapshot(self):
+        self.init_storage()
+        self.shared_data.update(self.data.keys())
+        snapshot = CompactSnapshot(self.data, self.ids_data, self.userids_data, self.version())
+        expired = set([self._id(x) for x in self._expired_keys()])
+        for key_id in set([self.reverse_data[id] for id in expired]):
+            snapshot.data[key_id] = IITreeSet([id for id in self.data[key_id] if id not in expired])
+        return snapshot
+
+    @instrumented('representatives.release')
+    def release(self, key):
+        representative = self._representative(key)
+        if representative is not None:
+            event = DelegationWillBeDisabled(self.context, representative = representative, delegator = key)
+            notify(event)
+            self._unlink(key)
+
+    def _link(self, key, item):
+        self.init_storage()
+        key_id = self._intern(key)
+        item_id = self._intern(item)
+        self._delegators(key_id).insert(item_id)
+        self.reverse_data[item_id] = key_id
+        self.counts_data[key_id].change(1)
+        self.total_data.change(1)
+        self.version_data.change(1)
+
+    def _unlink(self, item):
+        item_id = self.ids_data[item]
+        key_id = self.reverse_data[item_id]
+        self._delegators(key_id).remove(item_id)
+        del self.reverse_data[item_id]
+        self._forget_expiry(item)
+        self.counts_data[key_id].change(-1)
+        self.total_data.change(-1)
+        self.version_data.change(1)
+
+    def _delegators(self, key_id):
+        if key_id in self.shared_data:
+            self.data[key_id] = IITreeSet(self.data[key_id])
+            self.shared_data.remove(key_id)
+        return self.data[key_id]
+
+    def __setitem__(self, key, item):
+        self.init_storage()
+        if key in self:
+            for v in self._all_delegators(key):
+                self._unlink(v)
+        else:
+            key_id = self._intern(key)
+            self.data[key_id] = IITreeSet()
+            self._add_counters(key_id)
+            self.version_data.change(1)
+        for v in item:
+            if self._representative(v) is not None:
+                self._unlink(v)
+            self._link(key, v)
+
+    def __delitem__(self, key):
+        for v in self._all_delegators(key):
+            self._unlink(v)
+        key_id = self.ids_data[key]
+        del self.data[key_id]
+        self._remove_counters(key_id)
+        if key_id in self.shared_data:
+            self.shared_data.remove(key_id)
+        self.version_data.change(1)
+
+    def format_problem(self, problem):
+        kind, representative, delegator, found, expected = problem
+        if kind in (DANGLING_REVERSE, MISSING_REVERSE, DUPLICATE_DELEGATOR):
+            found, expected = self._userid_or_id(found), self._userid_or_id(expected)
+        problem = (kind, self._userid_or_id(representative), self._userid_or_id(delegator), found, expected)
+        return super(CompactRepresentatives, self).format_problem(problem)
+
+    def _userid_or_id(self, id):
+        if not isinstance(id, int):
+            #None, or a userid from the expiry indexes
+            return id
+        return self.userids_data.get(id, id)
+
+    def _all_delegators(self, key):
+        id = self._id(key)
+        if id is None or id not in self.data:
+            raise KeyError(key)
+        return self._userids(self.data[id])
+
+    def __len__(self): return len(self.data)
+    def keys(self, min = None, max = None, excludemin = False, excludemax = False):
+        data = self.data
+        items = self.ids_data.items(min, max, excludemin = excludemin, excludemax = excludemax)
+        return (userid for (userid, id) in items if id in data)
+    def items(self): return ((userid, self[userid]) for userid in self.keys())
+    def values(self): return (self[userid] for userid in self.keys())
+    def __contains__(self, key):
+        id = self._id(key)
+        return id is not None and id in self.data
+    def __iter__(self):
+        return iter(self.keys())
+
+
+class CompactSnapshot(Persistent):
+    """ Read-only copy of CompactRepresentatives. The sets of delegators and
+        the id mappings are shared with the live storage.
+    """
+
+    def __init__(self, data, ids, userids, version):
+        self.data = IOBTree(data)
+        self.ids = ids
+        self.userids = userids
+        self.version = version
+
+    def _userids(self, ids):
+        userids = self.userids
+        return tuple(sorted([userids[id] for id in ids]))
+
+    def represented_by(self, key):
+        try:
+            reverse = self._v_reverse
+        except AttributeError:
+            reverse = self._v_reverse = {}
+            for (representative, delegators) in self.data.items():
+                for delegator in delegators:
+                    reverse[delegator] = representative
+        representative = reverse.get(self.ids.get(key, None), None)
+        if representative is not None:
+            return self.userids[representative]
+
+    def count(self, key):
+        if key not in self:
+            return 0
+        return len(self.data[self.ids[key]])
+
+    def __len__(self): return len(self.data)
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self._userids(self.data[self.ids[key]])
+    def keys(self): return self._userids(self.data.keys())
+    def items(self): return [(userid, self[userid]) for userid in self.keys()]
+    def get(self, key, failobj=None):
+        if key not in self:
+            return failobj
+        return self[key]
+    def __contains__(self, key):
+        id = self.ids.get(key, None)
+        return id is not None and id in self.data
+    def __iter__(self):
+        return iter(self.keys())
@@ -0,0 +1,154 @@
+""" Deferred propagation of votes.
+
+    When 'voteit.liquid.deferred' is true, handle_votes won't adjust the votes of
+    delegators within the representative's request. Instead a job is added to a queue
+    stored on the site root, and the worker (voteit_liquid_worker) adjusts the votes
+    in chunked transactions.
+"""
+import argparse
+import sys
+import time
+
+from BTrees.OOBTree import OOBTree
+from persistent import Persistent
+from pyramid.paster import bootstrap
+from pyramid.settings import asbool
+from pyramid.traversal import find_resource
+from pyramid.traversal import find_root
+from pyramid.traversal import resource_path
+from transaction.interfaces import TransientError
+import transaction
+
+from voteit.liquid import logger
+from voteit.liquid.log import LazyPath
+
+
+class PropagationQueue(Persistent):
+    """ Jobs to propagate votes from representatives.
+        Each job is a tuple of poll path, name of the vote and the voter.
+        The same job is only queued once until it has been processed.
+    """
+
+    def __init__(self):
+        self.jobs = OOBTree()
+        self.pending = OOBTree()
+
+    def add(self, poll_path, vote_name, voter):
+        job = (poll_path, vote_name, voter)
+        if job in self.pending:
+            return False
+        key = (time.time(), poll_path, vote_name)
+        self.jobs[key] = job
+        self.pending[job] = key
+        return True
+
+    def pop(self, limit):
+        """ Remove and return at most limit jobs, oldest first. """
+        jobs = []
+        for key in tuple(self.jobs.keys()[:limit]):
+            job = self.jobs.pop(key)
+            del self.pending[job]
+            jobs.append(job)
+        return jobs
+
+    def __len__(self):
+        return len(self.jobs)
+
+
+def is_deferred(registry):
+    return asbool(registry.settings.get('voteit.liquid.deferred', False))
+
+
+def get_queue(root, create = True):
+    queue = getattr(root, '__liquid_queue__', None)
+    if queue is None and create:
+        root.__liquid_queue__ = queue = PropagationQueue()
+    return queue
+
+
+def enqueue(vote, voter):
+    """ Queue propagation of vote, cast by voter. """
+    poll = vote.__parent__
+    if get_queue(find_root(vote)).add(resource_path(poll), vote.__name__, voter):
+        logger.debug("Queued propagation of %s by %r", LazyPath(vote), voter)
+
+
+def process_job(root, registry, job):
+    #models imports this module
+    from voteit.liquid.models import get_liquid_voter_factory
+    poll_path, vote_name, voter = job
+    try:
+        poll = find_resource(root, poll_path)
+    except KeyError:
+        logger.info("Poll %r doesn't exist any longer" % poll_path)
+        return
+    if poll.get_workflow_state() != 'ongoing':
+        logger.info("Poll %r isn't ongoing, won't propagate" % poll_path)
+        return
+    vote = poll.get(vote_name, None)
+    if vote is None:
+        logger.info("Vote %r in %r was removed before it was propagated" % (vote_name, poll_path))
+        return
+    factory = get_liquid_voter_factory(registry)
+    if factory is None:
+        logger.warn("No liquid voter for 'voteit.liquid.type', won't propagate %r" % vote_name)
+        return
+    factory(vote)(voter)
+
+
+def process_queue(root, registry, request, chunk_size = 100, retries = 5, tm = transaction.manager):
+    """ Process all queued jobs, chunk_size jobs per transaction.
+        Transactions failing due to conflicts are retried. Jobs failing with
+        any other error are logged and dropped, since they'd fail again and keep
+        the rest of the queue waiting. Returns the number of processed jobs.
+    """
+    processed = 0
+    while True:
+        for attempt in tm.attempts(retries):
+            with attempt:
+                request._liquid_authorized = {}
+                queue = get_queue(root, create = False)
+                jobs = queue and queue.pop(chunk_size) or ()
+                for job in jobs:
+                    savepoint = tm.savepoint()
+                    try:
+                        process_job(root, registry, job)
+                    except TransientError:
+                        raise
+                    except Exception:
+                        savepoint.rollback()
+                        logger.exception("Dropped job %r, it failed with an error" % (job,))
+        if not jobs:
+            return processed
+        processed += len(jobs)
+        logger.info("Processed %s jobs" % processed)
+
+
+def main(argv = sys.argv):
+    parser = argparse.ArgumentParser(description = "Propagate queued votes from representatives.")
+    parser.add_argument('config_uri', help = "Paster ini file")
+    parser.add_argument('--filestorage', help = "Use this Data.fs instead of the database from the ini file")
+    parser.add_argument('--chunk', type = int, default = 100, help = "Jobs per transaction")
+    parser.add_argument('--retries', type = int, default = 5, help = "Attempts for each transaction")
+    parser.add_argument('--interval', type = float, default = 0,
+                        help = "Keep checking the queue with this many seconds in between. Default is to run once.")
+    args = parser.parse_args(argv[1:])
+    env = bootstrap(args.config_uri)
+    root = env['root']
+    if args.filestorage:
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        db = DB(FileStorage(args.filestorage))
+        root = db.open().root()['app_root']
+    try:
+        while True:
+            processed = process_queue(root, env['registry'], env['request'],
+                                      chunk_size = args.chunk, retries = args.retries)
+            if processed:
+                print("Propagated %s votes" % processed)
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+            root._p_jar.sync()
+    finally:
+        env['closer']()
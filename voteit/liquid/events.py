@@ -5,8 +5,11 @@ from voteit.liquid.interfaces import IRepresentativeEnabled
 from voteit.liquid.interfaces import IRepresentativeWillBeDisabled
 from voteit.liquid.interfaces import IDelegationEnabled
 from voteit.liquid.interfaces import IDelegationWillBeDisabled
+from voteit.liquid.interfaces import IDelegationsEnabled
+from voteit.liquid.interfaces import IDelegationsReleased
 from voteit.liquid.interfaces import IRepresentativeAddedVote
 from voteit.liquid.interfaces import IRepresentativeChangedVote
+from voteit.liquid.interfaces import IRepresentativeVotesPropagated
 
 
 @implementer(IRepresentationEvent)
@@ -39,6 +42,21 @@ class DelegationWillBeDisabled(RepresentationEvent):
     """ See voteit.liquid.interfaces.IDelegationWillBeDisabled """
 
 
+@implementer(IDelegationsEnabled)
+class DelegationsEnabled(RepresentationEvent):
+    """ See voteit.liquid.interfaces.IDelegationsEnabled """
+
+
+@implementer(IDelegationsReleased)
+class DelegationsReleased(RepresentationEvent):
+    """ See voteit.liquid.interfaces.IDelegationsReleased """
+
+
+@implementer(IRepresentativeVotesPropagated)
+class RepresentativeVotesPropagated(RepresentationEvent):
+    """ See voteit.liquid.interfaces.IRepresentativeVotesPropagated """
+
+
 @implementer(IRepresentativeAddedVote)
 class RepresentativeAddedVote(RepresentationEvent):
     """ See voteit.liquid.interfaces.IRepresentativeAddedVote """
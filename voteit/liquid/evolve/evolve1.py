@@ -0,0 +1,20 @@
+from BTrees.OOBTree import OOTreeSet
+from voteit.core.models.interfaces import IMeeting
+
+from voteit.liquid import logger
+
+
+def evolve(root):
+    """ Convert the tuple of delegators stored for each representative
+        into an OOTreeSet. The OOBTree itself is kept and changed in place.
+    """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        data = getattr(meeting, '__representatives_data__', None)
+        if data is None:
+            continue
+        for (representative, delegators) in list(data.items()):
+            if not isinstance(delegators, OOTreeSet):
+                data[representative] = OOTreeSet(delegators)
+        logger.info("Converted %s representatives in %r" % (len(data), meeting.__name__))
@@ -0,0 +1,24 @@
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from voteit.core.models.interfaces import IMeeting
+
+from voteit.liquid import logger
+
+
+def evolve(root):
+    """ Add the counters for number of delegators per representative
+        and number of delegations in the meeting.
+    """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        data = getattr(meeting, '__representatives_data__', None)
+        if data is None:
+            continue
+        meeting.__representatives_counts__ = counts = OOBTree()
+        total = 0
+        for (representative, delegators) in data.items():
+            counts[representative] = Length(len(delegators))
+            total += len(delegators)
+        meeting.__representatives_total__ = Length(total)
+        logger.info("Counted %s delegations in %r" % (total, meeting.__name__))
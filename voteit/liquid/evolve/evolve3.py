@@ -0,0 +1,21 @@
+from BTrees.OOBTree import OOBTree
+from voteit.core.models.interfaces import IAgendaItem
+from voteit.core.models.interfaces import IMeeting
+from voteit.core.models.interfaces import IPoll
+
+from voteit.liquid import logger
+
+
+def evolve(root):
+    """ Index ongoing polls in each meeting. """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        meeting.__liquid_open_polls__ = polls = OOBTree()
+        for ai in meeting.values():
+            if not IAgendaItem.providedBy(ai):
+                continue
+            for poll in ai.values():
+                if IPoll.providedBy(poll) and poll.get_workflow_state() == 'ongoing':
+                    polls[poll.uid] = poll
+        logger.info("Found %s ongoing polls in %r" % (len(polls), meeting.__name__))
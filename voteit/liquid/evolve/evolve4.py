@@ -0,0 +1,39 @@
+from BTrees.Length import Length
+from voteit.core.models.interfaces import IMeeting
+
+from voteit.liquid import logger
+
+
+#(delegators, counters) for the default and the compact storage
+STORAGES = (('__representatives_data__', '__representatives_counts__'),
+            ('__representatives_compact_data__', '__representatives_compact_counts__'))
+
+
+def evolve(root):
+    """ Add counters for representatives nobody has delegated to yet, and store
+        the weights of the 'chained' type as Length objects. Both are created
+        when someone becomes a representative now.
+    """
+    for meeting in root.values():
+        if not IMeeting.providedBy(meeting):
+            continue
+        for (data_name, counts_name) in STORAGES:
+            data = getattr(meeting, data_name, None)
+            counts = getattr(meeting, counts_name, None)
+            if data is None or counts is None:
+                continue
+            added = 0
+            for (representative, delegators) in data.items():
+                if representative not in counts:
+                    counts[representative] = Length(len(delegators))
+                    added += 1
+            logger.info("Added %s counters in %r" % (added, meeting.__name__))
+        data = getattr(meeting, '__representatives_data__', None)
+        weights = getattr(meeting, '__representatives_weight__', None)
+        if data is None or weights is None:
+            continue
+        for representative in data.keys():
+            weight = weights.get(representative, 0)
+            if not isinstance(weight, Length):
+                weights[representative] = Length(weight)
+        logger.info("Converted %s weights in %r" % (len(data), meeting.__name__))
@@ -0,0 +1,68 @@
+""" Release expired delegations.
+
+    Delegations stored with an expiry are left out by IRepresentatives as soon as they
+    expire, but they're only released by this script. Releasing them removes the
+    votes representatives added for the delegators in ongoing polls.
+
+    voteit_liquid_expire etc/production.ini --interval 60
+"""
+import argparse
+import sys
+import time
+
+from pyramid.paster import bootstrap
+from pyramid.traversal import resource_path
+from voteit.core.models.interfaces import IMeeting
+import transaction
+
+from voteit.liquid import logger
+from voteit.liquid.interfaces import IRepresentatives
+
+
+def meetings(root):
+    return [obj for obj in root.values() if IMeeting.providedBy(obj)]
+
+
+def release_expired(meeting, now = None, chunk_size = 500, retries = 5, request = None, tm = transaction.manager):
+    """ Release expired delegations in meeting, chunk_size per transaction.
+        Returns the number of released delegations.
+    """
+    if now is None:
+        now = time.time()
+    released = 0
+    while True:
+        for attempt in tm.attempts(retries):
+            with attempt:
+                if request is not None:
+                    request._liquid_authorized = {}
+                delegations = IRepresentatives(meeting).release_expired(now = now, limit = chunk_size)
+        if not delegations:
+            return released
+        released += len(delegations)
+        logger.info("Released %s expired delegations in %s", released, resource_path(meeting))
+
+
+def main(argv = sys.argv):
+    parser = argparse.ArgumentParser(description = "Release expired delegations in all meetings.")
+    parser.add_argument('config_uri', help = "Paster ini file")
+    parser.add_argument('--chunk', type = int, default = 500, help = "Delegations per transaction")
+    parser.add_argument('--retries', type = int, default = 5, help = "Attempts for each transaction")
+    parser.add_argument('--interval', type = float, default = 0,
+                        help = "Keep checking with this many seconds in between. Default is to run once.")
+    args = parser.parse_args(argv[1:])
+    env = bootstrap(args.config_uri)
+    root = env['root']
+    try:
+        while True:
+            for meeting in meetings(root):
+                released = release_expired(meeting, chunk_size = args.chunk, retries = args.retries,
+                                           request = env['request'])
+                if released:
+                    print("Released %s delegations in %s" % (released, resource_path(meeting)))
+            transaction.abort()
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+            root._p_jar.sync()
+    finally:
+        env['closer']()
@@ -0,0 +1,121 @@
+""" Timing and counters for the propagation hot path.
+
+    Enabled by 'voteit.liquid.instrumentation':
+
+    log
+        Report through the 'voteit.liquid.metrics' logger.
+    memory
+        Keep totals in a MemoryMetrics object, see get_metrics.
+    a dotted name
+        A callable returning an object implementing ILiquidMetrics,
+        for instance to send the numbers to statsd.
+
+    When it's not set, nothing is measured.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from logging import getLogger
+from time import time
+
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_registry
+from zope.interface import implementer
+
+from voteit.liquid.interfaces import ILiquidMetrics
+from voteit.liquid.interfaces import IRepresentationEvent
+
+
+metrics_logger = getLogger('voteit.liquid.metrics')
+
+
+@implementer(ILiquidMetrics)
+class LoggingMetrics(object):
+    """ Log every timing and counter. """
+
+    def __init__(self, logger = metrics_logger):
+        self.logger = logger
+
+    def timing(self, name, seconds):
+        self.logger.info("%s took %.2f ms", name, seconds * 1000)
+
+    def incr(self, name, value = 1):
+        if value:
+            self.logger.info("%s +%s", name, value)
+
+
+@implementer(ILiquidMetrics)
+class MemoryMetrics(object):
+    """ Totals since start, or since clear was called.
+        timings is name to (calls, total seconds, max seconds).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def timing(self, name, seconds):
+        calls, total, longest = self.timings.get(name, (0, 0.0, 0.0))
+        self.timings[name] = (calls + 1, total + seconds, max(longest, seconds))
+
+    def incr(self, name, value = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def clear(self):
+        self.timings = {}
+        self.counters = {}
+
+
+def get_metrics(registry = None):
+    """ The configured metrics hook, or None if instrumentation isn't enabled. """
+    if registry is None:
+        registry = get_current_registry()
+    return registry.queryUtility(ILiquidMetrics)
+
+
+@contextmanager
+def timed(name, registry = None):
+    metrics = get_metrics(registry)
+    if metrics is None:
+        yield
+        return
+    start = time()
+    try:
+        yield
+    finally:
+        metrics.timing(name, time() - start)
+
+
+def instrumented(name):
+    """ Decorator that times each call when instrumentation is enabled. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            metrics = get_metrics()
+            if metrics is None:
+                return func(*args, **kw)
+            start = time()
+            try:
+                return func(*args, **kw)
+            finally:
+                metrics.timing(name, time() - start)
+        return wrapper
+    return decorator
+
+
+def count_event(event):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.incr('events.%s' % event.__class__.__name__)
+
+
+def includeme(config):
+    value = config.registry.settings.get('voteit.liquid.instrumentation', '')
+    if not value or value.lower() in ('false', 'off', 'no', '0'):
+        return
+    if value == 'memory':
+        metrics = MemoryMetrics()
+    elif value == 'log' or asbool(value):
+        metrics = LoggingMetrics()
+    else:
+        metrics = config.maybe_dotted(value)()
+    config.registry.registerUtility(metrics, ILiquidMetrics)
+    config.add_subscriber(count_event, IRepresentationEvent)
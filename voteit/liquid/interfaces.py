@@ -19,17 +19,92 @@ class IRepresentatives(Interface):
             See the release method too.
             
             Sends the event IRepresentativeDisabled before it's actually removed,
-            to allow for cleanup or other notifications.
+            to allow for cleanup or other notifications. The delegators are released
+            with release_many.
         """
 
-    def represent(key, item):
+    def represent(key, item, expires = None):
         """ key should represent item. Makes sure item isn't represented by someone else.
+            If expires is a timestamp or datetime, the delegation ends then.
         
             Sends the event IDelegationEnabled when a link is established.
         """
 
+    def can_represent(key, item):
+        """ True if key is allowed to represent item. """
+
     def represented_by(key):
-        """ Returns id of representative or None. """
+        """ Returns id of representative or None. Expired delegations are ignored
+            even before they're released.
+        """
+
+    def expires(key):
+        """ Timestamp when the delegation of key expires, or None. """
+
+    def count(key):
+        """ Number of delegators key represents. Doesn't load the delegators. """
+
+    def total_delegations():
+        """ Number of delegations within the meeting. """
+
+    def weight(key):
+        """ Number of votes key casts for others. Includes everyone further down
+            a chain of representatives for the chained type.
+        """
+
+    def ranked():
+        """ Sorted tuple of (-weight, representative), heaviest first. """
+
+    def version():
+        """ A number that increases whenever representatives or delegations change. """
+
+    def cache_key():
+        """ Changes whenever version does, and when a delegation expires. """
+
+    def snapshot():
+        """ A read-only copy of the current delegations. Unchanged sets of delegators
+            are shared with the live storage rather than copied.
+        """
+
+    def keys(min = None, max = None, excludemin = False, excludemax = False):
+        """ Userids of the representatives, sorted. Optionally within a range,
+            like keys on a BTree.
+        """
+
+    def delegations():
+        """ Iterator of (representative, delegator) for every delegation.
+            Doesn't load everything at once.
+        """
+
+    def represent_many(pairs, expires = None):
+        """ Store all (representative, delegator) pairs. Delegators are released from their
+            current representatives first. Sends IDelegationsReleased and IDelegationsEnabled
+            once. Events for each delegator are only sent if 'voteit.liquid.item_events' is true.
+            expires applies to all of them, like for represent.
+        """
+
+    def release_many(keys):
+        """ Release all keys. Sends IDelegationsReleased once, and IDelegationWillBeDisabled
+            for each delegator if 'voteit.liquid.item_events' is true.
+            Returns a tuple of (former representative, delegator).
+        """
+
+    def release_expired(now = None, limit = None):
+        """ Release delegations that expired before now, at most limit of them.
+            Works like release_many and returns the same.
+        """
+
+    def verify(gc_interval = 10000):
+        """ Check that the indexes agree with each other. Yields a tuple of
+            (kind, representative, delegator, found, expected) for each problem.
+            Reads the indexes one record at a time.
+        """
+
+    def repair(problems):
+        """ Fix problems from verify. Returns the number of changes made. """
+
+    def format_problem(problem):
+        """ A problem from verify as readable text. """
 
     def release(key):
         """ Releases key so they're not represented by anyone.
@@ -46,6 +121,7 @@ class ILiquidVoter(Interface):
     title = Attribute("Title")
     description = Attribute("Description")
     name = Attribute("Adapter name - register the adapter with this name.")
+    transitive = Attribute("True if votes flow along chains of representatives.")
     meeting = Attribute("Meeting object, looked up from context")
     poll = Attribute("Poll object, looked up from context")
     repr = Attribute("The representatives adapter on the current meeting context")
@@ -61,9 +137,99 @@ class ILiquidVoter(Interface):
             to look like the adapted context.
             
             Sends the event IRepresentativeAddedVote
-            or IRepresentativeChangedVote.
+            or IRepresentativeChangedVote. Votes with the same vote data
+            are left untouched.
         """
 
+    def propagate_to(delegator):
+        """ Adjust the vote of delegator, who just picked a representative,
+            to look like the adapted context. Called for ongoing polls
+            where the representative has a vote.
+        """
+
+    def propagate_to_many(delegators):
+        """ Same as propagate_to, for several delegators who picked the same
+            representative, with the votes adjusted in one pass.
+        """
+
+    def adjust_votes(userids):
+        """ Adjust all votes from userids in one pass.
+            Votes added or changed here won't trigger another propagation.
+            Returns the number of votes added, changed, unchanged or skipped.
+        """
+
+
+class IProxyVotes(Interface):
+    """ An adapter for polls that keeps track of votes added by representatives.
+        Kept up to date by the ILiquidVoter adapters and when votes are removed.
+    """
+
+    def add(delegator, representative):
+        """ The vote of delegator was added or changed by representative. """
+
+    def remove(delegator):
+        """ The vote of delegator is no longer a vote from a representative. """
+
+    def representative_for(delegator):
+        """ Userid of the representative who added the vote of delegator, or None. """
+
+    def cast_by(representative):
+        """ Userids of the delegators representative added votes for. """
+
+    def __contains__(delegator):
+        """ True if the vote of delegator was added by a representative. """
+
+    def __len__():
+        """ Number of votes added by representatives. """
+
+    def items():
+        """ (delegator, representative) for all votes added by representatives. """
+
+
+class ILiquidTally(Interface):
+    """ An adapter for polls that counts votes according to the representatives.
+    """
+    meeting = Attribute("Meeting object, looked up from context")
+    repr = Attribute("The representatives adapter on the current meeting context")
+
+    def votes():
+        """ Iterator of all votes within the poll. """
+
+    def weights():
+        """ Dict-like of userid to the number of votes a vote from that user counts as.
+            Delegators count if they're allowed to vote in the poll and haven't voted.
+            Once the poll has been closed, the weights stored then are returned.
+        """
+
+    def ballots(weights = None):
+        """ Weighted ballots, formatted as the poll's ballots attribute:
+            a tuple of (vote_data, count).
+        """
+
+    def close():
+        """ Store the weights and set the weighted ballots on the poll.
+            Called just before the poll closes, so the poll plugin handles
+            the weighted ballots.
+        """
+
+    def handle_close():
+        """ Called after the poll has closed. If closing it replaced the weighted
+            ballots, they're set again from the stored weights and the poll plugin
+            counts them again. Returns True if that happened.
+        """
+
+
+class ILiquidMetrics(Interface):
+    """ Utility that receives timings and counters from the propagation
+        hot path when 'voteit.liquid.instrumentation' is set.
+    """
+
+    def timing(name, seconds):
+        """ name took seconds to run. """
+
+    def incr(name, value = 1):
+        """ Increase the counter name by value. """
+
 
 class IRepresentationEvent(Interface):
     """ Raised for any significant things that might go on
@@ -92,14 +258,38 @@ class IDelegationEnabled(IRepresentationEvent):
 
 class IDelegationWillBeDisabled(IRepresentationEvent):
     """ The delegator has chosen to either take back their vote or give it to someone else.
+        Bulk operations like disable_representative send IDelegationsReleased instead,
+        unless 'voteit.liquid.item_events' is true.
+    """
+
+class IDelegationsEnabled(IRepresentationEvent):
+    """ Several delegators picked representatives at once, see IRepresentatives.represent_many.
+        Sent instead of one IDelegationEnabled per delegator.
+    """
+    delegations = Attribute("Tuple of (representative, delegator)")
+
+class IDelegationsReleased(IRepresentationEvent):
+    """ Several delegators were released at once, see IRepresentatives.release_many.
+        Sent after the delegations were removed, instead of one IDelegationWillBeDisabled
+        per delegator.
+    """
+    delegations = Attribute("Tuple of (former representative, delegator)")
+
+class IRepresentativeVotesPropagated(IRepresentationEvent):
+    """ When votes for delegators were added or changed from a representative's vote.
+        The context here is the representative's vote. Sent once for each propagation.
     """
+    added = Attribute("Tuple of userids of the delegators who got a new vote")
+    changed = Attribute("Tuple of userids of the delegators whose vote was changed")
 
 class IRepresentativeAddedVote(IRepresentationEvent):
     """ When a representative adds a vote for a delegator.
         The context here is the vote object.
+        Only sent when 'voteit.liquid.item_events' is true.
     """
  
 class IRepresentativeChangedVote(IRepresentationEvent):
     """ When a representative changes a vote for a delegator.
         The context here is the vote object.
+        Only sent when 'voteit.liquid.item_events' is true.
     """
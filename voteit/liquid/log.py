@@ -0,0 +1,40 @@
+""" Logging for the propagation path.
+
+    Arguments are only formatted when a record is actually emitted, so resource
+    paths aren't computed unless the level is enabled. Each propagation is logged
+    as one summary record, with the numbers also attached as record.liquid
+    for handlers that want structured data.
+"""
+from logging import INFO
+
+from pyramid.traversal import resource_path
+
+from voteit.liquid import logger
+
+
+class LazyPath(object):
+    """ Resource path, looked up when the log record is formatted. """
+    __slots__ = ('resource',)
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def __str__(self):
+        return resource_path(self.resource)
+
+    def __repr__(self):
+        return repr(resource_path(self.resource))
+
+
+def log_propagation(vote, representative, results, seconds):
+    """ One record for a propagation. results is the dict from LiquidVoter.adjust_votes. """
+    if not logger.isEnabledFor(INFO):
+        return
+    data = dict(results)
+    data.update({'vote': resource_path(vote),
+                 'representative': representative,
+                 'delegators': sum(results.values()),
+                 'ms': round(seconds * 1000, 2)})
+    logger.info("Propagated %(vote)s from %(representative)s to %(delegators)s delegators in %(ms)s ms: "
+                "%(added)s added, %(changed)s changed, %(unchanged)s unchanged, %(own)s voted themselves",
+                data, extra = {'liquid': data})
@@ -1,37 +1,120 @@
+from calendar import timegm
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import datetime
+from hashlib import md5
+from itertools import chain
+from time import time
+
+from BTrees.Length import Length
 from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from arche.events import ObjectUpdatedEvent
+from arche.interfaces import IObjectWillBeRemovedEvent
+from arche.interfaces import IWorkflowAfterTransition
+from arche.interfaces import IWorkflowBeforeTransition
+from persistent import Persistent
 from pyramid.decorator import reify
+from pyramid.exceptions import ConfigurationError
+from pyramid.settings import asbool
 from pyramid.threadlocal import get_current_registry
 from pyramid.threadlocal import get_current_request
 from pyramid.traversal import find_interface
-from pyramid.traversal import resource_path
 from voteit.core.interfaces import IObjectAddedEvent
 from voteit.core.interfaces import IObjectUpdatedEvent
 from voteit.core.models.interfaces import IMeeting
 from voteit.core.models.interfaces import IPoll
 from voteit.core.models.interfaces import IVote
+from voteit.core.models.vote import Vote
 from voteit.core.security import ADD_VOTE
 from voteit.core.security import find_authorized_userids
 from voteit.core.security import ROLE_OWNER
 from zope.component import adapter
+from zope.component.event import objectEventNotify
 from zope.event import notify
 from zope.interface import implementer
 
 from voteit.liquid import _
 from voteit.liquid import logger
+from voteit.liquid.deferred import enqueue
+from voteit.liquid.deferred import is_deferred
 from voteit.liquid.events import DelegationEnabled
 from voteit.liquid.events import DelegationWillBeDisabled
+from voteit.liquid.events import DelegationsEnabled
+from voteit.liquid.events import DelegationsReleased
 from voteit.liquid.events import RepresentativeAddedVote
 from voteit.liquid.events import RepresentativeChangedVote
 from voteit.liquid.events import RepresentativeEnabled
+from voteit.liquid.events import RepresentativeVotesPropagated
 from voteit.liquid.events import RepresentativeWillBeDisabled
+from voteit.liquid.instrumentation import get_metrics
+from voteit.liquid.instrumentation import instrumented
+from voteit.liquid.instrumentation import timed
+from voteit.liquid.interfaces import ILiquidTally
 from voteit.liquid.interfaces import ILiquidVoter
+from voteit.liquid.interfaces import IProxyVotes
 from voteit.liquid.interfaces import IRepresentatives
+from voteit.liquid.log import LazyPath
+from voteit.liquid.log import log_propagation
+
+
+#Inconsistencies reported by Representatives.verify, as
+#(kind, representative, delegator, found, expected)
+DANGLING_REVERSE = 'dangling_reverse'
+MISSING_REVERSE = 'missing_reverse'
+DUPLICATE_DELEGATOR = 'duplicate_delegator'
+WRONG_COUNT = 'wrong_count'
+WRONG_TOTAL = 'wrong_total'
+WRONG_RESOLVED = 'wrong_resolved'
+WRONG_WEIGHT = 'wrong_weight'
+WRONG_EXPIRY = 'wrong_expiry'
+CYCLE = 'cycle'
+
+#Results from LiquidVoter.adjust_vote
+VOTE_ADDED = 'added'
+VOTE_CHANGED = 'changed'
+VOTE_UNCHANGED = 'unchanged'
+VOTE_OWN = 'own'
+
+
+class StorageMixin(object):
+    """ Storage kept as attributes on the adapted context.
+        storage is a tuple of (attribute name, factory).
+    """
+    storage = ()
+
+    def _storage(self, name):
+        """ The stored object, or an empty one that isn't stored.
+            Reading shouldn't write to the context, since two transactions
+            changing the context object itself always conflict.
+        """
+        try:
+            return getattr(self.context, name)
+        except AttributeError:
+            return dict(self.storage)[name]()
+
+    def init_storage(self):
+        """ Store the storage objects on the context if they don't exist.
+            Must be called before anything is changed.
+        """
+        for (name, factory) in self.storage:
+            if not hasattr(self.context, name):
+                setattr(self.context, name, factory())
 
 
 @implementer(IRepresentatives)
 @adapter(IMeeting)
-class Representatives(object):
+class Representatives(StorageMixin):
     """ Handle representatives and who they're representing. """
+    #Attributes on the meeting that hold the storage, and their factories
+    storage = (('__representatives_data__', OOBTree),
+               ('__representatives_data_dev__', OOBTree),
+               ('__representatives_counts__', OOBTree),
+               ('__representatives_total__', Length),
+               ('__representatives_version__', Length),
+               ('__representatives_shared__', OOTreeSet),
+               ('__representatives_expires__', OOBTree),
+               ('__representatives_expiry__', OOTreeSet),)
 
     def __init__(self, context):
         self.context = context
@@ -42,50 +125,176 @@ class Representatives(object):
 
     @property
     def data(self):
-        """ Main storage for data. Don't manipulate this directly. """
-        try:
-            return self.context.__representatives_data__
-        except AttributeError:
-            self.context.__representatives_data__ = data = OOBTree()
-            return data
+        """ Main storage for data. Don't manipulate this directly.
+            Representative to an OOTreeSet of the delegators they represent.
+        """
+        return self._storage('__representatives_data__')
 
     @property
     def reverse_data(self):
         """ Represented to representative key value. """
-        try:
-            return self.context.__representatives_data_dev__
-        except AttributeError:
-            self.context.__representatives_data_dev__ = data = OOBTree()
-            return data
+        return self._storage('__representatives_data_dev__')
 
+    @property
+    def counts_data(self):
+        """ Representative to a Length with the number of delegators. """
+        return self._storage('__representatives_counts__')
+
+    @property
+    def total_data(self):
+        """ Length with the number of delegations in the meeting. """
+        return self._storage('__representatives_total__')
+
+    @property
+    def version_data(self):
+        """ Length that increases whenever anything changes. """
+        return self._storage('__representatives_version__')
+
+    @property
+    def shared_data(self):
+        """ Representatives whose OOTreeSet of delegators is shared with a snapshot. """
+        return self._storage('__representatives_shared__')
+
+    @property
+    def expires_data(self):
+        """ Delegator to the timestamp when their delegation expires. """
+        return self._storage('__representatives_expires__')
+
+    @property
+    def expiry_data(self):
+        """ (timestamp, delegator) for all delegations that expire, in the order they expire. """
+        return self._storage('__representatives_expiry__')
+
+    @instrumented('representatives.enable_representative')
     def enable_representative(self, key):
         if key not in self:
+            self.init_storage()
             self.release(key)
-            self[key] = ()
+            self.data[key] = OOTreeSet()
+            self._add_counters(key)
+            self.version_data.change(1)
             event = RepresentativeEnabled(self.context, representative = key)
             notify(event)
 
+    @instrumented('representatives.disable_representative')
     def disable_representative(self, key):
         if key in self:
             event = RepresentativeWillBeDisabled(self.context, representative = key)
             notify(event)
-            for delegator in self[key]:
-                self.release(delegator)
+            self.release_many(tuple(self._all_delegators(key)))
             del self[key]
 
-    def represent(self, key, item):
+    @instrumented('representatives.represent')
+    def represent(self, key, item, expires = None):
         assert key in self, "%s is not a representative" % key
         assert key != item, "Representative and represented can't be the same"
         self.release(item)
-        representing = list(self[key])
-        representing.append(item)
-        self[key] = representing
+        self._link(key, item)
+        if expires is not None:
+            self._set_expiry(item, expires)
         event = DelegationEnabled(self.context, representative = key, delegator = item)
         notify(event)
 
+    def can_represent(self, key, item):
+        return key in self and key != item and item not in self
+
     def represented_by(self, key):
-        return self.reverse_data.get(key, None)
+        representative = self._representative(key)
+        if representative is not None and self._expired(key):
+            return None
+        return representative
+
+    def expires(self, key):
+        return self.expires_data.get(key, None)
+
+    def count(self, key):
+        counter = self._counter(key)
+        if counter is None:
+            return 0
+        return counter() - self._expired_state()[2].get(key, 0)
+
+    def total_delegations(self):
+        return self.total_data() - len(self._expired_keys())
 
+    def version(self):
+        return self.version_data()
+
+    def cache_key(self):
+        state = self._expired_state()
+        return (state[0][0], len(state[1]))
+
+    def weight(self, key):
+        """ Same as count, since delegators can't be representatives here. """
+        return self.count(key)
+
+    def ranked(self):
+        """ Sorted tuple of (-weight, representative), heaviest first.
+            Weights change with every delegation, and a persistent index sorted by them
+            would make delegations to the same representative conflict. So they're sorted
+            here instead, once per version and connection, and kept on the version counter.
+        """
+        version = self.version_data
+        key = self.cache_key()
+        cached = getattr(version, '_v_ranked', None)
+        if cached is None or cached[0] != key:
+            cached = version._v_ranked = (key, tuple(sorted([(-self.weight(x), x) for x in self.keys()])))
+        return cached[1]
+
+    def snapshot(self):
+        """ Freeze the current delegations. The snapshot shares the sets of delegators
+            with this object, which copies a set the first time it's changed afterwards.
+            Representatives with expired delegations get a copy without them.
+        """
+        self.init_storage()
+        self.shared_data.update(self.data.keys())
+        snapshot = DelegationSnapshot(self.data, self.version())
+        expired = self._expired_keys()
+        for key in set([self._representative(x) for x in expired]):
+            snapshot.data[key] = OOTreeSet([x for x in self.data[key] if x not in expired])
+        return snapshot
+
+    def delegations(self):
+        for (key, delegators) in self.items():
+            for delegator in delegators:
+                yield (key, delegator)
+
+    @instrumented('representatives.represent_many')
+    def represent_many(self, pairs, expires = None):
+        pairs = tuple(pairs)
+        #Release everyone first, so moving delegators around never creates a cycle on the way
+        self.release_many([item for (key, item) in pairs])
+        send_items = item_events()
+        for (key, item) in pairs:
+            assert self.can_represent(key, item), "%s can't represent %s" % (key, item)
+            self._link(key, item)
+            if expires is not None:
+                self._set_expiry(item, expires)
+            if send_items:
+                event = DelegationEnabled(self.context, representative = key, delegator = item)
+                notify(event)
+        if pairs:
+            event = DelegationsEnabled(self.context, delegations = pairs)
+            notify(event)
+
+    @instrumented('representatives.release_many')
+    def release_many(self, keys):
+        released = []
+        send_items = item_events()
+        for key in keys:
+            representative = self._representative(key)
+            if representative is not None:
+                if send_items:
+                    event = DelegationWillBeDisabled(self.context, representative = representative, delegator = key)
+                    notify(event)
+                self._unlink(key)
+                released.append((representative, key))
+        released = tuple(released)
+        if released:
+            event = DelegationsReleased(self.context, delegations = released)
+            notify(event)
+        return released
+
+    @instrumented('representatives.release')
     def release(self, key):
         """ When someone doesn't want to be represented any longer,
             or chooses another representative.
@@ -94,20 +303,290 @@ class Representatives(object):
             representative = self.reverse_data[key]
             event = DelegationWillBeDisabled(self.context, representative = representative, delegator = key)
             notify(event)
-            representing = list(self[representative])
-            representing.remove(key)
-            self[representative] = representing
-            del self.reverse_data[key]
+            self._unlink(key)
+
+    @instrumented('representatives.release_expired')
+    def release_expired(self, now = None, limit = None):
+        """ Release delegations that have expired. Only the expired part of the
+            index is read, so this is cheap when there's nothing to do.
+        """
+        if now is None:
+            now = time()
+        keys = []
+        for (expires, key) in self.expiry_data:
+            if expires > now or (limit is not None and len(keys) >= limit):
+                break
+            keys.append(key)
+        if not keys:
+            return ()
+        return self.release_many(keys)
+
+    def _representative(self, key):
+        """ Representative of key, even if the delegation has expired. """
+        return self.reverse_data.get(key, None)
+
+    def _expired_keys(self, now = None):
+        """ Delegators whose delegation has expired, but hasn't been released yet.
+            Only reads the expired part of the index.
+        """
+        if now is None:
+            return self._expired_state()[1]
+        keys = set()
+        for (expires, key) in self.expiry_data:
+            if expires > now:
+                break
+            keys.add(key)
+        return keys
+
+    def _expired_state(self):
+        """ ((version, next expiry), expired delegators, representative to the number of them).
+            Kept on the version counter until something changes or the next delegation
+            expires, so listings don't read the expired part of the index once per row.
+        """
+        version = self.version_data
+        now = time()
+        cached = getattr(version, '_v_expired', None)
+        if cached is not None:
+            (current, next_expiry) = cached[0]
+            if current == version() and (next_expiry is None or next_expiry > now):
+                return cached
+        keys = set()
+        next_expiry = None
+        for (expires, key) in self.expiry_data:
+            if expires > now:
+                next_expiry = expires
+                break
+            keys.add(key)
+        counts = {}
+        for key in keys:
+            representative = self._representative(key)
+            counts[representative] = counts.get(representative, 0) + 1
+        cached = version._v_expired = ((version(), next_expiry), frozenset(keys), counts)
+        return cached
+
+    def _counter(self, key):
+        """ Length with the number of delegators of key, or None. """
+        return self.counts_data.get(key, None)
+
+    def _add_counters(self, key):
+        """ Counters for a new representative. They're created here rather than on the
+            first delegation, so concurrent delegations to key only change the counters
+            and the changes merge.
+        """
+        self.counts_data[key] = Length()
+
+    def _remove_counters(self, key):
+        if key in self.counts_data:
+            del self.counts_data[key]
+
+    def _all_delegators(self, key):
+        """ Delegators of key, including the ones whose delegation has expired. """
+        return self.data[key]
+
+    def _expired(self, key, now = None):
+        expires = self.expires_data.get(key, None)
+        if expires is None:
+            return False
+        if now is None:
+            now = time()
+        return expires <= now
+
+    def _set_expiry(self, item, expires):
+        self.init_storage()
+        self._forget_expiry(item)
+        expires = to_timestamp(expires)
+        self.expires_data[item] = expires
+        self.expiry_data.insert((expires, item))
+        self.version_data.change(1)
+
+    def _forget_expiry(self, item):
+        expires = self.expires_data.get(item, None)
+        if expires is not None:
+            del self.expires_data[item]
+            self.expiry_data.remove((expires, item))
+
+    def _link(self, key, item):
+        """ Store that key represents item. All changes to the storage pass through
+            _link and _unlink, so subclasses may keep other indexes in sync.
+        """
+        self.init_storage()
+        self._delegators(key).insert(item)
+        self.reverse_data[item] = key
+        self.counts_data[key].change(1)
+        self.total_data.change(1)
+        self.version_data.change(1)
+
+    def _unlink(self, item):
+        key = self.reverse_data[item]
+        self._delegators(key).remove(item)
+        del self.reverse_data[item]
+        self._forget_expiry(item)
+        self.counts_data[key].change(-1)
+        self.total_data.change(-1)
+        self.version_data.change(1)
+
+    def verify(self, gc_interval = 10000):
+        """ Yields (kind, representative, delegator, found, expected) for everything
+            in the indexes that doesn't match. Each index is read once, in order, and the
+            object cache is garbage collected every gc_interval records, so memory use
+            doesn't grow with the size of the meeting.
+        """
+        data = self.data
+        reverse_data = self.reverse_data
+        counts_data = self.counts_data
+        visited = 0
+        #Delegators pointing to a representative who doesn't list them
+        for (delegator, representative) in reverse_data.items():
+            if delegator not in data.get(representative, ()):
+                yield (DANGLING_REVERSE, representative, delegator, representative, None)
+            visited = self._gc(visited, gc_interval)
+        #Delegators listed by a representative they don't point to
+        total = 0
+        for (representative, delegators) in data.items():
+            count = 0
+            for delegator in delegators:
+                current = reverse_data.get(delegator, None)
+                if current == representative:
+                    count += 1
+                elif current is not None and delegator in data.get(current, ()):
+                    yield (DUPLICATE_DELEGATOR, representative, delegator, current, None)
+                else:
+                    count += 1
+                    yield (MISSING_REVERSE, representative, delegator, current, representative)
+                visited = self._gc(visited, gc_interval)
+            counter = counts_data.get(representative, None)
+            found = None
+            if counter is not None:
+                found = counter()
+            if found != count:
+                yield (WRONG_COUNT, representative, None, found, count)
+            total += count
+        for (representative, counter) in counts_data.items():
+            if representative not in data:
+                yield (WRONG_COUNT, representative, None, counter(), None)
+        if self.total_data() != total:
+            yield (WRONG_TOTAL, None, None, self.total_data(), total)
+        #Expiry of delegations that don't exist, or that's missing from one of the indexes
+        expires_data = self.expires_data
+        for (expires, delegator) in self.expiry_data:
+            if expires_data.get(delegator, None) != expires or self._representative(delegator) is None:
+                yield (WRONG_EXPIRY, None, delegator, expires, expires_data.get(delegator, None))
+            visited = self._gc(visited, gc_interval)
+        for (delegator, expires) in expires_data.items():
+            if (expires, delegator) not in self.expiry_data:
+                yield (WRONG_EXPIRY, None, delegator, None, expires)
+            visited = self._gc(visited, gc_interval)
+
+    def repair(self, problems):
+        """ Fix problems reported by verify. Each one is checked again first,
+            since things may have changed. Returns the number of changes.
+        """
+        self.init_storage()
+        fixed = 0
+        for problem in problems:
+            if self._repair(*problem):
+                fixed += 1
+        if fixed:
+            self.version_data.change(1)
+        return fixed
+
+    def _repair(self, kind, representative, delegator, found, expected):
+        data = self.data
+        reverse_data = self.reverse_data
+        if kind == DANGLING_REVERSE:
+            if reverse_data.get(delegator, None) == representative and delegator not in data.get(representative, ()):
+                del reverse_data[delegator]
+                return True
+        elif kind in (MISSING_REVERSE, DUPLICATE_DELEGATOR):
+            if delegator not in data.get(representative, ()):
+                return False
+            current = reverse_data.get(delegator, None)
+            if current == representative:
+                return False
+            if current is not None and delegator in data.get(current, ()):
+                self._delegators(representative).remove(delegator)
+            else:
+                reverse_data[delegator] = representative
+            return True
+        elif kind == WRONG_COUNT:
+            if representative not in data:
+                if representative in self.counts_data:
+                    del self.counts_data[representative]
+                    return True
+                return False
+            count = len(data[representative])
+            counter = self.counts_data.get(representative, None)
+            if counter is None:
+                self.counts_data[representative] = Length(count)
+                return True
+            if counter() != count:
+                counter.set(count)
+                return True
+        elif kind == WRONG_TOTAL:
+            total = sum([counter() for counter in self.counts_data.values()])
+            if self.total_data() != total:
+                self.total_data.set(total)
+                return True
+        elif kind == WRONG_EXPIRY:
+            expires = self.expires_data.get(delegator, None)
+            stale = found is not None and (found, delegator) in self.expiry_data
+            if self._representative(delegator) is None:
+                #The delegation is gone, so its expiry should be too
+                if expires is not None:
+                    del self.expires_data[delegator]
+                if stale:
+                    self.expiry_data.remove((found, delegator))
+                return expires is not None or stale
+            if stale and found != expires:
+                self.expiry_data.remove((found, delegator))
+                return True
+            if expires is not None and (expires, delegator) not in self.expiry_data:
+                self.expiry_data.insert((expires, delegator))
+                return True
+        return False
+
+    def _gc(self, visited, interval):
+        visited += 1
+        if visited % interval == 0:
+            jar = getattr(self.context, '_p_jar', None)
+            if jar is not None:
+                jar.cacheGC()
+        return visited
+
+    def format_problem(self, problem):
+        kind, representative, delegator, found, expected = problem
+        return "%s: representative %r, delegator %r, found %r, expected %r" % \
+            (kind, representative, delegator, found, expected)
+
+    def _delegators(self, key):
+        """ The delegators of key, ready to be changed. """
+        if key in self.shared_data:
+            self.data[key] = OOTreeSet(self.data[key])
+            self.shared_data.remove(key)
+        return self.data[key]
 
     def __setitem__(self, key, item):
+        self.init_storage()
+        if key in self.data:
+            for v in tuple(self.data[key]):
+                self._unlink(v)
+        else:
+            self.data[key] = OOTreeSet()
+            self._add_counters(key)
+            self.version_data.change(1)
         for v in item:
-            self.reverse_data[v] = key
-        self.data[key] = tuple(item)
+            if v in self.reverse_data:
+                self._unlink(v)
+            self._link(key, v)
 
     def __delitem__(self, key):
-        for v in self.data[key]:
-            del self.reverse_data[v]
+        for v in tuple(self.data[key]):
+            self._unlink(v)
         del self.data[key]
+        self._remove_counters(key)
+        if key in self.shared_data:
+            self.shared_data.remove(key)
+        self.version_data.change(1)
 
     def __repr__(self): #pragma : no cover
         klass = self.__class__
@@ -116,10 +595,22 @@ class Representatives(object):
                                      self.context)
 
     def __len__(self): return len(self.data)
-    def __getitem__(self, key): return self.data[key]
-    def keys(self): return self.data.keys()
-    def items(self): return self.data.items()
-    def values(self): return self.data.values()
+    def __getitem__(self, key):
+        delegators = self._all_delegators(key)
+        expired = self._expired_keys()
+        if expired:
+            return tuple([x for x in delegators if x not in expired])
+        return delegators
+    def keys(self, min = None, max = None, excludemin = False, excludemax = False):
+        return self.data.keys(min, max, excludemin = excludemin, excludemax = excludemax)
+    def items(self):
+        if self._expired_keys():
+            return [(key, self[key]) for key in self.keys()]
+        return self.data.items()
+    def values(self):
+        if self._expired_keys():
+            return [self[key] for key in self.keys()]
+        return self.data.values()
     def get(self, key, failobj=None):
         if key not in self:
             return failobj
@@ -130,12 +621,393 @@ class Representatives(object):
         return iter(self.data)
 
 
+class DelegationSnapshot(Persistent):
+    """ Read-only copy of the delegations in a meeting, stored on a poll
+        when it opens. The sets of delegators are shared with the live storage.
+    """
+
+    def __init__(self, data, version):
+        self.data = OOBTree(data)
+        self.version = version
+
+    def represented_by(self, key):
+        try:
+            reverse = self._v_reverse
+        except AttributeError:
+            reverse = self._v_reverse = {}
+            for (representative, delegators) in self.data.items():
+                for delegator in delegators:
+                    reverse[delegator] = representative
+        return reverse.get(key, None)
+
+    def count(self, key):
+        return len(self.data.get(key, ()))
+
+    def __len__(self): return len(self.data)
+    def __getitem__(self, key): return self.data[key]
+    def keys(self): return self.data.keys()
+    def items(self): return self.data.items()
+    def get(self, key, failobj=None):
+        return self.data.get(key, failobj)
+    def __contains__(self, key):
+        return key in self.data
+    def __iter__(self):
+        return iter(self.data)
+
+
+@implementer(IRepresentatives)
+@adapter(IMeeting)
+class ChainedRepresentatives(Representatives):
+    """ Representatives that may be represented by someone else themselves,
+        so A -> B -> C means that C is the final representative of A and B.
+
+        The final representative of every delegator and the transitive weight
+        of every representative are kept up to date whenever a link changes,
+        so they never need to be computed by walking the chains.
+    """
+    default_max_depth = 5
+    storage = Representatives.storage + \
+        (('__representatives_resolved__', OOBTree),
+         ('__representatives_weight__', OOBTree),)
+
+    @property
+    def max_depth(self):
+        settings = get_current_registry().settings or {}
+        return int(settings.get('voteit.liquid.max_depth', self.default_max_depth))
+
+    @property
+    def resolved_data(self):
+        """ Delegator to final representative. """
+        return self._storage('__representatives_resolved__')
+
+    @property
+    def weight_data(self):
+        """ Representative to a Length with the number of delegators, direct or through others. """
+        return self._storage('__representatives_weight__')
+
+    def _weight(self, key):
+        counter = self.weight_data.get(key, None)
+        return counter is not None and counter() or 0
+
+    def _add_counters(self, key):
+        super(ChainedRepresentatives, self)._add_counters(key)
+        self.weight_data[key] = Length()
+
+    def _remove_counters(self, key):
+        super(ChainedRepresentatives, self)._remove_counters(key)
+        if key in self.weight_data:
+            del self.weight_data[key]
+
+    @instrumented('representatives.enable_representative')
+    def enable_representative(self, key):
+        """ Unlike the simple model, the new representative keeps their own representative. """
+        if key not in self:
+            self.init_storage()
+            self.data[key] = OOTreeSet()
+            self._add_counters(key)
+            self.version_data.change(1)
+            event = RepresentativeEnabled(self.context, representative = key)
+            notify(event)
+
+    def represent(self, key, item, expires = None):
+        assert self.can_represent(key, item), \
+            "%s can't represent %s - it would cause a cycle or a too long chain" % (key, item)
+        #Expired links above key would still be followed when the weights are updated
+        expired = self._expired_keys()
+        stale = [userid for userid in self.chain(key) if userid in expired]
+        if stale:
+            self.release_many(stale)
+        super(ChainedRepresentatives, self).represent(key, item, expires = expires)
+
+    def represent_many(self, pairs, expires = None):
+        pairs = tuple(pairs)
+        expired = self._expired_keys()
+        if expired:
+            self.release_many(sorted(set([userid for (key, item) in pairs
+                                          for userid in self.chain(key) if userid in expired])))
+        super(ChainedRepresentatives, self).represent_many(pairs, expires = expires)
+
+    @instrumented('representatives.can_represent')
+    def can_represent(self, key, item):
+        if key not in self or key == item:
+            return False
+        expired = self._expired_keys()
+        chain = self.chain(key, expired = expired)
+        if item in chain:
+            return False
+        limit = self.max_depth - len(chain)
+        return limit >= 0 and self.height(item, limit = limit, expired = expired) <= limit
+
+    def resolve(self, key):
+        """ Final representative of key or None. The chain ends at the first
+            expired delegation, if there are any that haven't been released yet.
+        """
+        final = self.resolved_data.get(key, None)
+        if final is None or not self.expires_data:
+            return final
+        now = time()
+        current = key
+        while current != final:
+            if self._expired(current, now):
+                return current != key and current or None
+            current = self.reverse_data[current]
+        return final
+
+    def weight(self, key):
+        """ Number of delegators key represents, directly or through others. """
+        weight = self._weight(key)
+        if not weight:
+            return 0
+        return weight - self._expired_weights().get(key, 0)
+
+    def _expired_weights(self):
+        """ Representative to the weight they lose to expired delegations,
+            kept as long as the expired delegations are the same.
+        """
+        state = self._expired_state()
+        version = self.version_data
+        cached = getattr(version, '_v_expired_weights', None)
+        if cached is not None and cached[0] is state:
+            return cached[1]
+        expired = state[1]
+        weights = {}
+        for delegator in expired:
+            lost = 1 + self._weight(delegator)
+            for userid in self.chain(delegator)[1:]:
+                weights[userid] = weights.get(userid, 0) + lost
+                if userid in expired:
+                    #Links further up already lost this one with userid
+                    break
+        version._v_expired_weights = (state, weights)
+        return weights
+
+    def chain(self, key, expired = ()):
+        """ key followed by all its representatives, ending with the final one.
+            The chain ends at delegators in expired.
+        """
+        chain = [key]
+        representative = self.reverse_data.get(key, None)
+        while representative is not None and representative not in chain and chain[-1] not in expired:
+            chain.append(representative)
+            representative = self.reverse_data.get(representative, None)
+        return chain
+
+    def subtree(self, key):
+        """ Yields (userid, distance) for everyone represented by key,
+            directly or through others. Closest delegators first.
+        """
+        return self._subtree(key)
+
+    def _subtree(self, key, repeated = None):
+        """ subtree, but delegators met a second time are appended to repeated
+            instead of being walked again. That only happens when data is broken.
+        """
+        seen = set([key])
+        level = [key]
+        distance = 0
+        while level:
+            distance += 1
+            next_level = []
+            for userid in level:
+                for delegator in self.data.get(userid, ()):
+                    if delegator in seen:
+                        if repeated is not None:
+                            repeated.append(delegator)
+                        continue
+                    seen.add(delegator)
+                    yield delegator, distance
+                    next_level.append(delegator)
+            level = next_level
+
+    def height(self, key, limit = None, expired = ()):
+        """ Length of the longest chain ending with key, not counting delegators in expired.
+            With limit, the levels below limit + 1 aren't read, and limit + 1 is returned
+            if it's that high.
+        """
+        seen = set([key])
+        level = [key]
+        height = 0
+        while level:
+            level = [delegator for userid in level for delegator in self.data.get(userid, ())
+                     if delegator not in expired and delegator not in seen]
+            seen.update(level)
+            if level:
+                height += 1
+                if limit is not None and height > limit:
+                    break
+        return height
+
+    def verify(self, gc_interval = 10000):
+        """ Also checks the final representatives and weights. """
+        for problem in super(ChainedRepresentatives, self).verify(gc_interval = gc_interval):
+            yield problem
+        cycles = False
+        visited = 0
+        resolved_data = self.resolved_data
+        for delegator in self.reverse_data.keys():
+            final, cyclic = self._final(delegator)
+            if cyclic:
+                cycles = True
+                yield (CYCLE, final, delegator, None, None)
+            elif resolved_data.get(delegator, None) != final:
+                yield (WRONG_RESOLVED, final, delegator, resolved_data.get(delegator, None), final)
+            visited = self._gc(visited, gc_interval)
+        for delegator in resolved_data.keys():
+            if delegator not in self.reverse_data:
+                yield (WRONG_RESOLVED, None, delegator, resolved_data[delegator], None)
+        if cycles:
+            #Weights can't be counted
+            return
+        for representative in self.data.keys():
+            weight = 0
+            repeated = []
+            for (userid, distance) in self._subtree(representative, repeated):
+                weight += 1
+                visited = self._gc(visited, gc_interval)
+            if representative in repeated:
+                #Represented by one of their own delegators in data, but not in reverse_data
+                yield (CYCLE, representative, representative, None, None)
+                continue
+            counter = self.weight_data.get(representative, None)
+            found = None
+            if counter is not None:
+                found = counter()
+            if found != weight:
+                yield (WRONG_WEIGHT, representative, None, found, weight)
+        for (representative, counter) in self.weight_data.items():
+            if representative not in self.data:
+                yield (WRONG_WEIGHT, representative, None, counter(), None)
+
+    def _repair(self, kind, representative, delegator, found, expected):
+        if kind == MISSING_REVERSE and delegator in self.chain(representative):
+            #Pointing delegator to representative would close a loop, so the listing is wrong
+            if delegator in self.data.get(representative, ()) and \
+                    self.reverse_data.get(delegator, None) is None:
+                self._delegators(representative).remove(delegator)
+                return True
+            return False
+        if kind == WRONG_RESOLVED:
+            if delegator not in self.reverse_data:
+                if delegator in self.resolved_data:
+                    del self.resolved_data[delegator]
+                    return True
+                return False
+            final, cyclic = self._final(delegator)
+            if not cyclic and self.resolved_data.get(delegator, None) != final:
+                self.resolved_data[delegator] = final
+                return True
+        elif kind == WRONG_WEIGHT:
+            if representative not in self.data:
+                if representative in self.weight_data:
+                    del self.weight_data[representative]
+                    return True
+                return False
+            weight = len(list(self.subtree(representative)))
+            counter = self.weight_data.get(representative, None)
+            if counter is None:
+                self.weight_data[representative] = Length(weight)
+                return True
+            if counter() != weight:
+                counter.set(weight)
+                return True
+        else:
+            return super(ChainedRepresentatives, self)._repair(kind, representative, delegator, found, expected)
+        return False
+
+    def _final(self, key):
+        """ Final representative of key according to reverse_data,
+            and True if the chain turned out to be a cycle.
+        """
+        chain = self.chain(key)
+        representative = self.reverse_data.get(chain[-1], None)
+        return chain[-1], representative is not None
+
+    def _link(self, key, item):
+        super(ChainedRepresentatives, self)._link(key, item)
+        self._adjust_weight(key, 1 + self._weight(item))
+        final = self.resolved_data.get(key, key)
+        self.resolved_data[item] = final
+        for (userid, distance) in self.subtree(item):
+            self.resolved_data[userid] = final
+
+    def _unlink(self, item):
+        self._adjust_weight(self.reverse_data[item], -(1 + self._weight(item)))
+        super(ChainedRepresentatives, self)._unlink(item)
+        del self.resolved_data[item]
+        for (userid, distance) in self.subtree(item):
+            self.resolved_data[userid] = item
+
+    def _adjust_weight(self, key, value):
+        for userid in self.chain(key):
+            self.weight_data[userid].change(value)
+
+
+@implementer(IProxyVotes)
+@adapter(IPoll)
+class ProxyVotes(StorageMixin):
+    """ Index of votes in a poll added by representatives. """
+    storage = (('__liquid_proxies__', OOBTree),
+               ('__liquid_cast_by__', OOBTree),)
+
+    def __init__(self, context):
+        self.context = context
+
+    @property
+    def data(self):
+        """ Delegator to the representative who added their vote. """
+        return self._storage('__liquid_proxies__')
+
+    @property
+    def cast_by_data(self):
+        """ Representative to an OOTreeSet of delegators they added votes for. """
+        return self._storage('__liquid_cast_by__')
+
+    def add(self, delegator, representative):
+        current = self.data.get(delegator, None)
+        if current == representative:
+            return
+        self.init_storage()
+        if current is not None:
+            self.cast_by_data[current].remove(delegator)
+        self.data[delegator] = representative
+        votes = self.cast_by_data.get(representative, None)
+        if votes is None:
+            self.cast_by_data[representative] = votes = OOTreeSet()
+        votes.insert(delegator)
+
+    def remove(self, delegator):
+        representative = self.data.get(delegator, None)
+        if representative is None:
+            return
+        del self.data[delegator]
+        votes = self.cast_by_data[representative]
+        votes.remove(delegator)
+        if not votes:
+            del self.cast_by_data[representative]
+
+    def representative_for(self, delegator):
+        return self.data.get(delegator, None)
+
+    def cast_by(self, representative):
+        return self.cast_by_data.get(representative, ())
+
+    def __contains__(self, delegator):
+        return delegator in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        return self.data.items()
+
+
 @adapter(IVote)
 @implementer(ILiquidVoter)
 class LiquidVoter(object):
     title = ""
     description = ""
     name = ""
+    transitive = False
 
     def __init__(self, context):
         self.context = context
@@ -150,54 +1022,309 @@ class LiquidVoter(object):
 
     @reify
     def repr(self):
-        return IRepresentatives(self.meeting)
+        return poll_representatives(self.poll)
+
+    @reify
+    def proxies(self):
+        return IProxyVotes(self.poll)
+
+    @reify
+    def vote_data(self):
+        """ Vote data of the adapted context, read once per propagation. """
+        return self.context.get_vote_data()
+
+    @reify
+    def fingerprint(self):
+        return vote_fingerprint(self.vote_data)
+
+    @reify
+    def payload(self):
+        """ Vote data shared by all proxied votes added from the adapted context.
+            A new payload is made when the vote data changes, so votes that still
+            reference the old one, like the ones of delegators who weren't adjusted
+            this time, keep their vote data.
+        """
+        payload = getattr(self.context, '__liquid_payload__', None)
+        if payload is None or payload.fingerprint != self.fingerprint:
+            self.context.__liquid_payload__ = payload = VoteDataPayload(self.vote_data)
+        return payload
+
+    @reify
+    def vote_class(self):
+        return self.poll.get_poll_plugin().get_vote_class()
 
     def __call__(self, voter):
         """ Note that voter here represents the person who initiated the action. """
         raise NotImplementedError() #pragma : no cover
 
     def adjust_owner(self, userid):
+        """ Make userid the owner of their own vote if it was added by a representative.
+            It won't be changed by representatives after that.
+        """
         if userid == self.context.__name__ and userid not in self.context.creators:
             self.context.local_roles.add(userid, [ROLE_OWNER])
             self.context.local_roles.remove(self.context.creators[0], [ROLE_OWNER])
             self.context.creators = [userid]
+            self.context.__liquid_fingerprint__ = None
+            self.proxies.remove(userid)
+
+    @instrumented('liquid_voter.adjust_vote')
+    def adjust_vote(self, userid, representative = None):
+        """ Adjust another vote to look like the adapted context.
+            representative defaults to the one representing userid.
 
-    def adjust_vote(self, userid):
-        """ Adjust another vote to look like the adapted context. """
+            Votes that already have the same fingerprint as the adapted context
+            won't be touched. Returns one of the VOTE_ constants.
+        """
         #FIXME: Should the adjustments be tracked in some way?
-        logger.debug("Adjusting vote for '%s'" % userid)
-        representative = self.repr.represented_by(userid)
+        logger.debug("Adjusting vote for %r", userid)
+        if representative is None:
+            representative = self.repr.represented_by(userid)
         if userid in self.poll:
             vote = self.poll[userid]
             if userid in vote.creators:
-                logger.debug("%r has voted themselves to representative %r won't have any effect on the vote %r" % (userid, representative, vote))
+                logger.debug("%r has voted themselves so representative %r won't have any effect on the vote %s",
+                             userid, representative, LazyPath(vote))
+                return VOTE_OWN
+            self.proxies.add(userid, representative)
+            if getattr(vote, '__liquid_fingerprint__', None) == self.fingerprint:
+                return VOTE_UNCHANGED
+            logger.debug("Changing vote %s to look like %s", LazyPath(vote), LazyPath(self.context))
+            vote.__liquid_fingerprint__ = self.fingerprint
+            if isinstance(vote, ProxyVote):
+                vote.set_payload(self.payload)
             else:
-                logger.debug("Changing vote %r to look like %r" % (resource_path(vote), resource_path(self.context)))
-                vote.set_vote_data(self.context.get_vote_data())
+                vote.set_vote_data(self.vote_data)
+            if item_events():
                 event = RepresentativeChangedVote(vote, representative = representative, delegator = userid)
                 notify(event)
+            return VOTE_CHANGED
         else:
-            poll_plugin = self.poll.get_poll_plugin()
-            Vote = poll_plugin.get_vote_class()
             assert representative is not None, "Tried to adjust vote where no representative was found"
-            vote = Vote(creators = [representative], representative = representative)
-            vote.set_vote_data(self.context.get_vote_data(), notify = False)
+            if self.vote_class is Vote:
+                vote = ProxyVote(creators = [representative], representative = representative)
+                vote.set_payload(self.payload, notify = False)
+            else:
+                #Poll plugins with their own vote class get a copy of the vote data
+                vote = self.vote_class(creators = [representative], representative = representative)
+                vote.set_vote_data(self.vote_data, notify = False)
+            vote.__liquid_fingerprint__ = self.fingerprint
             self.poll[userid] = vote
-            logger.debug("Added new vote %r that looks like %r" % (resource_path(vote), resource_path(self.context)))
-            event = RepresentativeAddedVote(vote, representative = representative, delegator = userid)
+            self.proxies.add(userid, representative)
+            logger.debug("Added new vote %s that looks like %s", LazyPath(vote), LazyPath(self.context))
+            if item_events():
+                event = RepresentativeAddedVote(vote, representative = representative, delegator = userid)
+                notify(event)
+            return VOTE_ADDED
+
+    def propagate_to(self, delegator):
+        """ Adjust the vote of delegator, who just picked a representative. """
+        self.propagate_to_many([delegator])
+
+    def propagate_to_many(self, delegators):
+        """ Adjust the votes of delegators who just picked the same representative. """
+        all_voters = authorized_userids(get_current_request(), self.poll, ADD_VOTE)
+        userids = [userid for userid in delegators if userid in all_voters]
+        if userids:
+            self.adjust_votes(userids, representative = self.context.creators[0])
+
+    def adjust_votes(self, userids, representative = None):
+        """ Adjust all votes in one pass. Returns a dict with the number of votes
+            for each result of adjust_vote.
+        """
+        start = time()
+        results = dict.fromkeys((VOTE_ADDED, VOTE_CHANGED, VOTE_UNCHANGED, VOTE_OWN), 0)
+        affected = {VOTE_ADDED: [], VOTE_CHANGED: []}
+        with propagating(get_current_request(), self.context):
+            for userid in userids:
+                result = self.adjust_vote(userid, representative = representative)
+                results[result] += 1
+                if result in affected:
+                    affected[result].append(userid)
+        if representative is None:
+            representative = self.context.creators[0]
+        if affected[VOTE_ADDED] or affected[VOTE_CHANGED]:
+            event = RepresentativeVotesPropagated(self.context,
+                                                  representative = representative,
+                                                  added = tuple(affected[VOTE_ADDED]),
+                                                  changed = tuple(affected[VOTE_CHANGED]))
             notify(event)
+        metrics = get_metrics()
+        if metrics is not None:
+            metrics.incr('votes.delegators', len(userids))
+            for (result, count) in results.items():
+                metrics.incr('votes.%s' % result, count)
+        log_propagation(self.context, representative, results, time() - start)
+        return results
+
+
+class VoteDataPayload(Persistent):
+    """ Vote data stored once on the representative's vote and referenced
+        by every proxied vote added from it. Never changed after it's created.
+    """
+
+    def __init__(self, vote_data):
+        self.vote_data = deepcopy(vote_data)
+        self.fingerprint = vote_fingerprint(vote_data)
+
+
+class ProxyVote(Vote):
+    """ A vote added by a representative. It stores a reference to
+        the representative's payload instead of its own copy of the vote data.
+        Setting vote data on it, for instance when the delegator votes themselves,
+        stores the data on the vote as usual.
+
+        This saves storage when votes are added. When the representative changes
+        their vote, each proxied vote is still written once to point to the new
+        payload, and sends an ObjectUpdatedEvent.
+    """
+    payload = None
+
+    def get_vote_data(self):
+        """ A copy when the data comes from the shared payload, so changing it
+            won't change the votes of other delegators.
+        """
+        if self.payload is not None:
+            return deepcopy(self.payload.vote_data)
+        return super(ProxyVote, self).get_vote_data()
+
+    def set_vote_data(self, value, notify = True):
+        self.payload = None
+        super(ProxyVote, self).set_vote_data(value, notify = notify)
+
+    def set_payload(self, payload, notify = True):
+        self.payload = payload
+        if notify:
+            objectEventNotify(ObjectUpdatedEvent(self))
+
+
+def to_timestamp(value):
+    """ Seconds since the epoch from a timestamp or a datetime. Naive datetimes are UTC. """
+    if isinstance(value, datetime):
+        return timegm(value.utctimetuple()) + value.microsecond / 1000000.0
+    return float(value)
+
+
+def poll_representatives(poll):
+    """ The delegations that apply to poll: the snapshot taken when it opened,
+        or the live ones if there isn't any.
+    """
+    snapshot = getattr(poll, '__liquid_snapshot__', None)
+    if snapshot is not None:
+        return snapshot
+    return IRepresentatives(find_interface(poll, IMeeting))
+
+
+def item_events(registry = None):
+    """ Bulk operations send one event for everything they did. With 'voteit.liquid.item_events'
+        they also send the events for each delegator, like before there were bulk events.
+    """
+    if registry is None:
+        registry = get_current_registry()
+    return asbool((registry.settings or {}).get('voteit.liquid.item_events', False))
+
+
+def vote_fingerprint(vote_data):
+    """ A short string that's the same for equal vote data. """
+    return md5(repr(_freeze(vote_data)).encode('utf-8')).hexdigest()
+
+
+def authorized_userids(request, context, permission):
+    """ Cached version of find_authorized_userids for a single permission.
+        The result is kept on the request, and cleared by invalidate_authorized_userids
+        when the meeting or poll is updated, for instance when roles change.
+    """
+    if request is None:
+        return frozenset(find_authorized_userids(context, [permission]))
+    cache = getattr(request, '_liquid_authorized', None)
+    if cache is None:
+        request._liquid_authorized = cache = {}
+    key = (context.uid, permission)
+    try:
+        return cache[key]
+    except KeyError:
+        with timed('find_authorized_userids'):
+            cache[key] = userids = frozenset(find_authorized_userids(context, [permission]))
+        return userids
+
+
+def invalidate_authorized_userids(context, event):
+    request = get_current_request()
+    if getattr(request, '_liquid_authorized', None):
+        request._liquid_authorized.clear()
+
+
+def is_propagating(request):
+    """ True if votes are being propagated during this request. """
+    return bool(getattr(request, '_liquid_propagating', None))
+
+
+@contextmanager
+def propagating(request, vote):
+    """ Mark that vote is being propagated to delegators during this request.
+        Votes added or changed within this block won't be propagated again,
+        since handle_votes ignores them.
+    """
+    if request is None:
+        yield
+        return
+    active = getattr(request, '_liquid_propagating', None)
+    if active is None:
+        request._liquid_propagating = active = []
+    active.append(vote)
+    try:
+        yield
+    finally:
+        active.pop()
+
+
+def get_liquid_voter_factory(registry):
+    """ The ILiquidVoter factory named by 'voteit.liquid.type', or None.
+        The lookup is stored on the registry, and only redone if the setting changes.
+    """
+    ld_name = registry.settings.get('voteit.liquid.type', None)
+    cached = getattr(registry, '_liquid_voter_factory', None)
+    if cached is not None and cached[0] == ld_name:
+        return cached[1]
+    factory = None
+    if ld_name:
+        factory = registry.adapters.lookup((IVote,), ILiquidVoter, name = ld_name)
+    registry._liquid_voter_factory = (ld_name, factory)
+    return factory
+
+
+def check_liquid_type(registry):
+    if get_liquid_voter_factory(registry) is None:
+        raise ConfigurationError("'voteit.liquid.type' is set to '%s', but there's no "
+                                 "ILiquidVoter adapter with that name." % registry.settings['voteit.liquid.type'])
+
+
+def remove_proxy_vote(context, event):
+    poll = context.__parent__
+    if IPoll.providedBy(poll):
+        IProxyVotes(poll).remove(context.__name__)
 
 
 def handle_votes(context, event):
     request = get_current_request()
-    ld_name = request.registry.settings.get('voteit.liquid.type', None)
+    if is_propagating(request):
+        #Votes added or changed by a representative. The propagation already handles them.
+        return
     voter = request.authenticated_userid
     if voter is None:
-        logger.warn("handle_votes method couldn't find a valid userid. This should only happen during scripts or testing. Will abourt vote delegation.")
+        logger.warn("handle_votes method couldn't find a valid userid. This should only happen during scripts or testing. Will abort vote delegation.")
         return
-    if ld_name:
-        lv = request.registry.getAdapter(context, ILiquidVoter, name = ld_name)
-        lv(voter)
+    factory = get_liquid_voter_factory(request.registry)
+    if factory is not None:
+        with timed('handle_votes', request.registry):
+            lv = factory(context)
+            if is_deferred(request.registry) and voter in lv.repr:
+                #Take ownership right away, so propagation from someone else won't overwrite the vote
+                lv.adjust_owner(voter)
+                enqueue(context, voter)
+            else:
+                with timed('liquid_voter.call', request.registry):
+                    lv(voter)
 
 
 class SimpleAdjustVotes(LiquidVoter):
@@ -212,21 +1339,221 @@ class SimpleAdjustVotes(LiquidVoter):
     name = "simple"
 
     def __call__(self, voter):
+        self.adjust_owner(voter)
         if voter not in self.repr:
-            logger.debug("Curren't user wasn't a representative, but we may need to adjust ownership")
-            self.adjust_owner(voter)
             return
-        all_voters = find_authorized_userids(self.poll, [ADD_VOTE])
+        all_voters = authorized_userids(get_current_request(), self.poll, ADD_VOTE)
+        userids = []
         for userid in self.repr.get(voter, ()):
             if userid in all_voters:
-                logger.info("%r adjusted vote for %r in poll %r" % (voter, userid, resource_path(self.poll)))
-                self.adjust_vote(userid)
+                userids.append(userid)
             else:
-                logger.debug("%r doesn't have the add vote permission, so representative %r can't add one for this user." % (userid, voter))
+                logger.debug("%r doesn't have the add vote permission, so representative %r can't add one for this user.", userid, voter)
+        self.adjust_votes(userids, representative = voter)
+
+
+class ChainedAdjustVotes(LiquidVoter):
+    title = _("Chained delegation")
+    description = __doc__ = _("""
+        Representatives may delegate their vote to someone else, so votes flow along
+        chains of representatives. The closest representative who has voted decides
+        the vote. If a delegator has voted themselves, neither they nor anyone they
+        represent will be affected.
+
+        Note that delegators still need the permission to add a vote for their votes to be added.
+    """)
+    name = "chained"
+    transitive = True
+
+    def __call__(self, voter):
+        #Representatives may be represented too, so they may be voting over a vote added for them
+        self.adjust_owner(voter)
+        if voter not in self.repr:
+            return
+        all_voters = authorized_userids(get_current_request(), self.poll, ADD_VOTE)
+        userids = []
+        for userid in self.delegators(voter):
+            if userid in all_voters:
+                userids.append(userid)
+            else:
+                logger.debug("%r doesn't have the add vote permission, so representative %r can't add one for this user.", userid, voter)
+        self.adjust_votes(userids, representative = voter)
+
+    def propagate_to_many(self, delegators):
+        """ Adjust the votes of delegators and everyone they represent. """
+        all_voters = authorized_userids(get_current_request(), self.poll, ADD_VOTE)
+        userids = []
+        for delegator in delegators:
+            if delegator in self.poll and delegator in self.poll[delegator].creators:
+                continue
+            userids.extend([userid for userid in chain([delegator], self.delegators(delegator))
+                            if userid in all_voters])
+        if userids:
+            self.adjust_votes(userids, representative = self.context.creators[0])
+
+    def delegators(self, voter):
+        """ Everyone voter represents directly or through others, except the ones
+            who've voted themselves and the delegators they represent.
+        """
+        level = [voter]
+        while level:
+            next_level = []
+            for representative in level:
+                for userid in self.repr.get(representative, ()):
+                    if userid in self.poll and userid in self.poll[userid].creators:
+                        continue
+                    yield userid
+                    next_level.append(userid)
+            level = next_level
+
+
+class WeightedVotes(LiquidVoter):
+    title = _("Weighted votes")
+    description = __doc__ = _("""
+        No votes are added for delegators. Instead, the vote of a representative
+        counts once for every delegator who hasn't voted themselves when the poll closes.
+
+        Note that delegators still need to be voters for their votes to be counted.
+    """)
+    name = "weighted"
+
+    def __call__(self, voter):
+        self.adjust_owner(voter)
+
+    def propagate_to_many(self, delegators):
+        """ Delegators are counted when the poll closes. """
+
+
+@adapter(IPoll)
+@implementer(ILiquidTally)
+class WeightedTally(object):
+    """ Count the votes in a poll, weighted by the number of delegators
+        the voter represented when the poll closed.
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    @reify
+    def meeting(self):
+        return find_interface(self.context, IMeeting)
+
+    @reify
+    def repr(self):
+        return poll_representatives(self.context)
+
+    def votes(self):
+        for obj in self.context.values():
+            if IVote.providedBy(obj):
+                yield obj
+
+    def weights(self):
+        stored = getattr(self.context, '__liquid_weights__', None)
+        if stored is not None:
+            return stored
+        all_voters = authorized_userids(get_current_request(), self.context, ADD_VOTE)
+        weights = {}
+        for vote in self.votes():
+            userid = vote.__name__
+            weight = 1
+            for delegator in self.repr.get(userid, ()):
+                if delegator not in self.context and delegator in all_voters:
+                    weight += 1
+            weights[userid] = weight
+        return weights
+
+    def ballots(self, weights = None):
+        if weights is None:
+            weights = self.weights()
+        counter = {}
+        for vote in self.votes():
+            vote_data = vote.get_vote_data()
+            key = _freeze(vote_data)
+            if key in counter:
+                counter[key] = (counter[key][0], counter[key][1] + weights.get(vote.__name__, 1))
+            else:
+                counter[key] = (vote_data, weights.get(vote.__name__, 1))
+        #Frozen vote data may mix types that can't be compared, but their repr can
+        return tuple([counter[key] for key in sorted(counter, key = repr)])
+
+    def close(self):
+        weights = self.weights()
+        self.context.__liquid_weights__ = OOBTree(weights)
+        self.context.ballots = self.ballots(weights)
+
+    def handle_close(self):
+        ballots = self.ballots()
+        if self.context.ballots == ballots:
+            return False
+        self.context.ballots = ballots
+        self.context.get_poll_plugin().handle_close()
+        return True
+
+
+def _freeze(value):
+    """ Hashable version of vote data, the same for equal vote data. """
+    if isinstance(value, dict):
+        return tuple(_sorted([(k, _freeze(v)) for (k, v) in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(x) for x in value])
+    if isinstance(value, (set, frozenset)):
+        return tuple(_sorted([_freeze(x) for x in value]))
+    return value
+
+
+def _sorted(items):
+    try:
+        return sorted(items)
+    except TypeError:
+        #Mixed types on Python 3
+        return sorted(items, key = repr)
+
+
+def weighted_tally_on_close(context, event):
+    """ Count the weighted ballots while the poll is still ongoing, so the voters
+        are the ones allowed to vote, and the poll plugin gets the weighted ballots
+        when the poll closes.
+    """
+    if event.transition.to_state == 'closed':
+        ILiquidTally(context).close()
+
+
+def weighted_tally_after_close(context, event):
+    """ Closing the poll may count the ballots again without weights,
+        so if it did, the weighted ballots are put back and counted by the poll plugin.
+    """
+    if event.transition.to_state == 'closed':
+        ILiquidTally(context).handle_close()
 
 
 def includeme(config):
-    config.registry.registerAdapter(Representatives)
+    ld_type = config.registry.settings.get('voteit.liquid.type', None)
+    storage = config.registry.settings.get('voteit.liquid.storage', 'default')
+    if storage not in ('default', 'compact'):
+        raise ConfigurationError("voteit.liquid.storage must be 'default' or 'compact'")
+    if ld_type == ChainedAdjustVotes.name:
+        if storage == 'compact':
+            raise ConfigurationError("The compact storage can't be used with the '%s' type" % ld_type)
+        config.registry.registerAdapter(ChainedRepresentatives)
+    elif storage == 'compact':
+        #compact imports this module
+        from voteit.liquid.compact import CompactRepresentatives
+        config.registry.registerAdapter(CompactRepresentatives)
+    else:
+        config.registry.registerAdapter(Representatives)
     config.registry.registerAdapter(SimpleAdjustVotes, name = SimpleAdjustVotes.name)
+    config.registry.registerAdapter(ChainedAdjustVotes, name = ChainedAdjustVotes.name)
+    config.registry.registerAdapter(WeightedVotes, name = WeightedVotes.name)
+    config.registry.registerAdapter(WeightedTally)
+    config.registry.registerAdapter(ProxyVotes)
+    config.add_subscriber(remove_proxy_vote, (IVote, IObjectWillBeRemovedEvent))
+    if ld_type == WeightedVotes.name:
+        config.add_subscriber(weighted_tally_on_close, (IPoll, IWorkflowBeforeTransition))
+        config.add_subscriber(weighted_tally_after_close, (IPoll, IWorkflowAfterTransition))
+    if ld_type:
+        #Other packages may register adapters too, so check when the configuration is committed
+        config.action('voteit.liquid.type', check_liquid_type, args = (config.registry,))
     config.add_subscriber(handle_votes, (IVote, IObjectAddedEvent))
     config.add_subscriber(handle_votes, (IVote, IObjectUpdatedEvent))
+    config.add_subscriber(invalidate_authorized_userids, (IMeeting, IObjectUpdatedEvent))
+    config.add_subscriber(invalidate_authorized_userids, (IPoll, IObjectUpdatedEvent))
@@ -10,18 +10,22 @@ from voteit.liquid.interfaces import IRepresentatives
 @colander.deferred
 def existing_representative_validator(node, kw):
     context = kw['context']
-    return ExistingRepresentativeValidator(context)
+    request = kw['request']
+    return ExistingRepresentativeValidator(context, request.authenticated_userid)
 
 
 class ExistingRepresentativeValidator(object):
 
-    def __init__(self, context):
+    def __init__(self, context, userid = None):
         self.context = context
+        self.userid = userid
 
     def __call__(self, node, value):
         repr = IRepresentatives(self.context)
         if value not in repr:
             raise colander.Invalid(node, _("Not an existing representative"))
+        if self.userid and repr.represented_by(self.userid) != value and not repr.can_represent(value, self.userid):
+            raise colander.Invalid(node, _("You can't select this representative"))
 
 
 class SelectRepresentativeSchema(colander.Schema):
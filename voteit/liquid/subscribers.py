@@ -0,0 +1,146 @@
+""" Keep votes in ongoing polls in line with delegations that change
+    while the polls are open. When 'voteit.liquid.snapshots' is true, polls
+    use the delegations from when they opened instead.
+"""
+from arche.interfaces import IObjectWillBeRemovedEvent
+from arche.interfaces import IWorkflowAfterTransition
+from BTrees.OOBTree import OOBTree
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_registry
+from pyramid.traversal import find_interface
+from voteit.core.models.interfaces import IMeeting
+from voteit.core.models.interfaces import IPoll
+
+from voteit.liquid import logger
+from voteit.liquid.interfaces import IDelegationEnabled
+from voteit.liquid.interfaces import IDelegationWillBeDisabled
+from voteit.liquid.interfaces import IDelegationsEnabled
+from voteit.liquid.interfaces import IDelegationsReleased
+from voteit.liquid.interfaces import IProxyVotes
+from voteit.liquid.interfaces import IRepresentatives
+from voteit.liquid.interfaces import IRepresentativeWillBeDisabled
+from voteit.liquid.models import get_liquid_voter_factory
+from voteit.liquid.models import item_events
+
+
+def open_polls(meeting):
+    """ Ongoing polls within meeting. """
+    polls = getattr(meeting, '__liquid_open_polls__', None)
+    if polls is None:
+        return ()
+    return tuple(polls.values())
+
+
+def track_open_polls(context, event):
+    meeting = find_interface(context, IMeeting)
+    polls = getattr(meeting, '__liquid_open_polls__', None)
+    if context.get_workflow_state() == 'ongoing':
+        if polls is None:
+            meeting.__liquid_open_polls__ = polls = OOBTree()
+        polls[context.uid] = context
+    elif polls is not None and context.uid in polls:
+        del polls[context.uid]
+
+
+def following_delegations(meeting):
+    """ Ongoing polls that use the live delegations rather than a snapshot. """
+    return [poll for poll in open_polls(meeting) if getattr(poll, '__liquid_snapshot__', None) is None]
+
+
+def snapshot_on_open(context, event):
+    """ Store the delegations on a poll when it opens, so changes
+        while it's ongoing won't affect it.
+    """
+    if context.get_workflow_state() == 'ongoing':
+        meeting = find_interface(context, IMeeting)
+        context.__liquid_snapshot__ = IRepresentatives(meeting).snapshot()
+
+
+def forget_removed_poll(context, event):
+    meeting = find_interface(context, IMeeting)
+    polls = getattr(meeting, '__liquid_open_polls__', None)
+    if polls is not None and context.uid in polls:
+        del polls[context.uid]
+
+
+def retract_representative_votes(event):
+    """ Remove all votes the representative added in ongoing polls. """
+    for poll in following_delegations(event.context):
+        delegators = tuple(IProxyVotes(poll).cast_by(event.representative))
+        for userid in delegators:
+            del poll[userid]
+        if delegators:
+            logger.info("Removed %s votes added by %r in %r" % (len(delegators), event.representative, poll.uid))
+
+
+def retract_delegation_votes(event):
+    """ Remove votes added for the delegator by their former representative.
+        When chains of representatives are used, this also applies to
+        anyone the delegator represents.
+    """
+    _retract(event.context, [event.delegator])
+
+
+def retract_released_votes(event):
+    _retract(event.context, [delegator for (representative, delegator) in event.delegations])
+
+
+def _retract(meeting, delegators):
+    polls = following_delegations(meeting)
+    if not polls:
+        return
+    repr = IRepresentatives(meeting)
+    subtree = getattr(repr, 'subtree', None)
+    for delegator in delegators:
+        affected = [delegator]
+        if subtree is not None:
+            affected.extend([userid for (userid, distance) in subtree(delegator)])
+        #Votes added by the delegator or anyone they represent are still valid
+        keep = set(affected)
+        for poll in polls:
+            proxies = IProxyVotes(poll)
+            for userid in affected:
+                representative = proxies.representative_for(userid)
+                if representative is not None and representative not in keep:
+                    del poll[userid]
+
+
+def propagate_delegation_votes(event):
+    """ Add votes for the delegator in ongoing polls where the new representative has voted. """
+    _propagate(event.context, [(event.representative, event.delegator)])
+
+
+def propagate_enabled_votes(event):
+    _propagate(event.context, event.delegations)
+
+
+def _propagate(meeting, delegations):
+    polls = following_delegations(meeting)
+    if not polls:
+        return
+    factory = get_liquid_voter_factory(get_current_registry())
+    if factory is None:
+        return
+    by_representative = {}
+    for (representative, delegator) in delegations:
+        by_representative.setdefault(representative, []).append(delegator)
+    for poll in polls:
+        for (representative, delegators) in by_representative.items():
+            vote = poll.get(representative, None)
+            if vote is not None:
+                factory(vote).propagate_to_many(delegators)
+
+
+def includeme(config):
+    config.add_subscriber(track_open_polls, (IPoll, IWorkflowAfterTransition))
+    if asbool(config.registry.settings.get('voteit.liquid.snapshots', False)):
+        config.add_subscriber(snapshot_on_open, (IPoll, IWorkflowAfterTransition))
+    config.add_subscriber(forget_removed_poll, (IPoll, IObjectWillBeRemovedEvent))
+    config.add_subscriber(retract_representative_votes, IRepresentativeWillBeDisabled)
+    config.add_subscriber(retract_delegation_votes, IDelegationWillBeDisabled)
+    config.add_subscriber(propagate_delegation_votes, IDelegationEnabled)
+    #Bulk operations send the events for each delegator too with item_events,
+    #and the votes should only be retracted and propagated once
+    if not item_events(config.registry):
+        config.add_subscriber(retract_released_votes, IDelegationsReleased)
+        config.add_subscriber(propagate_enabled_votes, IDelegationsEnabled)
@@ -1,10 +1,15 @@
+import os
 from unittest import TestCase
 
 from pyramid import testing
 from pyramid.httpexceptions import HTTPForbidden
+from webob.etag import ETagMatcher
+from webob.etag import NoETag
 from voteit.core.models.meeting import Meeting
+from voteit.core.models.interfaces import IVote
 from voteit.core.models.user import User
 from voteit.core.models.vote import Vote
+from voteit.core.security import ADD_VOTE
 from voteit.core.security import unrestricted_wf_transition_to
 from voteit.core.testing_helpers import bootstrap_and_fixture
 from zope.interface.verify import verifyClass
@@ -79,6 +84,26 @@ class RepresentativesTests(TestCase):
         obj.disable_representative('hello')
         self.assertEqual(len(L), 1)
 
+    def test_disable_repr_sends_bulk_event(self):
+        from voteit.liquid.interfaces import IDelegationsReleased
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IDelegationsReleased)
+        self.config.add_subscriber(lambda event: L.append(event), IDelegationWillBeDisabled)
+        obj = self._cut(Meeting())
+        obj['hello'] = ('one', 'two')
+        obj.disable_representative('hello')
+        self.assertEqual(len(L), 1)
+        self.assertEqual(set(L[0].delegations), set([('hello', 'one'), ('hello', 'two')]))
+
+    def test_disable_repr_item_events(self):
+        L = []
+        self.config.registry.settings['voteit.liquid.item_events'] = 'true'
+        self.config.add_subscriber(lambda event: L.append(event), IDelegationWillBeDisabled)
+        obj = self._cut(Meeting())
+        obj['hello'] = ('one', 'two')
+        obj.disable_representative('hello')
+        self.assertEqual(set([x.delegator for x in L]), set(['one', 'two']))
+
     def test_represent(self):
         obj = self._cut(Meeting())
         obj['one'] = ()
@@ -144,15 +169,120 @@ class RepresentativesTests(TestCase):
         obj['cand_one'] = ('one',)
         obj['cand_two'] = ()
         obj.represent('cand_two', 'one')
-        self.assertEqual(obj['cand_one'], ())
-        self.assertEqual(obj['cand_two'], ('one',))
+        self.assertEqual(tuple(obj['cand_one']), ())
+        self.assertEqual(tuple(obj['cand_two']), ('one',))
+
+    def test_setitem_moves_delegators(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two', 'three',)
+        obj['four'] = ('two',)
+        self.assertEqual(tuple(obj['one']), ('three',))
+        self.assertEqual(obj.represented_by('two'), 'four')
+
+    def test_setitem_replaces_delegators(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two', 'three',)
+        obj['one'] = ('three',)
+        self.assertEqual(obj.represented_by('two'), None)
+        self.assertEqual(obj.represented_by('three'), 'one')
+
+    def test_delegators_stored_as_treeset(self):
+        from BTrees.OOBTree import OOTreeSet
+        obj = self._cut(Meeting())
+        obj.enable_representative('one')
+        obj.represent('one', 'two')
+        self.assertIsInstance(obj['one'], OOTreeSet)
+
+    def test_count(self):
+        obj = self._cut(Meeting())
+        self.assertEqual(obj.count('one'), 0)
+        obj['one'] = ('two', 'three',)
+        obj.enable_representative('four')
+        obj.represent('four', 'two')
+        self.assertEqual(obj.count('one'), 1)
+        self.assertEqual(obj.count('four'), 1)
+        obj.release('two')
+        self.assertEqual(obj.count('four'), 0)
+
+    def test_total_delegations(self):
+        obj = self._cut(Meeting())
+        self.assertEqual(obj.total_delegations(), 0)
+        obj['one'] = ('two', 'three',)
+        obj['four'] = ('five',)
+        self.assertEqual(obj.total_delegations(), 3)
+        obj.disable_representative('one')
+        self.assertEqual(obj.total_delegations(), 1)
+        del obj['four']
+        self.assertEqual(obj.total_delegations(), 0)
+
+    def test_version(self):
+        obj = self._cut(Meeting())
+        self.assertEqual(obj.version(), 0)
+        obj.enable_representative('one')
+        first = obj.version()
+        obj.represent('one', 'two')
+        second = obj.version()
+        obj.release('two')
+        third = obj.version()
+        obj.disable_representative('one')
+        self.assertTrue(0 < first < second < third < obj.version())
+
+    def test_ranked(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two',)
+        obj['three'] = ()
+        self.assertEqual(obj.ranked(), ((-1, 'one'), (0, 'three')))
+        self.assertIs(obj.ranked(), obj.ranked())
+        obj.represent('three', 'four')
+        obj.represent('three', 'five')
+        self.assertEqual(obj.ranked(), ((-2, 'three'), (-1, 'one')))
+
+    def test_ranked_skips_expired(self):
+        from time import time
+        from voteit.liquid import models
+        now = time()
+        obj = self._cut(Meeting())
+        obj['one'] = ('two',)
+        obj.enable_representative('three')
+        obj.represent('three', 'four', expires = now + 3600)
+        obj.represent('three', 'five', expires = now + 3600)
+        self.assertEqual(obj.ranked(), ((-2, 'three'), (-1, 'one')))
+        #Expire them without changing the version
+        original = models.time
+        models.time = lambda: now + 7200
+        try:
+            self.assertEqual(obj.ranked(), ((-1, 'one'), (0, 'three')))
+        finally:
+            models.time = original
+
+    def test_snapshot(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two',)
+        obj['four'] = ('five',)
+        snapshot = obj.snapshot()
+        obj.represent('one', 'three')
+        obj.release('five')
+        self.assertEqual(tuple(snapshot['one']), ('two',))
+        self.assertEqual(tuple(snapshot['four']), ('five',))
+        self.assertEqual(snapshot.represented_by('five'), 'four')
+        self.assertEqual(tuple(obj['one']), ('three', 'two'))
+        self.assertEqual(tuple(obj['four']), ())
+
+    def test_snapshot_shares_unchanged_delegators(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two',)
+        obj['four'] = ('five',)
+        snapshot = obj.snapshot()
+        obj.represent('one', 'three')
+        self.assertIsNot(snapshot['one'], obj['one'])
+        self.assertIs(snapshot['four'], obj['four'])
 
     def test_get(self):
         obj = self._cut(Meeting())
         obj['one'] = ()
         _marker = object()
         self.assertEqual(obj.get('blabla', _marker), _marker)
-        self.assertEqual(obj.get('one', _marker), ())
+        self.assertEqual(tuple(obj.get('one', _marker)), ())
         self.assertEqual(obj.get('blabla'), None)
 
     def test_iter(self):
@@ -169,151 +299,2036 @@ class RepresentativesTests(TestCase):
         self.failUnless(IRepresentatives(m, None))
 
 
-def _voting_fixture(config):
-    #Note: active_poll_fixture may clear registry.settings
-    from voteit.core.testing_helpers import active_poll_fixture
-    config.include('voteit.core.plugins.majority_poll')
-    root = active_poll_fixture(config)
-    poll = root['meeting']['ai']['poll']
-    poll.set_field_value('poll_plugin', 'majority_poll')
-    poll['one'] = vote = Vote(creators = ['one'])
-    vote.set_vote_data({'a': 1, 'b': 2}, notify = False)
-    return vote
+class ConcurrentDelegationTests(TestCase):
+    """ Delegating to the same representative in two connections at once,
+        against a FileStorage. The changes should merge without conflicts.
+    """
 
+    def setUp(self):
+        import tempfile
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        self.config = testing.setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = DB(FileStorage(os.path.join(self.tmpdir, 'Data.fs')))
+
+    def tearDown(self):
+        import shutil
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+        testing.tearDown()
+
+    def _concurrent_represent(self, cut, delegators = ()):
+        import transaction
+        conn = self.db.open()
+        conn.root()['m'] = meeting = Meeting()
+        cut(meeting).enable_representative('rep')
+        for userid in delegators:
+            cut(meeting).represent('rep', userid)
+        transaction.commit()
+        tms = [transaction.TransactionManager() for i in range(2)]
+        conns = [self.db.open(tm) for tm in tms]
+        for (i, other) in enumerate(conns):
+            cut(other.root()['m']).represent('rep', 'user%s' % i)
+        #Raises ConflictError if the changes don't merge
+        for tm in tms:
+            tm.commit()
+        for other in conns:
+            other.close()
+        conn.sync()
+        self.addCleanup(conn.close)
+        return cut(conn.root()['m'])
+
+    def test_first_delegations(self):
+        from voteit.liquid.models import Representatives
+        obj = self._concurrent_represent(Representatives)
+        self.assertEqual(tuple(obj['rep']), ('user0', 'user1'))
+        self.assertEqual(obj.count('rep'), 2)
+        self.assertEqual(obj.total_delegations(), 2)
+        self.assertEqual(list(obj.verify()), [])
+
+    def test_more_delegations(self):
+        from voteit.liquid.models import Representatives
+        obj = self._concurrent_represent(Representatives, ('other',))
+        self.assertEqual(tuple(obj['rep']), ('other', 'user0', 'user1'))
+        self.assertEqual(obj.count('rep'), 3)
+
+    def test_chained(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        obj = self._concurrent_represent(ChainedRepresentatives, ('other',))
+        self.assertEqual(obj.count('rep'), 3)
+        self.assertEqual(obj.weight('rep'), 3)
+        self.assertEqual(obj.resolve('user1'), 'rep')
+        self.assertEqual(list(obj.verify()), [])
+
+    def test_compact(self):
+        from voteit.liquid.compact import CompactRepresentatives
+        obj = self._concurrent_represent(CompactRepresentatives)
+        self.assertEqual(tuple(obj['rep']), ('user0', 'user1'))
+        self.assertEqual(obj.count('rep'), 2)
+
+    def test_reading_doesnt_write_to_meeting(self):
+        from voteit.liquid.models import Representatives
+        meeting = Meeting()
+        obj = Representatives(meeting)
+        obj.represented_by('one')
+        self.assertEqual(len(obj), 0)
+        self.assertFalse(hasattr(meeting, '__representatives_data__'))
+        self.assertFalse(hasattr(meeting, '__representatives_data_dev__'))
+
+
+class ChainedRepresentativesTests(TestCase):
 
-class LiquidVoterTests(TestCase):
- 
     def setUp(self):
         self.config = testing.setUp()
-        self.config.include('voteit.liquid.models')
- 
+
     def tearDown(self):
         testing.tearDown()
 
     @property
     def _cut(self):
-        from voteit.liquid.models import LiquidVoter
-        return LiquidVoter
- 
-    def test_verify_class(self):
-        self.failUnless(verifyClass(ILiquidVoter, self._cut))
- 
+        from voteit.liquid.models import ChainedRepresentatives
+        return ChainedRepresentatives
+
+    def _fixture(self):
+        obj = self._cut(Meeting())
+        for userid in ('a', 'b', 'c', 'd'):
+            obj.enable_representative(userid)
+        obj.represent('b', 'a')
+        obj.represent('c', 'b')
+        return obj
+
     def test_verify_object(self):
-        vote = _voting_fixture(self.config)
-        self.failUnless(verifyObject(ILiquidVoter, self._cut(vote)))
- 
-    def test_adjust_owner(self):
-        vote = _voting_fixture(self.config)
-        vote.creators = ['someone_else']
-        obj = self._cut(vote)
-        obj.adjust_owner('one')
-        self.assertIn('one', vote.creators)
-        self.assertNotIn('someone_else', vote.creators)
- 
-    def test_adjust_vote_new_vote(self):
-        vote = _voting_fixture(self.config)
-        obj = self._cut(vote)
-        obj.repr.enable_representative('one')
-        obj.repr.represent('one', 'other')
-        obj.adjust_vote('other')
-        poll = vote.__parent__
-        self.assertIn('other', poll)
-        self.assertEqual(poll['other'].get_vote_data(), {'a': 1, 'b': 2})
- 
-    def test_adjust_vote_existing(self):
-        vote = _voting_fixture(self.config)
-        poll = vote.__parent__
-        other = Vote(creators = ['one'])
-        other.set_vote_data({'c': 3}, notify = False)
-        poll['other'] = other
-        obj = self._cut(vote)
-        obj.adjust_vote('other')
-        self.assertIn('other', poll)
-        self.assertEqual(poll['other'].get_vote_data(), {'a': 1, 'b': 2})
+        self.failUnless(verifyObject(IRepresentatives, self._cut(Meeting())))
 
-    def test_adjust_vote_wont_touch_delegators_own_votes(self):
-        vote = _voting_fixture(self.config)
-        poll = vote.__parent__
-        obj = self._cut(vote)
-        obj.repr.enable_representative('one')
-        obj.repr.represent('one', 'other')
-        other = Vote(creators = ['other'])
-        other.set_vote_data({'c': 3}, notify = False)
-        poll['other'] = other
-        obj = self._cut(other)
-        obj.adjust_vote('other')
-        self.assertEqual(vote.get_vote_data(), {'a': 1, 'b': 2})
-        self.assertEqual(other.get_vote_data(), {'c': 3})
-        self.assertEqual(obj.repr.represented_by('other'), 'one')
+    def test_resolve(self):
+        obj = self._fixture()
+        self.assertEqual(obj.resolve('a'), 'c')
+        self.assertEqual(obj.resolve('b'), 'c')
+        self.assertEqual(obj.resolve('c'), None)
+
+    def test_weight(self):
+        obj = self._fixture()
+        self.assertEqual(obj.weight('c'), 2)
+        self.assertEqual(obj.weight('b'), 1)
+        self.assertEqual(obj.weight('a'), 0)
+
+    def test_ranked(self):
+        obj = self._fixture()
+        self.assertEqual(obj.ranked(), ((-2, 'c'), (-1, 'b'), (0, 'a'), (0, 'd')))
+
+    def test_enable_keeps_representative(self):
+        obj = self._fixture()
+        self.assertEqual(obj.represented_by('b'), 'c')
+
+    def test_cycle_rejected(self):
+        obj = self._fixture()
+        self.assertFalse(obj.can_represent('a', 'c'))
+        self.assertRaises(AssertionError, obj.represent, 'a', 'c')
+
+    def test_max_depth(self):
+        self.config.registry.settings['voteit.liquid.max_depth'] = '2'
+        obj = self._fixture()
+        self.assertFalse(obj.can_represent('d', 'c'))
+        self.assertTrue(obj.can_represent('d', 'a'))
+
+    def test_height_limit(self):
+        obj = self._fixture()
+        self.assertEqual(obj.height('c'), 2)
+        self.assertEqual(obj.height('c', limit = 0), 1)
+        self.assertEqual(obj.height('c', limit = 5), 2)
+
+    def test_moving_subtree(self):
+        obj = self._fixture()
+        obj.represent('d', 'b')
+        self.assertEqual(obj.resolve('a'), 'd')
+        self.assertEqual(obj.weight('d'), 2)
+        self.assertEqual(obj.weight('c'), 0)
+
+    def test_release(self):
+        obj = self._fixture()
+        obj.release('b')
+        self.assertEqual(obj.resolve('a'), 'b')
+        self.assertEqual(obj.resolve('b'), None)
+        self.assertEqual(obj.weight('c'), 0)
+
+    def test_disable_representative(self):
+        obj = self._fixture()
+        obj.disable_representative('b')
+        self.assertEqual(obj.resolve('a'), None)
+        self.assertEqual(obj.resolve('b'), 'c')
+        self.assertEqual(obj.weight('c'), 1)
+
+
+class CompactRepresentativesTests(TestCase):
 
- 
-class SimpleAdjustVotesTests(TestCase):
- 
     def setUp(self):
         self.config = testing.setUp()
-        
+
     def tearDown(self):
         testing.tearDown()
- 
+
     @property
     def _cut(self):
-        from voteit.liquid.models import SimpleAdjustVotes
-        return SimpleAdjustVotes
- 
+        from voteit.liquid.compact import CompactRepresentatives
+        return CompactRepresentatives
+
     def test_verify_class(self):
-        self.failUnless(verifyClass(ILiquidVoter, self._cut))
- 
+        self.failUnless(verifyClass(IRepresentatives, self._cut))
+
     def test_verify_object(self):
-        self.config.include('voteit.liquid.models')
-        vote = _voting_fixture(self.config)
-        self.failUnless(verifyObject(ILiquidVoter, self._cut(vote)))
+        self.failUnless(verifyObject(IRepresentatives, self._cut(Meeting())))
 
-    def test_delegators_without_voting_perm(self):
-        vote = _voting_fixture(self.config)
-        self.config.testing_securitypolicy(userid = 'jane')
-        poll = vote.__parent__
-        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+    def test_set_and_get(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two', 'three')
+        obj['four'] = ('two',)
+        self.assertEqual(obj['one'], ('three',))
+        self.assertEqual(obj['four'], ('two',))
+        self.assertEqual(obj.represented_by('two'), 'four')
+        self.assertEqual(obj.count('one'), 1)
+        self.assertEqual(obj.total_delegations(), 2)
+
+    def test_stores_integers(self):
+        meeting = Meeting()
+        obj = self._cut(meeting)
+        obj['one'] = ('two',)
+        ids = obj.ids_data
+        self.assertEqual(list(obj.reverse_data.items()), [(ids['two'], ids['one'])])
+        self.assertIsInstance(ids['one'], int)
+        self.assertFalse(hasattr(meeting, '__representatives_data__'))
+
+    def test_new_ids_not_reused(self):
+        obj = self._cut(Meeting())
+        obj.enable_representative('one')
+        obj._nextid = obj.ids_data['one']
+        obj.enable_representative('two')
+        self.assertNotEqual(obj.ids_data['one'], obj.ids_data['two'])
+        self.assertEqual(obj.userids_data[obj.ids_data['two']], 'two')
+
+    def test_disable_representative_releases_represented(self):
+        obj = self._cut(Meeting())
+        obj.enable_representative('one')
+        obj.represent('one', 'two')
+        obj.disable_representative('one')
+        self.assertNotIn('one', obj)
+        self.assertEqual(obj.represented_by('two'), None)
+        self.assertEqual(obj.total_delegations(), 0)
+
+    def test_keys_sorted_by_userid(self):
+        obj = self._cut(Meeting())
+        for userid in ('c', 'a', 'b'):
+            obj.enable_representative(userid)
+        obj.represent('a', 'x')
+        self.assertEqual(list(obj.keys()), ['a', 'b', 'c'])
+        self.assertEqual(list(obj.keys('a', None, excludemin = True)), ['b', 'c'])
+
+    def test_snapshot(self):
+        obj = self._cut(Meeting())
+        obj['one'] = ('two',)
+        snapshot = obj.snapshot()
+        obj.represent('one', 'three')
+        obj.release('two')
+        self.assertEqual(snapshot['one'], ('two',))
+        self.assertEqual(snapshot.represented_by('two'), 'one')
+        self.assertEqual(obj['one'], ('three',))
+
+    def test_registered_with_setting(self):
+        self.config.registry.settings['voteit.liquid.storage'] = 'compact'
         self.config.include('voteit.liquid.models')
-        obj = self._cut(vote)
-        repr = IRepresentatives(obj.meeting)
-        repr['jane'] = ('james', 'john')
-        new_v = Vote(creators = ['jane'])
-        new_v.set_vote_data({'a': 1}, notify = False)
-        poll['jane'] = new_v
-        self.assertNotIn('james', poll)
+        self.assertIsInstance(IRepresentatives(Meeting()), self._cut)
 
-    def test_delegators_get_votes(self):
-        self.config.include('pyramid_chameleon')
-        vote = _voting_fixture(self.config)
-        self.config.testing_securitypolicy(userid = 'jane')
-        poll = vote.__parent__
-        unrestricted_wf_transition_to(poll, 'ongoing')
-        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+    def test_not_with_chained(self):
+        from pyramid.exceptions import ConfigurationError
+        self.config.registry.settings['voteit.liquid.storage'] = 'compact'
+        self.config.registry.settings['voteit.liquid.type'] = 'chained'
+        self.assertRaises(ConfigurationError, self.config.include, 'voteit.liquid.models')
+
+
+class BulkTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
         self.config.include('voteit.liquid.models')
-        obj = self._cut(vote)
-        root = obj.meeting.__parent__
-        root.users['james'] = User()
-        root.users['john'] = User()
-        obj.meeting.add_groups('james', ['role:Voter'])
-        obj.meeting.add_groups('john', ['role:Voter'])
-        repr = IRepresentatives(obj.meeting)
-        repr['jane'] = ('james', 'john')
-        new_v = Vote(creators = ['jane'])
-        new_v.set_vote_data({'a': 1}, notify = False)
-        poll['jane'] = new_v
-        self.assertIn('james', poll)
-        self.assertIn('john', poll)
-        self.assertEqual(poll['james'].get_vote_data(), {'a': 1})
 
-    def test_call_adjusts_ownership_for_delegators_who_vote(self):
-        vote = _voting_fixture(self.config)
-        poll = vote.__parent__
-        poll['jane'] = v2 = Vote(creators = ['someone'])
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self):
+        meeting = Meeting()
+        repr = IRepresentatives(meeting)
+        repr.enable_representative('jane')
+        repr.represent('jane', 'james')
+        return meeting
+
+    def test_read_csv(self):
+        from io import StringIO
+        from voteit.liquid.bulk import read_csv
+        stream = StringIO(u"representative,delegator\njane, james\n\nanna,john\n")
+        self.assertEqual(list(read_csv(stream)), [(2, 'jane', 'james'), (4, 'anna', 'john')])
+
+    def test_read_csv_bad_row(self):
+        from io import StringIO
+        from voteit.liquid.bulk import read_csv
+        self.assertRaises(ValueError, list, read_csv(StringIO(u"jane\n")))
+
+    def test_read_jsonl(self):
+        from io import StringIO
+        from voteit.liquid.bulk import read_jsonl
+        stream = StringIO(u'{"representative": "jane", "delegator": "james"}\n["anna", "john"]\n')
+        self.assertEqual(list(read_jsonl(stream)), [(1, 'jane', 'james'), (2, 'anna', 'john')])
+
+    def test_validate(self):
+        from voteit.liquid.bulk import validate
+        repr = IRepresentatives(self._fixture())
+        rows = [(1, 'jane', 'john'), (2, 'anna', 'jeff'), (3, 'jane', 'john'), (4, 'jane', 'jane')]
+        pairs, errors = validate(repr, rows)
+        self.assertEqual(pairs, (('jane', 'john'),))
+        self.assertEqual([line for (line, message) in errors], [2, 3, 4])
+
+    def test_validate_representative_as_delegator(self):
+        from voteit.liquid.bulk import validate
+        repr = IRepresentatives(self._fixture())
+        pairs, errors = validate(repr, [(1, 'anna', 'jane'), (2, 'jane', 'anna')], enable = True)
+        self.assertEqual([line for (line, message) in errors], [1, 2])
+
+    def test_import_sends_one_event(self):
+        from voteit.liquid.bulk import import_delegations
+        from voteit.liquid.interfaces import IDelegationsEnabled
+        meeting = self._fixture()
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IDelegationsEnabled)
+        self.config.add_subscriber(lambda event: L.append(event), IDelegationEnabled)
+        rows = [(1, 'anna', 'james'), (2, 'anna', 'john'), (3, 'jane', 'jeff')]
+        pairs, errors = import_delegations(meeting, rows, enable = True)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(L), 1)
+        self.assertEqual(L[0].delegations, pairs)
+        repr = IRepresentatives(meeting)
+        self.assertEqual(repr.represented_by('james'), 'anna')
+        self.assertEqual(sorted(repr.delegations()), [('anna', 'james'), ('anna', 'john'), ('jane', 'jeff')])
+
+    def test_import_nothing_on_errors(self):
+        from voteit.liquid.bulk import import_delegations
+        meeting = self._fixture()
+        pairs, errors = import_delegations(meeting, [(1, 'jane', 'john'), (2, 'anna', 'jeff')])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(IRepresentatives(meeting).represented_by('john'), None)
+
+    def test_export_roundtrip(self):
+        from io import StringIO
+        from voteit.liquid.bulk import export_delegations
+        from voteit.liquid.bulk import read_jsonl
+        stream = StringIO()
+        export_delegations(self._fixture(), stream, 'jsonl')
+        stream.seek(0)
+        self.assertEqual(list(read_jsonl(stream)), [(1, 'jane', 'james')])
+
+    def test_chained_cycle(self):
+        from voteit.liquid.bulk import validate
+        from voteit.liquid.models import ChainedRepresentatives
+        repr = ChainedRepresentatives(Meeting())
+        for userid in ('a', 'b', 'c'):
+            repr.enable_representative(userid)
+        repr.represent('b', 'a')
+        self.assertEqual(len(validate(repr, [(1, 'a', 'b')])[1]), 1)
+        self.assertEqual(validate(repr, [(1, 'a', 'b'), (2, 'c', 'a')])[1], [])
+
+    def test_import_chained_top_down(self):
+        from voteit.liquid.bulk import import_delegations
+        from voteit.liquid.models import ChainedRepresentatives
+        self.config.registry.registerAdapter(ChainedRepresentatives)
+        meeting = Meeting()
+        repr = IRepresentatives(meeting)
+        for userid in ('a', 'b', 'c'):
+            repr.enable_representative(userid)
+        repr.represent('b', 'a')
+        #Storing a -> b before b's delegation is gone would be a cycle
+        pairs, errors = import_delegations(meeting, [(1, 'a', 'b'), (2, 'c', 'a')], chunk_size = 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(repr.resolve('b'), 'c')
+        self.assertEqual(repr.resolve('a'), 'c')
+
+    def test_failed_import_keeps_old_delegations(self):
+        from voteit.liquid.bulk import import_delegations
+        from voteit.liquid.models import Representatives
+        meeting = self._fixture()
+        IRepresentatives(meeting).represent('jane', 'john')
+        calls = []
+        original = Representatives.represent_many
+        def represent_many(repr, pairs):
+            calls.append(pairs)
+            if len(calls) > 1:
+                raise ValueError()
+            return original(repr, pairs)
+        Representatives.represent_many = represent_many
+        try:
+            rows = [(1, 'anna', 'james'), (2, 'anna', 'john')]
+            self.assertRaises(ValueError, import_delegations, meeting, rows, enable = True, chunk_size = 1)
+        finally:
+            Representatives.represent_many = original
+        repr = IRepresentatives(meeting)
+        self.assertEqual(repr.represented_by('james'), 'anna')
+        self.assertEqual(repr.represented_by('john'), 'jane')
+
+
+class VerifyTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
         self.config.include('voteit.liquid.models')
-        obj = self._cut(v2)
-        obj.adjust_owner('jane')
-        self.assertIn('jane', v2.creators)
-        self.assertNotIn('someone', v2.creators)
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self, factory = None):
+        from voteit.liquid.models import Representatives
+        repr = (factory or Representatives)(Meeting())
+        repr.enable_representative('jane')
+        repr.enable_representative('john')
+        repr.represent('jane', 'james')
+        repr.represent('john', 'joe')
+        return repr
+
+    def _kinds(self, repr):
+        return sorted([problem[0] for problem in repr.verify()])
+
+    def test_consistent(self):
+        self.assertEqual(self._kinds(self._fixture()), [])
+
+    def test_dangling_reverse(self):
+        from voteit.liquid.models import DANGLING_REVERSE
+        repr = self._fixture()
+        repr.reverse_data['ghost'] = 'jane'
+        self.assertEqual(self._kinds(repr), [DANGLING_REVERSE])
+        self.assertEqual(repr.repair(list(repr.verify())), 1)
+        self.assertEqual(repr.represented_by('ghost'), None)
+        self.assertEqual(self._kinds(repr), [])
+
+    def test_missing_reverse(self):
+        from voteit.liquid.models import MISSING_REVERSE
+        repr = self._fixture()
+        del repr.reverse_data['james']
+        self.assertEqual(self._kinds(repr), [MISSING_REVERSE])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(repr.represented_by('james'), 'jane')
+
+    def test_duplicate_delegator(self):
+        from voteit.liquid.models import DUPLICATE_DELEGATOR
+        repr = self._fixture()
+        repr._delegators('john').add('james')
+        self.assertEqual(self._kinds(repr), [DUPLICATE_DELEGATOR])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(tuple(repr['john']), ('joe',))
+        self.assertEqual(self._kinds(repr), [])
+
+    def test_counts(self):
+        from voteit.liquid.models import WRONG_COUNT
+        from voteit.liquid.models import WRONG_TOTAL
+        repr = self._fixture()
+        repr.counts_data['jane'].change(2)
+        repr.total_data.change(-1)
+        self.assertEqual(self._kinds(repr), [WRONG_COUNT, WRONG_TOTAL])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(repr.count('jane'), 1)
+        self.assertEqual(repr.total_delegations(), 2)
+
+    def test_missing_counter(self):
+        from voteit.liquid.models import WRONG_COUNT
+        repr = self._fixture()
+        repr.enable_representative('joe')
+        del repr.counts_data['joe']
+        self.assertEqual(self._kinds(repr), [WRONG_COUNT])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(self._kinds(repr), [])
+        repr.represent('joe', 'jim')
+        self.assertEqual(repr.count('joe'), 1)
+
+    def test_repair_checks_again(self):
+        repr = self._fixture()
+        repr.reverse_data['ghost'] = 'jane'
+        problems = list(repr.verify())
+        del repr.reverse_data['ghost']
+        self.assertEqual(repr.repair(problems), 0)
+
+    def test_chained(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        from voteit.liquid.models import WRONG_RESOLVED
+        from voteit.liquid.models import WRONG_WEIGHT
+        repr = self._fixture(ChainedRepresentatives)
+        repr.resolved_data['james'] = 'john'
+        repr.weight_data['jane'].set(5)
+        self.assertEqual(self._kinds(repr), [WRONG_RESOLVED, WRONG_WEIGHT])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(repr.resolve('james'), 'jane')
+        self.assertEqual(repr.weight('jane'), 1)
+
+    def test_chained_loop_in_data(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        from voteit.liquid.models import CYCLE
+        from voteit.liquid.models import MISSING_REVERSE
+        repr = ChainedRepresentatives(Meeting())
+        for userid in ('a', 'b', 'c'):
+            repr.enable_representative(userid)
+        repr.represent('a', 'b')
+        repr.represent('b', 'c')
+        repr.data['c'].insert('a')
+        self.assertEqual(len(list(repr.subtree('a'))), 2)
+        self.assertEqual(repr.height('a'), 2)
+        kinds = self._kinds(repr)
+        self.assertIn(MISSING_REVERSE, kinds)
+        self.assertIn(CYCLE, kinds)
+        repr.repair(list(repr.verify()))
+        self.assertEqual(self._kinds(repr), [])
+        self.assertEqual(tuple(repr['c']), ())
+        self.assertEqual(repr.weight('a'), 2)
+
+    def test_compact_format(self):
+        from voteit.liquid.compact import CompactRepresentatives
+        repr = self._fixture(CompactRepresentatives)
+        repr.reverse_data[repr._intern('ghost')] = repr._id('jane')
+        problems = list(repr.verify())
+        self.assertEqual(len(problems), 1)
+        self.assertIn("'ghost'", repr.format_problem(problems[0]))
+        repr.repair(problems)
+        self.assertEqual(self._kinds(repr), [])
+
+    def test_compact_format_expiry(self):
+        from voteit.liquid.compact import CompactRepresentatives
+        repr = self._fixture(CompactRepresentatives)
+        repr.expiry_data.insert((1893456000.0, 'ghost'))
+        problems = list(repr.verify())
+        self.assertEqual(len(problems), 1)
+        self.assertIn("'ghost'", repr.format_problem(problems[0]))
+
+    def test_script_check_and_repair(self):
+        try:
+            from StringIO import StringIO
+        except ImportError: #pragma : no cover
+            from io import StringIO
+        from voteit.liquid.verify import check
+        from voteit.liquid.verify import repair
+        meeting = Meeting()
+        repr = IRepresentatives(meeting)
+        repr.enable_representative('jane')
+        repr.reverse_data['ghost'] = 'jane'
+        out = StringIO()
+        problems_file = StringIO()
+        self.assertEqual(check(meeting, out, problems_file), 1)
+        self.assertIn('ghost', out.getvalue())
+        problems_file.seek(0)
+        self.assertEqual(repair(meeting, problems_file, batch_size = 1), 1)
+        self.assertEqual(check(meeting, StringIO()), 0)
+
+
+class ExpiryTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('voteit.liquid.models')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self, factory = None):
+        from voteit.liquid.models import Representatives
+        repr = (factory or Representatives)(Meeting())
+        repr.enable_representative('jane')
+        return repr
+
+    def test_expired_not_returned(self):
+        from time import time
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = time() - 1)
+        repr.represent('jane', 'joe', expires = time() + 100)
+        self.assertEqual(repr.represented_by('james'), None)
+        self.assertEqual(repr.represented_by('joe'), 'jane')
+
+    def test_datetime(self):
+        from datetime import datetime
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = datetime(2030, 1, 1))
+        self.assertEqual(repr.expires('james'), 1893456000.0)
+
+    def test_release_expired(self):
+        from time import time
+        now = time()
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = now - 10)
+        repr.represent('jane', 'joe', expires = now + 100)
+        repr.represent('jane', 'jim')
+        self.assertEqual(repr.release_expired(now = now), (('jane', 'james'),))
+        self.assertEqual(repr.release_expired(now = now), ())
+        self.assertEqual(tuple(repr['jane']), ('jim', 'joe'))
+        self.assertEqual(repr.expires('james'), None)
+
+    def test_release_expired_limit(self):
+        repr = self._fixture()
+        repr.represent_many([('jane', 'james'), ('jane', 'joe')], expires = 10)
+        self.assertEqual(len(repr.release_expired(now = 15, limit = 1)), 1)
+        self.assertEqual(len(repr.expiry_data), 1)
+
+    def test_represent_again_replaces_expiry(self):
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = 10)
+        repr.represent('jane', 'james')
+        self.assertEqual(repr.expires('james'), None)
+        self.assertEqual(repr.release_expired(now = 15), ())
+
+    def test_release_forgets_expiry(self):
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = 10)
+        repr.release('james')
+        self.assertEqual(len(repr.expiry_data), 0)
+
+    def test_expiring_changes_cache_key(self):
+        from time import time
+        from voteit.liquid import models
+        now = time()
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = now + 100)
+        key = repr.cache_key()
+        self.assertEqual(repr.count('jane'), 1)
+        self.assertEqual(repr.cache_key(), key)
+        original = models.time
+        models.time = lambda: now + 200
+        try:
+            self.assertNotEqual(repr.cache_key(), key)
+            self.assertEqual(repr.count('jane'), 0)
+        finally:
+            models.time = original
+
+    def test_compact(self):
+        from voteit.liquid.compact import CompactRepresentatives
+        repr = self._fixture(CompactRepresentatives)
+        repr.represent('jane', 'james', expires = 10)
+        self.assertEqual(repr.represented_by('james'), None)
+        self.assertEqual(repr.release_expired(now = 15), (('jane', 'james'),))
+        self.assertEqual(repr.count('jane'), 0)
+
+    def test_chained_resolve(self):
+        from time import time
+        from voteit.liquid.models import ChainedRepresentatives
+        repr = self._fixture(ChainedRepresentatives)
+        repr.enable_representative('james')
+        repr.represent('jane', 'james', expires = time() - 1)
+        repr.represent('james', 'joe')
+        self.assertEqual(repr.resolve('joe'), 'james')
+        self.assertEqual(repr.resolve('james'), None)
+        repr.release_expired()
+        self.assertEqual(repr.weight('jane'), 0)
+
+    def test_reads_leave_out_expired(self):
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = 10)
+        repr.represent('jane', 'joe')
+        self.assertEqual(repr.count('jane'), 1)
+        self.assertEqual(repr.total_delegations(), 1)
+        self.assertEqual(tuple(repr['jane']), ('joe',))
+        self.assertEqual(list(repr.delegations()), [('jane', 'joe')])
+        self.assertEqual(len(repr.expiry_data), 1)
+
+    def test_snapshot_leaves_out_expired(self):
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = 10)
+        repr.represent('jane', 'joe')
+        snapshot = repr.snapshot()
+        self.assertEqual(tuple(snapshot['jane']), ('joe',))
+        self.assertEqual(snapshot.represented_by('james'), None)
+        self.assertEqual(tuple(repr._all_delegators('jane')), ('james', 'joe'))
+
+    def test_chained_weight(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        repr = self._fixture(ChainedRepresentatives)
+        repr.enable_representative('james')
+        repr.represent('jane', 'james', expires = 10)
+        repr.represent('james', 'joe')
+        self.assertEqual(repr.weight('jane'), 0)
+        self.assertEqual(repr.weight('james'), 1)
+
+    def test_chained_expired_link_isnt_a_cycle(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        repr = self._fixture(ChainedRepresentatives)
+        repr.enable_representative('james')
+        repr.represent('james', 'jane', expires = 10)
+        self.assertTrue(repr.can_represent('jane', 'james'))
+        repr.represent('jane', 'james')
+        self.assertEqual(repr.resolve('james'), 'jane')
+        self.assertEqual(repr.represented_by('jane'), None)
+        self.assertEqual(list(repr.verify()), [])
+
+    def test_verify(self):
+        from voteit.liquid.models import WRONG_EXPIRY
+        repr = self._fixture()
+        repr.represent('jane', 'james', expires = 10)
+        repr.expiry_data.insert((20, 'joe'))
+        self.assertEqual([problem[0] for problem in repr.verify()], [WRONG_EXPIRY])
+        repr.repair(list(repr.verify()))
+        self.assertEqual(list(repr.verify()), [])
+        self.assertEqual(repr.expires('james'), 10)
+
+    def test_script_release_expired(self):
+        from voteit.liquid.expiry import release_expired
+        meeting = Meeting()
+        repr = IRepresentatives(meeting)
+        repr.enable_representative('jane')
+        repr.represent_many([('jane', 'james'), ('jane', 'joe')], expires = 10)
+        self.assertEqual(release_expired(meeting, now = 15, chunk_size = 1), 2)
+        self.assertEqual(IRepresentatives(meeting).count('jane'), 0)
+
+
+class Evolve1Tests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _fut(self):
+        from voteit.liquid.evolve.evolve1 import evolve
+        return evolve
+
+    def test_converts_tuples(self):
+        from BTrees.OOBTree import OOBTree
+        from BTrees.OOBTree import OOTreeSet
+        from voteit.liquid.models import Representatives
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = m = Meeting()
+        m.__representatives_data__ = data = OOBTree()
+        data['one'] = ('two', 'three')
+        m.__representatives_data_dev__ = OOBTree({'two': 'one', 'three': 'one'})
+        self._fut(root)
+        self.assertIs(m.__representatives_data__, data)
+        self.assertIsInstance(data['one'], OOTreeSet)
+        obj = Representatives(m)
+        obj.release('two')
+        self.assertEqual(tuple(obj['one']), ('three',))
+
+
+class Evolve2Tests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_adds_counters(self):
+        from voteit.liquid.evolve.evolve2 import evolve
+        from voteit.liquid.models import Representatives
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = m = Meeting()
+        obj = Representatives(m)
+        obj['one'] = ('two', 'three')
+        obj['four'] = ()
+        del m.__representatives_counts__
+        del m.__representatives_total__
+        evolve(root)
+        self.assertEqual(obj.count('one'), 2)
+        self.assertEqual(obj.count('four'), 0)
+        self.assertEqual(obj.total_delegations(), 2)
+
+
+class Evolve4Tests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def test_adds_counters(self):
+        from voteit.liquid.evolve.evolve4 import evolve
+        from voteit.liquid.models import Representatives
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = m = Meeting()
+        obj = Representatives(m)
+        obj['one'] = ('two',)
+        obj['three'] = ()
+        del obj.counts_data['three']
+        evolve(root)
+        obj.represent('three', 'four')
+        self.assertEqual(obj.count('three'), 1)
+        self.assertEqual(obj.count('one'), 1)
+
+    def test_converts_weights(self):
+        from voteit.liquid.evolve.evolve4 import evolve
+        from voteit.liquid.models import ChainedRepresentatives
+        root = bootstrap_and_fixture(self.config)
+        root['m'] = m = Meeting()
+        obj = ChainedRepresentatives(m)
+        obj['one'] = ('two',)
+        obj['two'] = ('three',)
+        obj['four'] = ()
+        obj.weight_data['one'] = 2
+        obj.weight_data['two'] = 1
+        del obj.weight_data['four']
+        evolve(root)
+        obj.represent('four', 'five')
+        obj.represent('two', 'six')
+        self.assertEqual(obj.weight('one'), 3)
+        self.assertEqual(obj.weight('four'), 1)
+        self.assertEqual(list(obj.verify()), [])
+
+
+def _voting_fixture(config):
+    #Note: active_poll_fixture may clear registry.settings
+    from voteit.core.testing_helpers import active_poll_fixture
+    config.include('voteit.core.plugins.majority_poll')
+    root = active_poll_fixture(config)
+    poll = root['meeting']['ai']['poll']
+    poll.set_field_value('poll_plugin', 'majority_poll')
+    poll['one'] = vote = Vote(creators = ['one'])
+    vote.set_vote_data({'a': 1, 'b': 2}, notify = False)
+    return vote
+
+
+class ProxyVotesTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.models import ProxyVotes
+        return ProxyVotes
+
+    def test_verify_object(self):
+        from voteit.liquid.interfaces import IProxyVotes
+        vote = _voting_fixture(self.config)
+        self.failUnless(verifyObject(IProxyVotes, self._cut(vote.__parent__)))
+
+    def test_add(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote.__parent__)
+        obj.add('james', 'jane')
+        obj.add('john', 'jane')
+        self.assertEqual(obj.representative_for('james'), 'jane')
+        self.assertEqual(tuple(obj.cast_by('jane')), ('james', 'john'))
+        self.assertIn('james', obj)
+        self.assertEqual(len(obj), 2)
+
+    def test_add_other_representative(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote.__parent__)
+        obj.add('james', 'jane')
+        obj.add('james', 'jeff')
+        self.assertEqual(tuple(obj.cast_by('jane')), ())
+        self.assertEqual(tuple(obj.cast_by('jeff')), ('james',))
+
+    def test_remove(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote.__parent__)
+        obj.remove('james')
+        obj.add('james', 'jane')
+        obj.remove('james')
+        self.assertNotIn('james', obj)
+        self.assertEqual(tuple(obj.cast_by('jane')), ())
+
+    def test_reading_doesnt_write_to_poll(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote.__parent__)
+        self.assertNotIn('james', obj)
+        self.assertFalse(hasattr(vote.__parent__, '__liquid_proxies__'))
+
+    def test_kept_up_to_date(self):
+        from voteit.liquid.interfaces import IProxyVotes
+        from voteit.liquid.models import LiquidVoter
+        self.config.include('voteit.liquid.models')
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = LiquidVoter(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        proxies = IProxyVotes(poll)
+        self.assertEqual(tuple(proxies.cast_by('one')), ('other', 'third'))
+        LiquidVoter(poll['other']).adjust_owner('other')
+        self.assertNotIn('other', proxies)
+        del poll['third']
+        self.assertEqual(len(proxies), 0)
+
+
+class LiquidVoterTests(TestCase):
+ 
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('voteit.liquid.models')
+ 
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.models import LiquidVoter
+        return LiquidVoter
+ 
+    def test_verify_class(self):
+        self.failUnless(verifyClass(ILiquidVoter, self._cut))
+ 
+    def test_verify_object(self):
+        vote = _voting_fixture(self.config)
+        self.failUnless(verifyObject(ILiquidVoter, self._cut(vote)))
+ 
+    def test_adjust_owner(self):
+        vote = _voting_fixture(self.config)
+        vote.creators = ['someone_else']
+        obj = self._cut(vote)
+        obj.adjust_owner('one')
+        self.assertIn('one', vote.creators)
+        self.assertNotIn('someone_else', vote.creators)
+ 
+    def test_adjust_vote_new_vote(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote)
+        obj.repr.enable_representative('one')
+        obj.repr.represent('one', 'other')
+        obj.adjust_vote('other')
+        poll = vote.__parent__
+        self.assertIn('other', poll)
+        self.assertEqual(poll['other'].get_vote_data(), {'a': 1, 'b': 2})
+ 
+    def test_adjust_vote_existing(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        other = Vote(creators = ['one'])
+        other.set_vote_data({'c': 3}, notify = False)
+        poll['other'] = other
+        obj = self._cut(vote)
+        obj.adjust_vote('other')
+        self.assertIn('other', poll)
+        self.assertEqual(poll['other'].get_vote_data(), {'a': 1, 'b': 2})
+
+    def test_adjust_vote_unchanged_skipped(self):
+        from voteit.liquid.models import VOTE_ADDED
+        from voteit.liquid.models import VOTE_UNCHANGED
+        L = []
+        def subscriber(event):
+            L.append(event)
+        self.config.add_subscriber(subscriber, IRepresentativeChangedVote)
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote)
+        obj.repr.enable_representative('one')
+        obj.repr.represent('one', 'other')
+        self.assertEqual(obj.adjust_vote('other'), VOTE_ADDED)
+        obj = self._cut(vote)
+        self.assertEqual(obj.adjust_vote('other'), VOTE_UNCHANGED)
+        self.assertEqual(L, [])
+
+    def test_adjust_vote_changed_data(self):
+        from voteit.liquid.models import VOTE_CHANGED
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote)
+        obj.repr.enable_representative('one')
+        obj.repr.represent('one', 'other')
+        obj.adjust_vote('other')
+        vote.set_vote_data({'a': 2}, notify = False)
+        obj = self._cut(vote)
+        self.assertEqual(obj.adjust_vote('other'), VOTE_CHANGED)
+        self.assertEqual(vote.__parent__['other'].get_vote_data(), {'a': 2})
+
+    def test_adjust_votes_counts(self):
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        self.assertEqual(obj.adjust_votes(['other', 'third'])['added'], 2)
+        obj = self._cut(vote)
+        self.assertEqual(obj.adjust_votes(['other', 'third'])['unchanged'], 2)
+
+    def test_adjust_votes_sends_bulk_event(self):
+        from voteit.liquid.interfaces import IRepresentativeVotesPropagated
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IRepresentativeVotesPropagated)
+        self.config.add_subscriber(lambda event: L.append(event), IRepresentativeAddedVote)
+        vote = _voting_fixture(self.config)
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        self.assertEqual(len(L), 1)
+        self.assertEqual(L[0].added, ('other', 'third'))
+        self.assertEqual(L[0].changed, ())
+        self.assertEqual(L[0].representative, 'one')
+        obj = self._cut(vote)
+        obj.adjust_votes(['other', 'third'])
+        self.assertEqual(len(L), 1)
+
+    def test_adjust_votes_item_events(self):
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IRepresentativeAddedVote)
+        vote = _voting_fixture(self.config)
+        self.config.registry.settings['voteit.liquid.item_events'] = 'true'
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        self.assertEqual([x.delegator for x in L], ['other', 'third'])
+
+    def test_proxied_votes_share_payload(self):
+        from voteit.liquid.models import ProxyVote
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        self.assertIsInstance(poll['other'], ProxyVote)
+        self.assertIs(poll['other'].payload, vote.__liquid_payload__)
+        self.assertIs(poll['third'].payload, vote.__liquid_payload__)
+
+    def test_shared_payload_updated(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other',)
+        obj.adjust_votes(['other'])
+        payload = vote.__liquid_payload__
+        vote.set_vote_data({'a': 2}, notify = False)
+        obj = self._cut(vote)
+        obj.adjust_votes(['other'])
+        self.assertIsNot(vote.__liquid_payload__, payload)
+        self.assertEqual(payload.vote_data, {'a': 1, 'b': 2})
+        self.assertEqual(poll['other'].get_vote_data(), {'a': 2})
+
+    def test_changed_payload_leaves_other_votes(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        vote.set_vote_data({'a': 2}, notify = False)
+        obj = self._cut(vote)
+        obj.adjust_votes(['other'])
+        self.assertEqual(poll['other'].get_vote_data(), {'a': 2})
+        self.assertEqual(poll['third'].get_vote_data(), {'a': 1, 'b': 2})
+
+    def test_proxy_vote_data_is_a_copy(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other', 'third')
+        obj.adjust_votes(['other', 'third'])
+        poll['other'].get_vote_data()['a'] = 5
+        self.assertEqual(poll['third'].get_vote_data(), {'a': 1, 'b': 2})
+
+    def test_proxy_vote_set_vote_data_detaches(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr['one'] = ('other',)
+        obj.adjust_votes(['other'])
+        poll['other'].set_vote_data({'c': 3}, notify = False)
+        self.assertEqual(poll['other'].payload, None)
+        self.assertEqual(poll['other'].get_vote_data(), {'c': 3})
+        self.assertEqual(vote.get_vote_data(), {'a': 1, 'b': 2})
+
+    def test_vote_fingerprint(self):
+        from voteit.liquid.models import vote_fingerprint
+        self.assertEqual(vote_fingerprint({'a': [1, 2], 'b': 2}), vote_fingerprint({'b': 2, 'a': [1, 2]}))
+        self.assertNotEqual(vote_fingerprint({'a': 1}), vote_fingerprint({'a': 2}))
+
+    def test_adjust_vote_wont_touch_delegators_own_votes(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        obj = self._cut(vote)
+        obj.repr.enable_representative('one')
+        obj.repr.represent('one', 'other')
+        other = Vote(creators = ['other'])
+        other.set_vote_data({'c': 3}, notify = False)
+        poll['other'] = other
+        obj = self._cut(other)
+        obj.adjust_vote('other')
+        self.assertEqual(vote.get_vote_data(), {'a': 1, 'b': 2})
+        self.assertEqual(other.get_vote_data(), {'c': 3})
+        self.assertEqual(obj.repr.represented_by('other'), 'one')
+
+ 
+class SimpleAdjustVotesTests(TestCase):
+ 
+    def setUp(self):
+        self.config = testing.setUp()
+        
+    def tearDown(self):
+        testing.tearDown()
+ 
+    @property
+    def _cut(self):
+        from voteit.liquid.models import SimpleAdjustVotes
+        return SimpleAdjustVotes
+ 
+    def test_verify_class(self):
+        self.failUnless(verifyClass(ILiquidVoter, self._cut))
+ 
+    def test_verify_object(self):
+        self.config.include('voteit.liquid.models')
+        vote = _voting_fixture(self.config)
+        self.failUnless(verifyObject(ILiquidVoter, self._cut(vote)))
+
+    def test_delegators_without_voting_perm(self):
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('voteit.liquid.models')
+        obj = self._cut(vote)
+        repr = IRepresentatives(obj.meeting)
+        repr['jane'] = ('james', 'john')
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        self.assertNotIn('james', poll)
+
+    def test_delegators_get_votes(self):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('voteit.liquid.models')
+        obj = self._cut(vote)
+        root = obj.meeting.__parent__
+        root.users['james'] = User()
+        root.users['john'] = User()
+        obj.meeting.add_groups('james', ['role:Voter'])
+        obj.meeting.add_groups('john', ['role:Voter'])
+        repr = IRepresentatives(obj.meeting)
+        repr['jane'] = ('james', 'john')
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        self.assertIn('james', poll)
+        self.assertIn('john', poll)
+        self.assertEqual(poll['james'].get_vote_data(), {'a': 1})
+
+    def test_call_doesnt_look_up_representatives(self):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('voteit.liquid.models')
+        meeting = poll.__parent__.__parent__
+        meeting.__parent__.users['james'] = User()
+        meeting.add_groups('james', ['role:Voter'])
+        IRepresentatives(meeting)['jane'] = ('james',)
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        new_v.set_vote_data({'b': 2}, notify = False)
+        obj = self._cut(new_v)
+        #The voter is the representative, so reverse lookups aren't needed
+        obj.repr.represented_by = lambda userid: self.fail("Looked up %r" % userid)
+        obj('jane')
+        self.assertEqual(poll['james'].get_vote_data(), {'b': 2})
+
+    def test_call_adjusts_ownership_for_delegators_who_vote(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        poll['jane'] = v2 = Vote(creators = ['someone'])
+        self.config.include('voteit.liquid.models')
+        obj = self._cut(v2)
+        obj.adjust_owner('jane')
+        self.assertIn('jane', v2.creators)
+        self.assertNotIn('someone', v2.creators)
+
+
+class HandleVotesTests(TestCase):
+
+    def setUp(self):
+        self.request = testing.DummyRequest()
+        self.config = testing.setUp(request = self.request)
+        self.config.registry.settings['voteit.liquid.type'] = 'dummy'
+        self.config.testing_securitypolicy(userid = 'jane')
+        self.calls = calls = []
+
+        class _DummyVoter(object):
+            def __init__(self, context):
+                self.context = context
+            def __call__(self, voter):
+                calls.append(voter)
+
+        self.config.registry.registerAdapter(_DummyVoter, (IVote,), ILiquidVoter, name = 'dummy')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _fut(self):
+        from voteit.liquid.models import handle_votes
+        return handle_votes
+
+    def test_calls_adapter(self):
+        self._fut(Vote(), None)
+        self.assertEqual(self.calls, ['jane'])
+
+    def test_nested_propagation_ignored(self):
+        from voteit.liquid.models import propagating
+        vote = Vote()
+        with propagating(self.request, vote):
+            self._fut(Vote(), None)
+        self.assertEqual(self.calls, [])
+        self._fut(Vote(), None)
+        self.assertEqual(self.calls, ['jane'])
+
+    def test_is_propagating(self):
+        from voteit.liquid.models import is_propagating
+        from voteit.liquid.models import propagating
+        self.assertFalse(is_propagating(self.request))
+        with propagating(self.request, Vote()):
+            self.assertTrue(is_propagating(self.request))
+        self.assertFalse(is_propagating(self.request))
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _enable(self, value = 'memory'):
+        from voteit.liquid.instrumentation import get_metrics
+        self.config.registry.settings['voteit.liquid.instrumentation'] = value
+        self.config.include('voteit.liquid.instrumentation')
+        return get_metrics()
+
+    def test_disabled_by_default(self):
+        from voteit.liquid.instrumentation import get_metrics
+        self.config.include('voteit.liquid.instrumentation')
+        self.assertEqual(get_metrics(), None)
+
+    def test_memory_metrics(self):
+        from voteit.liquid.instrumentation import MemoryMetrics
+        from voteit.liquid.interfaces import ILiquidMetrics
+        metrics = self._enable()
+        self.assertIsInstance(metrics, MemoryMetrics)
+        self.failUnless(verifyObject(ILiquidMetrics, metrics))
+
+    def test_log_metrics(self):
+        from voteit.liquid.instrumentation import LoggingMetrics
+        self.assertIsInstance(self._enable('log'), LoggingMetrics)
+
+    def test_dotted_name(self):
+        from voteit.liquid.instrumentation import LoggingMetrics
+        self.assertIsInstance(self._enable('voteit.liquid.instrumentation.LoggingMetrics'), LoggingMetrics)
+
+    def test_mutators_timed_and_events_counted(self):
+        from voteit.liquid.models import Representatives
+        metrics = self._enable()
+        obj = Representatives(Meeting())
+        obj.enable_representative('jane')
+        obj.represent('jane', 'james')
+        obj.release('james')
+        self.assertEqual(metrics.timings['representatives.represent'][0], 1)
+        self.assertIn('representatives.release', metrics.timings)
+        self.assertEqual(metrics.counters['events.DelegationEnabled'], 1)
+        self.assertEqual(metrics.counters['events.DelegationWillBeDisabled'], 1)
+
+    def test_propagation_counted(self):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        metrics = self._enable()
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('voteit.liquid.models')
+        meeting = poll.__parent__.__parent__
+        meeting.__parent__.users['james'] = User()
+        meeting.add_groups('james', ['role:Voter'])
+        IRepresentatives(meeting)['jane'] = ('james',)
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        self.assertEqual(metrics.counters['votes.added'], 1)
+        self.assertEqual(metrics.counters['votes.delegators'], 1)
+        self.assertIn('handle_votes', metrics.timings)
+        self.assertIn('liquid_voter.call', metrics.timings)
+        self.assertIn('find_authorized_userids', metrics.timings)
+
+
+class LogTests(TestCase):
+
+    def setUp(self):
+        from logging import getLogger
+        from logging import Handler
+        self.config = testing.setUp()
+        self.logger = getLogger('voteit.liquid')
+        self.records = records = []
+
+        class _Handler(Handler):
+            def emit(self, record):
+                records.append(record)
+
+        self.handler = _Handler()
+        self.old_level = self.logger.level
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.old_level)
+        testing.tearDown()
+
+    def test_lazy_path_not_computed_when_disabled(self):
+        from logging import INFO
+        from voteit.liquid.log import LazyPath
+
+        class _Resource(object):
+            @property
+            def __name__(self):
+                raise AssertionError("Path was computed")
+
+        self.logger.setLevel(INFO)
+        self.logger.debug("%s", LazyPath(_Resource()))
+        self.assertEqual(self.records, [])
+
+    def test_one_record_per_propagation(self):
+        from logging import INFO
+        from voteit.liquid.models import SimpleAdjustVotes
+        self.logger.setLevel(INFO)
+        vote = _voting_fixture(self.config)
+        self.config.include('voteit.liquid.models')
+        obj = SimpleAdjustVotes(vote)
+        obj.repr['one'] = ('other', 'third')
+        del self.records[:]
+        obj.adjust_votes(['other', 'third'])
+        self.assertEqual(len(self.records), 1)
+        self.assertEqual(self.records[0].liquid['added'], 2)
+        self.assertEqual(self.records[0].liquid['representative'], 'one')
+
+
+class GetLiquidVoterFactoryTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('voteit.liquid.models')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _fut(self):
+        from voteit.liquid.models import get_liquid_voter_factory
+        return get_liquid_voter_factory
+
+    def test_not_set(self):
+        self.assertEqual(self._fut(self.config.registry), None)
+
+    def test_lookup(self):
+        from voteit.liquid.models import SimpleAdjustVotes
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.assertEqual(self._fut(self.config.registry), SimpleAdjustVotes)
+
+    def test_setting_changed(self):
+        from voteit.liquid.models import ChainedAdjustVotes
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self._fut(self.config.registry)
+        self.config.registry.settings['voteit.liquid.type'] = 'chained'
+        self.assertEqual(self._fut(self.config.registry), ChainedAdjustVotes)
+
+    def test_bad_type_raises_configuration_error(self):
+        from pyramid.exceptions import ConfigurationError
+        from voteit.liquid.models import check_liquid_type
+        self.config.registry.settings['voteit.liquid.type'] = '404'
+        self.assertRaises(ConfigurationError, check_liquid_type, self.config.registry)
+
+    def test_include_checks_type(self):
+        from pyramid.exceptions import ConfigurationError
+        #setUp already included the models, and includes only run once
+        testing.tearDown()
+        self.config = testing.setUp(settings = {'voteit.liquid.type': '404'})
+        self.assertRaises(ConfigurationError, self.config.include, 'voteit.liquid.models')
+
+
+class AuthorizedUseridsTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _fut(self):
+        from voteit.liquid.models import authorized_userids
+        return authorized_userids
+
+    def test_cached_on_request(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        request = testing.DummyRequest()
+        first = self._fut(request, poll, ADD_VOTE)
+        self.assertIs(self._fut(request, poll, ADD_VOTE), first)
+        self.assertIn((poll.uid, ADD_VOTE), request._liquid_authorized)
+
+    def test_invalidated_on_update(self):
+        from voteit.liquid.models import invalidate_authorized_userids
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        request = testing.DummyRequest()
+        self.config.begin(request)
+        self._fut(request, poll, ADD_VOTE)
+        invalidate_authorized_userids(poll, None)
+        self.assertEqual(request._liquid_authorized, {})
+
+
+class ChainedAdjustVotesTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.models import ChainedAdjustVotes
+        return ChainedAdjustVotes
+
+    def test_verify_class(self):
+        self.failUnless(verifyClass(ILiquidVoter, self._cut))
+
+    def _fixture(self):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        self.config.registry.settings['voteit.liquid.type'] = 'chained'
+        self.config.include('voteit.liquid.models')
+        meeting = poll.__parent__.__parent__
+        root = meeting.__parent__
+        for userid in ('james', 'john', 'jeff'):
+            root.users[userid] = User()
+            meeting.add_groups(userid, ['role:Voter'])
+        repr = IRepresentatives(meeting)
+        for userid in ('jane', 'james'):
+            repr.enable_representative(userid)
+        repr.represent('jane', 'james')
+        repr.represent('james', 'john')
+        repr.represent('james', 'jeff')
+        return poll
+
+    def test_chained_representatives_registered(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        poll = self._fixture()
+        self.assertIsInstance(IRepresentatives(poll.__parent__.__parent__), ChainedRepresentatives)
+
+    def test_votes_follow_chain(self):
+        poll = self._fixture()
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        for userid in ('james', 'john', 'jeff'):
+            self.assertEqual(poll[userid].get_vote_data(), {'a': 1})
+            self.assertEqual(poll[userid].creators, ['jane'])
+
+    def test_closest_voting_representative_decides(self):
+        poll = self._fixture()
+        self.config.testing_securitypolicy(userid = 'james')
+        james_v = Vote(creators = ['james'])
+        james_v.set_vote_data({'b': 2}, notify = False)
+        poll['james'] = james_v
+        self.config.testing_securitypolicy(userid = 'jane')
+        jane_v = Vote(creators = ['jane'])
+        jane_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = jane_v
+        self.assertEqual(poll['james'].get_vote_data(), {'b': 2})
+        self.assertEqual(poll['john'].get_vote_data(), {'b': 2})
+
+    def test_represented_representative_votes_then_upstream_changes(self):
+        poll = self._fixture()
+        jane_v = Vote(creators = ['jane'])
+        jane_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = jane_v
+        self.assertEqual(poll['james'].creators, ['jane'])
+        self.config.testing_securitypolicy(userid = 'james')
+        poll['james'].set_vote_data({'b': 2})
+        self.assertEqual(poll['james'].creators, ['james'])
+        self.assertEqual(poll['john'].creators, ['james'])
+        self.config.testing_securitypolicy(userid = 'jane')
+        jane_v.set_vote_data({'c': 3})
+        self.assertEqual(poll['james'].get_vote_data(), {'b': 2})
+        self.assertEqual(poll['john'].get_vote_data(), {'b': 2})
+        lv = self._cut(jane_v)
+        self.assertNotIn('james', list(lv.delegators('jane')))
+
+
+class DelegationChangesInOpenPollsTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self, ld_type = 'simple', snapshots = False, item_events = False):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        self.config.registry.settings['voteit.liquid.type'] = ld_type
+        self.config.registry.settings['voteit.liquid.snapshots'] = str(snapshots)
+        self.config.registry.settings['voteit.liquid.item_events'] = str(item_events)
+        self.config.include('voteit.liquid.models')
+        self.config.include('voteit.liquid.subscribers')
+        poll = vote.__parent__
+        meeting = poll.__parent__.__parent__
+        root = meeting.__parent__
+        for userid in ('james', 'john'):
+            root.users[userid] = User()
+            meeting.add_groups(userid, ['role:Voter'])
+        repr = IRepresentatives(meeting)
+        repr.enable_representative('jane')
+        repr.represent('jane', 'james')
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        return poll
+
+    def test_open_polls_indexed(self):
+        from voteit.liquid.subscribers import open_polls
+        poll = self._fixture()
+        meeting = poll.__parent__.__parent__
+        self.assertEqual(open_polls(meeting), (poll,))
+        unrestricted_wf_transition_to(poll, 'closed')
+        self.assertEqual(open_polls(meeting), ())
+
+    def test_released_delegator_loses_proxy_vote(self):
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        self.assertIn('james', poll)
+        repr.release('james')
+        self.assertNotIn('james', poll)
+
+    def test_disabled_representative_votes_retracted(self):
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.disable_representative('jane')
+        self.assertNotIn('james', poll)
+        self.assertIn('jane', poll)
+
+    def test_new_delegator_gets_vote(self):
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.represent('jane', 'john')
+        self.assertEqual(poll['john'].get_vote_data(), {'a': 1})
+        self.assertEqual(poll['john'].creators, ['jane'])
+
+    def test_own_vote_kept_on_release(self):
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        self.config.testing_securitypolicy(userid = 'john')
+        poll['john'] = own = Vote(creators = ['john'])
+        own.set_vote_data({'b': 2}, notify = False)
+        repr.represent('jane', 'john')
+        self.assertEqual(poll['john'].get_vote_data(), {'b': 2})
+        repr.release('john')
+        self.assertIn('john', poll)
+
+    def test_bulk_changes(self):
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.represent_many([('jane', 'john')])
+        self.assertEqual(poll['john'].creators, ['jane'])
+        repr.release_many(['james', 'john'])
+        self.assertNotIn('james', poll)
+        self.assertNotIn('john', poll)
+
+    def test_bulk_changes_propagated_once_per_representative(self):
+        from voteit.liquid.interfaces import IRepresentativeVotesPropagated
+        poll = self._fixture()
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.release('james')
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IRepresentativeVotesPropagated)
+        repr.represent_many([('jane', 'james'), ('jane', 'john')])
+        self.assertEqual(len(L), 1)
+        self.assertEqual(sorted(L[0].added), ['james', 'john'])
+
+    def test_bulk_import_propagated_once_per_representative(self):
+        from voteit.liquid.bulk import import_delegations
+        from voteit.liquid.interfaces import IRepresentativeVotesPropagated
+        poll = self._fixture()
+        meeting = poll.__parent__.__parent__
+        meeting.__parent__.users['jeff'] = User()
+        meeting.add_groups('jeff', ['role:Voter'])
+        L = []
+        self.config.add_subscriber(lambda event: L.append(event), IRepresentativeVotesPropagated)
+        rows = [(1, 'jane', 'john'), (2, 'jane', 'jeff')]
+        pairs, errors = import_delegations(meeting, rows, request = testing.DummyRequest())
+        self.assertEqual(errors, [])
+        self.assertEqual(len(L), 1)
+        self.assertEqual(sorted(L[0].added), ['jeff', 'john'])
+        self.assertEqual(poll['jeff'].creators, ['jane'])
+
+    def test_bulk_changes_handled_once_with_item_events(self):
+        from voteit.liquid.subscribers import propagate_enabled_votes
+        from voteit.liquid.subscribers import retract_released_votes
+        poll = self._fixture(item_events = True)
+        handlers = [x.handler for x in self.config.registry.registeredHandlers()]
+        self.assertNotIn(propagate_enabled_votes, handlers)
+        self.assertNotIn(retract_released_votes, handlers)
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.represent_many([('jane', 'john')])
+        self.assertEqual(poll['john'].creators, ['jane'])
+        repr.release_many(['james', 'john'])
+        self.assertNotIn('james', poll)
+        self.assertNotIn('john', poll)
+
+    def test_snapshot_taken_when_poll_opens(self):
+        poll = self._fixture(snapshots = True)
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        self.assertEqual(poll.__liquid_snapshot__.represented_by('james'), 'jane')
+        repr.represent('jane', 'john')
+        repr.release('james')
+        self.assertIn('james', poll)
+        self.assertNotIn('john', poll)
+
+    def test_chained_subtree_follows_new_representative(self):
+        poll = self._fixture(ld_type = 'chained')
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.enable_representative('james')
+        repr.represent('james', 'john')
+        self.assertEqual(poll['john'].creators, ['jane'])
+        repr.release('james')
+        self.assertNotIn('james', poll)
+        self.assertNotIn('john', poll)
+
+
+class WeightedTallyTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.models import WeightedTally
+        return WeightedTally
+
+    def _fixture(self):
+        vote = _voting_fixture(self.config)
+        poll = vote.__parent__
+        meeting = poll.__parent__.__parent__
+        root = meeting.__parent__
+        for userid in ('james', 'john', 'jeff'):
+            root.users[userid] = User()
+            meeting.add_groups(userid, ['role:Voter'])
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        repr = IRepresentatives(meeting)
+        repr['one'] = ('james', 'john', 'jeff', 'not_a_voter')
+        other = Vote(creators = ['john'])
+        other.set_vote_data({'c': 3}, notify = False)
+        poll['john'] = other
+        return poll
+
+    def test_verify_object(self):
+        from voteit.liquid.interfaces import ILiquidTally
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        self.failUnless(verifyObject(ILiquidTally, self._cut(poll)))
+
+    def test_weights(self):
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        obj = self._cut(poll)
+        self.assertEqual(obj.weights(), {'one': 3, 'john': 1})
+
+    def test_ballots(self):
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        obj = self._cut(poll)
+        self.assertEqual(obj.ballots(), (({'a': 1, 'b': 2}, 3), ({'c': 3}, 1)))
+
+    def test_close_stores_weights(self):
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        obj = self._cut(poll)
+        obj.close()
+        self.assertEqual(dict(poll.__liquid_weights__), {'one': 3, 'john': 1})
+        self.assertEqual(poll.ballots, (({'a': 1, 'b': 2}, 3), ({'c': 3}, 1)))
+        repr = IRepresentatives(poll.__parent__.__parent__)
+        repr.release('james')
+        self.assertEqual(obj.weights()['one'], 3)
+
+    def test_handle_close_restores_weighted_ballots(self):
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        obj = self._cut(poll)
+        obj.close()
+        self.assertFalse(obj.handle_close())
+        poll.ballots = (({'a': 1, 'b': 2}, 1), ({'c': 3}, 1))
+        self.assertTrue(obj.handle_close())
+        self.assertEqual(poll.ballots, (({'a': 1, 'b': 2}, 3), ({'c': 3}, 1)))
+
+    def test_ballots_with_mixed_types(self):
+        self.config.include('voteit.liquid.models')
+        poll = self._fixture()
+        poll['john'].set_vote_data({1: 'x', 'a': None}, notify = False)
+        obj = self._cut(poll)
+        self.assertEqual(len(obj.ballots()), 2)
+
+    def test_tally_before_close(self):
+        self.config.include('pyramid_chameleon')
+        poll = self._fixture()
+        self.config.registry.settings['voteit.liquid.type'] = 'weighted'
+        self.config.include('voteit.liquid.models')
+        unrestricted_wf_transition_to(poll, 'closed')
+        self.assertEqual(dict(poll.__liquid_weights__), {'one': 3, 'john': 1})
+
+    def test_plugin_counts_weighted_ballots_after_close(self):
+        from voteit.core.models.interfaces import IPoll
+        from voteit.core.models.interfaces import IPollPlugin
+        from voteit.core.plugins.majority_poll import MajorityPollPlugin
+        counted = []
+        class RecordingPlugin(MajorityPollPlugin):
+            def handle_close(self):
+                counted.append(self.context.ballots)
+                return super(RecordingPlugin, self).handle_close()
+        self.config.include('pyramid_chameleon')
+        poll = self._fixture()
+        self.config.registry.registerAdapter(RecordingPlugin, (IPoll,), IPollPlugin, name = 'majority_poll')
+        self.config.registry.settings['voteit.liquid.type'] = 'weighted'
+        self.config.include('voteit.liquid.models')
+        unrestricted_wf_transition_to(poll, 'closed')
+        weighted = (({'a': 1, 'b': 2}, 3), ({'c': 3}, 1))
+        self.assertEqual(poll.ballots, weighted)
+        self.assertEqual(counted[-1], weighted)
+
+    def test_weighted_voter_adds_no_votes(self):
+        self.config.include('pyramid_chameleon')
+        poll = self._fixture()
+        self.config.testing_securitypolicy(userid = 'one')
+        self.config.registry.settings['voteit.liquid.type'] = 'weighted'
+        self.config.include('voteit.liquid.models')
+        poll['one'].set_vote_data({'a': 2})
+        self.assertNotIn('james', poll)
+
+
+class PropagationQueueTests(TestCase):
+
+    @property
+    def _cut(self):
+        from voteit.liquid.deferred import PropagationQueue
+        return PropagationQueue
+
+    def test_add_once(self):
+        obj = self._cut()
+        self.assertTrue(obj.add('/m/ai/poll', 'jane', 'jane'))
+        self.assertFalse(obj.add('/m/ai/poll', 'jane', 'jane'))
+        self.assertEqual(len(obj), 1)
+
+    def test_pop(self):
+        obj = self._cut()
+        obj.add('/m/ai/poll', 'jane', 'jane')
+        obj.add('/m/ai/poll', 'john', 'john')
+        self.assertEqual(obj.pop(1), [('/m/ai/poll', 'jane', 'jane')])
+        self.assertEqual(obj.pop(5), [('/m/ai/poll', 'john', 'john')])
+        self.assertEqual(obj.pop(5), [])
+        self.assertTrue(obj.add('/m/ai/poll', 'jane', 'jane'))
+
+
+class DeferredPropagationTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+
+    def tearDown(self):
+        testing.tearDown()
+
+    def _fixture(self):
+        self.config.include('pyramid_chameleon')
+        vote = _voting_fixture(self.config)
+        self.config.testing_securitypolicy(userid = 'jane')
+        poll = vote.__parent__
+        unrestricted_wf_transition_to(poll, 'ongoing')
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.registry.settings['voteit.liquid.deferred'] = 'true'
+        self.config.include('voteit.liquid.models')
+        meeting = poll.__parent__.__parent__
+        root = meeting.__parent__
+        root.users['james'] = User()
+        meeting.add_groups('james', ['role:Voter'])
+        repr = IRepresentatives(meeting)
+        repr['jane'] = ('james',)
+        new_v = Vote(creators = ['jane'])
+        new_v.set_vote_data({'a': 1}, notify = False)
+        poll['jane'] = new_v
+        return poll
+
+    def test_vote_queued(self):
+        from voteit.liquid.deferred import get_queue
+        poll = self._fixture()
+        root = poll.__parent__.__parent__.__parent__
+        self.assertNotIn('james', poll)
+        self.assertEqual(len(get_queue(root)), 1)
+
+    def test_process_queue(self):
+        from voteit.liquid.deferred import get_queue
+        from voteit.liquid.deferred import process_queue
+        poll = self._fixture()
+        root = poll.__parent__.__parent__.__parent__
+        request = testing.DummyRequest()
+        self.assertEqual(process_queue(root, self.config.registry, request), 1)
+        self.assertEqual(poll['james'].get_vote_data(), {'a': 1})
+        self.assertEqual(len(get_queue(root)), 0)
+
+    def test_closed_poll_not_processed(self):
+        from voteit.liquid.deferred import process_queue
+        poll = self._fixture()
+        root = poll.__parent__.__parent__.__parent__
+        unrestricted_wf_transition_to(poll, 'closed')
+        process_queue(root, self.config.registry, testing.DummyRequest())
+        self.assertNotIn('james', poll)
+
+    def test_process_job_uses_voter_factory(self):
+        from pyramid.traversal import resource_path
+        from voteit.liquid.deferred import process_job
+        poll = self._fixture()
+        root = poll.__parent__.__parent__.__parent__
+        calls = []
+        self.config.registry._liquid_voter_factory = ('simple', lambda vote: calls.append)
+        process_job(root, self.config.registry, (resource_path(poll), 'jane', 'jane'))
+        self.assertEqual(calls, ['jane'])
+        self.assertNotIn('james', poll)
+
+
+    def test_failing_job_dropped(self):
+        from voteit.liquid.deferred import get_queue
+        from voteit.liquid.deferred import process_queue
+        root = testing.DummyResource()
+        root['poll'] = poll = testing.DummyResource()
+        poll.get_workflow_state = lambda: 'ongoing'
+        poll['jane'] = testing.DummyResource()
+        poll['broken'] = testing.DummyResource()
+        calls = []
+        def adjust(voter):
+            if voter == 'broken':
+                raise ValueError(voter)
+            calls.append(voter)
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.registry._liquid_voter_factory = ('simple', lambda vote: adjust)
+        queue = get_queue(root)
+        queue.add('/poll', 'broken', 'broken')
+        queue.add('/poll', 'jane', 'jane')
+        self.assertEqual(process_queue(root, self.config.registry, testing.DummyRequest()), 2)
+        self.assertEqual(calls, ['jane'])
+        self.assertEqual(len(queue), 0)
+
+class RepresentativesJSONTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('arche.testing')
+        self.config.include('voteit.liquid')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.views import RepresentativesJSON
+        return RepresentativesJSON
+
+    def _fixture(self):
+        root = bootstrap_and_fixture(self.config)
+        self.config.testing_securitypolicy('jane', permissive = True)
+        root['m'] = context = Meeting()
+        repr = IRepresentatives(context)
+        repr['anna'] = ('a1', 'a2')
+        repr['anders'] = ('b1',)
+        repr['bertil'] = ('c1', 'c2', 'c3')
+        repr['cecilia'] = ()
+        return context
+
+    def _call(self, context, **params):
+        request = testing.DummyRequest(params = params)
+        return self._cut(context, request)()
+
+    def _userids(self, response):
+        return [x['userid'] for x in response['items']]
+
+    def test_by_name(self):
+        context = self._fixture()
+        response = self._call(context, limit = '2')
+        self.assertEqual(self._userids(response), ['anders', 'anna'])
+        #No such user, so the userid is the title
+        self.assertEqual(response['items'][0]['title'], 'anders')
+        response = self._call(context, limit = '2', after = response['next'])
+        self.assertEqual(self._userids(response), ['bertil', 'cecilia'])
+        self.assertEqual(response['next'], None)
+
+    def test_prefix_search(self):
+        context = self._fixture()
+        response = self._call(context, q = 'an')
+        self.assertEqual(self._userids(response), ['anders', 'anna'])
+
+    def test_by_weight(self):
+        context = self._fixture()
+        response = self._call(context, sort = 'weight', limit = '2')
+        self.assertEqual(self._userids(response), ['bertil', 'anna'])
+        self.assertEqual(response['items'][0]['votes'], 4)
+        response = self._call(context, sort = 'weight', limit = '2', after = response['next'])
+        self.assertEqual(self._userids(response), ['anders', 'cecilia'])
+        self.assertEqual(response['next'], None)
+
+    def test_bad_params(self):
+        from pyramid.httpexceptions import HTTPBadRequest
+        context = self._fixture()
+        self.assertRaises(HTTPBadRequest, self._call, context, sort = 'other')
+        self.assertRaises(HTTPBadRequest, self._call, context, limit = 'a')
+        self.assertRaises(HTTPBadRequest, self._call, context, sort = 'weight', after = 'a')
+
+    def test_limit_at_least_one(self):
+        context = self._fixture()
+        for limit in ('0', '-2'):
+            response = self._call(context, sort = 'weight', limit = limit)
+            self.assertEqual(self._userids(response), ['bertil'])
+            self.assertEqual(response['next'], '-3:bertil')
+
+    def test_by_weight_prefix_search(self):
+        context = self._fixture()
+        response = self._call(context, sort = 'weight', q = 'an', limit = '1')
+        self.assertEqual(self._userids(response), ['anna'])
+        response = self._call(context, sort = 'weight', q = 'an', after = response['next'])
+        self.assertEqual(self._userids(response), ['anders'])
+        self.assertEqual(response['next'], None)
+
+    def test_chained_votes(self):
+        from voteit.liquid.models import ChainedRepresentatives
+        self.config.registry.registerAdapter(ChainedRepresentatives)
+        root = bootstrap_and_fixture(self.config)
+        self.config.testing_securitypolicy('jane', permissive = True)
+        root['m'] = context = Meeting()
+        repr = IRepresentatives(context)
+        repr.enable_representative('anna')
+        repr.enable_representative('bertil')
+        repr.represent('bertil', 'a1')
+        repr.represent('anna', 'bertil')
+        response = self._call(context, sort = 'weight')
+        self.assertEqual(self._userids(response), ['anna', 'bertil'])
+        self.assertEqual([x['votes'] for x in response['items']], [3, 2])
+
+    def test_select_url(self):
+        context = self._fixture()
+        item = self._call(context, q = 'cecilia')['items'][0]
+        self.assertTrue(item['can_select'])
+        self.assertEqual(item['url'], 'http://example.com/m/select_representative_form?repr=cecilia')
+
+
+class UserTitlesTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.include('arche.testing')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _fut(self):
+        from voteit.liquid.views import user_titles
+        return user_titles
+
+    def test_user_titles(self):
+        root = bootstrap_and_fixture(self.config)
+        root.users['jane'] = User(first_name = 'Jane', last_name = 'Doe')
+        root['m'] = context = Meeting()
+        result = self._fut(context, ['jane', '404', 'jane'])
+        self.assertEqual(result, {'jane': root.users['jane'].title, '404': '404'})
+
+
+class RepresentationViewTests(TestCase):
+
+    def setUp(self):
+        self.config = testing.setUp()
+        self.config.registry.settings['voteit.liquid.type'] = 'simple'
+        self.config.include('arche.testing')
+        self.config.include('voteit.liquid')
+
+    def tearDown(self):
+        testing.tearDown()
+
+    @property
+    def _cut(self):
+        from voteit.liquid.views import RepresentationView
+        return RepresentationView
+
+    def _request(self, **kw):
+        request = testing.DummyRequest(**kw)
+        request.creators_calls = calls = []
+        def creators_info(userids, portrait = True):
+            calls.append((tuple(userids), portrait))
+            return ", ".join(userids)
+        request.creators_info = creators_info
+        return request
+
+    def test_user_info_rendered_once(self):
+        root = bootstrap_and_fixture(self.config)
+        self.config.testing_securitypolicy('jane', permissive = True)
+        root['m'] = context = Meeting()
+        repr = IRepresentatives(context)
+        repr['jane'] = ('one', 'two')
+        request = self._request(if_none_match = NoETag)
+        response = self._cut(context, request)()
+        self.assertEqual(response['delegators_info'], 'one, two')
+        self.assertEqual(response['represented_by'], None)
+        self.assertEqual(request.creators_calls, [(('one', 'two'), False)])
+
+    def _etag_fixture(self):
+        root = bootstrap_and_fixture(self.config)
+        self.config.testing_securitypolicy('jane', permissive = True)
+        root['m'] = context = Meeting()
+        IRepresentatives(context).enable_representative('jane')
+        return context
+
+    def test_etag_set(self):
+        context = self._etag_fixture()
+        request = self._request(if_none_match = NoETag)
+        obj = self._cut(context, request)
+        obj()
+        self.assertEqual(request.response.etag, obj.etag(IRepresentatives(context)))
+
+    def test_not_modified(self):
+        from pyramid.httpexceptions import HTTPNotModified
+        context = self._etag_fixture()
+        request = testing.DummyRequest()
+        obj = self._cut(context, request)
+        etag = obj.etag(IRepresentatives(context))
+        request.if_none_match = ETagMatcher([etag])
+        self.assertIsInstance(obj(), HTTPNotModified)
+
+    def test_etag_changes_when_delegation_expires(self):
+        from time import time
+        from voteit.liquid import models
+        now = time()
+        context = self._etag_fixture()
+        obj = self._cut(context, testing.DummyRequest(if_none_match = NoETag))
+        repr = IRepresentatives(context)
+        repr.represent('jane', 'john', expires = now + 100)
+        etag = obj.etag(repr)
+        original = models.time
+        models.time = lambda: now + 200
+        try:
+            self.assertNotEqual(obj.etag(repr), etag)
+        finally:
+            models.time = original
+
+    def test_etag_changes_with_delegations(self):
+        context = self._etag_fixture()
+        obj = self._cut(context, testing.DummyRequest(if_none_match = NoETag))
+        repr = IRepresentatives(context)
+        etag = obj.etag(repr)
+        repr.represent('jane', 'john')
+        self.assertNotEqual(obj.etag(repr), etag)
 
 
 class RepresentativeFormTests(TestCase):
@@ -383,7 +2398,7 @@ class RepresentativeFormTests(TestCase):
         obj.check_csrf = False
         response = obj()
         self.assertIn('jane', repr)
-        self.assertEqual(repr['jane'] ,('one', 'two',))
+        self.assertEqual(tuple(repr['jane']) ,('one', 'two',))
 
 
 class SelectRepresentativeFormTests(TestCase):
@@ -468,7 +2483,7 @@ class SelectRepresentativeFormTests(TestCase):
         obj.check_csrf = False
         response = obj()
         self.assertEqual(repr.represented_by('jane'), 'zwork')
-        self.assertEqual(repr['zwork'], ('jane', 'jeff',))
+        self.assertEqual(tuple(repr['zwork']), ('jane', 'jeff',))
         self.assertEqual(response.location, 'http://example.com/m/representation')
 
     def test_unset_repr(self):
@@ -483,5 +2498,5 @@ class SelectRepresentativeFormTests(TestCase):
         obj.check_csrf = False
         response = obj()
         self.assertEqual(repr.represented_by('jane'), None)
-        self.assertEqual(repr['zwork'], ('jeff',))
+        self.assertEqual(tuple(repr['zwork']), ('jeff',))
         self.assertEqual(response.location, 'http://example.com/m/representation')
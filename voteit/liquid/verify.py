@@ -0,0 +1,87 @@
+""" Check that the delegation indexes of a meeting agree, and optionally repair them.
+
+    voteit_liquid_verify etc/production.ini /meeting
+    voteit_liquid_verify etc/production.ini /meeting --repair
+
+    Problems are written to a temporary file while the indexes are read, and repairs
+    are applied from that file in batched transactions, so memory use doesn't
+    depend on the size of the meeting.
+"""
+import argparse
+import json
+import sys
+import tempfile
+
+from pyramid.paster import bootstrap
+from pyramid.traversal import find_resource
+import transaction
+
+from voteit.liquid.interfaces import IRepresentatives
+
+
+def check(meeting, out = sys.stdout, problems_file = None, gc_interval = 10000):
+    """ Write all problems to out, and as JSON lines to problems_file if given.
+        Returns the number of problems.
+    """
+    repr = IRepresentatives(meeting)
+    found = 0
+    for problem in repr.verify(gc_interval = gc_interval):
+        found += 1
+        out.write(repr.format_problem(problem) + '\n')
+        if problems_file is not None:
+            problems_file.write(json.dumps(problem) + '\n')
+    return found
+
+
+def _batches(problems_file, size):
+    batch = []
+    for line in problems_file:
+        batch.append(tuple(json.loads(line)))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def repair(meeting, problems_file, batch_size = 1000, retries = 5, tm = transaction.manager):
+    """ Repair problems read from problems_file, batch_size per transaction.
+        Returns the number of changes.
+    """
+    fixed = 0
+    for batch in _batches(problems_file, batch_size):
+        for attempt in tm.attempts(retries):
+            with attempt:
+                changes = IRepresentatives(meeting).repair(batch)
+        fixed += changes
+    return fixed
+
+
+def main(argv = sys.argv):
+    parser = argparse.ArgumentParser(description = "Check the delegations of a meeting.")
+    parser.add_argument('config_uri', help = "Paster ini file")
+    parser.add_argument('meeting', help = "Path to the meeting, like /my-meeting")
+    parser.add_argument('--repair', action = 'store_true', help = "Fix the problems that were found")
+    parser.add_argument('--batch', type = int, default = 1000, help = "Repairs per transaction")
+    args = parser.parse_args(argv[1:])
+    env = bootstrap(args.config_uri)
+    try:
+        meeting = find_resource(env['root'], args.meeting)
+        problems_file = tempfile.TemporaryFile(mode = 'w+')
+        try:
+            found = check(meeting, problems_file = problems_file)
+            #Reading doesn't change anything, so don't keep the objects around
+            transaction.abort()
+            print("Found %s problems" % found)
+            if found and args.repair:
+                problems_file.seek(0)
+                fixed = repair(meeting, problems_file, batch_size = args.batch)
+                print("Made %s changes" % fixed)
+                found = check(meeting)
+                if found:
+                    print("%s problems remain" % found)
+            return found and 1 or 0
+        finally:
+            problems_file.close()
+    finally:
+        env['closer']()
@@ -1,16 +1,23 @@
 from arche.views.base import BaseForm
 from arche.views.base import BaseView
+from bisect import bisect_right
+from hashlib import md5
+from itertools import islice
+
 from betahaus.viewcomponent.decorators import view_action
+from pyramid.httpexceptions import HTTPBadRequest
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPNotModified
+from pyramid.decorator import reify
+from pyramid.traversal import find_root
 from pyramid.view import view_config
 from voteit.core import security
 from voteit.core.models.interfaces import IMeeting
-from voteit.core.models.interfaces import IVote
 
 from voteit.liquid import _
-from voteit.liquid.interfaces import ILiquidVoter
 from voteit.liquid.interfaces import IRepresentatives
+from voteit.liquid.models import get_liquid_voter_factory
 
 
 @view_action('meeting_menu', 'representation', title = _(u"Representation"))
@@ -20,12 +27,19 @@ def representation_menu_link(context, request, va, **kw):
 
 
 def _get_ld_adapter(request):
-    ld_name = request.registry.settings.get('voteit.liquid.type', None)
-    if not ld_name:
-        return
-    for reg in request.registry.registeredAdapters():
-        if reg.provided == ILiquidVoter and reg.name == ld_name and IVote in reg.required:
-            return reg.factory
+    return get_liquid_voter_factory(request.registry)
+
+
+def user_titles(context, userids):
+    """ Dict of userid to the title of the user, or the userid if there's no such user.
+        Only reads the users folder, nothing is rendered for each user.
+    """
+    users = find_root(context)['users']
+    titles = {}
+    for userid in userids:
+        user = users.get(userid, None)
+        titles[userid] = user is not None and getattr(user, 'title', None) or userid
+    return titles
 
 
 @view_config(context = IMeeting,
@@ -34,14 +48,125 @@ def _get_ld_adapter(request):
              renderer = 'voteit.liquid:templates/representation.pt')
 class RepresentationView(BaseView):
 
+    def etag(self, repr):
+        """ Changes when anything shown on the page might have changed. """
+        value = "%s:%s:%s" % (repr.cache_key(), self.request.authenticated_userid, self.context.get_workflow_state())
+        return md5(value.encode('utf-8')).hexdigest()
+
     def __call__(self):
+        repr = IRepresentatives(self.context)
+        etag = self.etag(repr)
+        if etag in self.request.if_none_match:
+            response = HTTPNotModified()
+            response.etag = etag
+            return response
+        self.request.response.etag = etag
+        self.request.response.cache_control = 'private, no-cache'
         response = {}
         response['open'] = self.context.get_workflow_state() != 'closed'
-        response['repr'] = repr = IRepresentatives(self.context)
+        response['repr'] = repr
         response['ld_type'] = _get_ld_adapter(self.request)
+        userid = self.request.authenticated_userid
+        delegators = tuple(repr.get(userid, ()))
+        response['represented_by'] = represented_by = repr.represented_by(userid)
+        #All users in a list are rendered by one call, like everywhere else
+        response['delegators_info'] = delegators and self.request.creators_info(delegators, portrait = False) or ''
+        response['represented_by_info'] = ''
+        if represented_by is not None:
+            response['represented_by_info'] = self.request.creators_info([represented_by], portrait = False)
         return response
 
 
+@view_config(context = IMeeting,
+             name = 'representatives.json',
+             permission = security.VIEW,
+             renderer = 'json')
+class RepresentativesJSON(BaseView):
+    """ A page of representatives, sorted by userid or weight.
+        Params:
+        sort: 'name' (userid) or 'weight' (number of votes, most first)
+        q: only userids starting with this
+        after: the 'next' cursor from the previous page
+        limit: number of representatives per page
+    """
+    default_limit = 50
+    max_limit = 200
+
+    def __call__(self):
+        params = self.request.GET
+        try:
+            limit = max(1, min(int(params.get('limit', self.default_limit)), self.max_limit))
+        except ValueError:
+            raise HTTPBadRequest("limit must be an integer")
+        sort = params.get('sort', 'name')
+        if sort == 'name':
+            userids, next_cursor = self.by_name(params.get('q', ''), params.get('after', None), limit)
+        elif sort == 'weight':
+            userids, next_cursor = self.by_weight(params.get('q', ''), params.get('after', None), limit)
+        else:
+            raise HTTPBadRequest("sort must be 'name' or 'weight'")
+        titles = user_titles(self.context, userids)
+        return {'items': [self.item(userid, titles[userid]) for userid in userids],
+                'next': next_cursor}
+
+    @reify
+    def repr(self):
+        return IRepresentatives(self.context)
+
+    def matching(self, query, after = None):
+        """ Iterate userids starting with query, after the userid after. """
+        min_key = after or query or None
+        max_key = query and query + u'\uffff' or None
+        return self.repr.keys(min_key, max_key, excludemin = after is not None)
+
+    def by_name(self, query, after, limit):
+        userids = list(islice(self.matching(query, after), limit + 1))
+        if len(userids) > limit:
+            return userids[:limit], userids[limit - 1]
+        return userids, None
+
+    def by_weight(self, query, after, limit):
+        #Only sorted again when the delegations have changed, see IRepresentatives.ranked
+        entries = self.repr.ranked()
+        start = 0
+        if after:
+            try:
+                weight, userid = after.split(':', 1)
+                start = bisect_right(entries, (int(weight), userid))
+            except ValueError:
+                raise HTTPBadRequest("Bad cursor")
+        if query:
+            page = list(islice((x for x in islice(entries, start, None) if x[1].startswith(query)), limit + 1))
+        else:
+            page = list(entries[start:start + limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = "%s:%s" % page[-1]
+        return [userid for (weight, userid) in page], next_cursor
+
+    @reify
+    def represented_by(self):
+        return self.repr.represented_by(self.request.authenticated_userid)
+
+    @reify
+    def open(self):
+        return self.context.get_workflow_state() != 'closed'
+
+    def item(self, userid, title):
+        current = self.represented_by == userid
+        can_select = self.open and self.repr.can_represent(userid, self.request.authenticated_userid)
+        url = None
+        if self.open and (current or can_select):
+            url = self.request.resource_url(self.context, 'select_representative_form', query = {'repr': userid})
+        return {'userid': userid,
+                'title': title,
+                'votes': self.repr.weight(userid) + 1,
+                'current': current,
+                'can_select': can_select,
+                'url': url}
+
+
 @view_config(context = IMeeting,
              name = 'representative_form',
              permission = security.VIEW, #FIXME: Permission?
@@ -76,7 +201,7 @@ class RepresentativeForm(BaseForm):
                 msg = _('no_longer_representative',
                         default = "You're no longer an available representative. "
                             "${votes} vote(s) were released back to their original owners.",
-                            mapping = {'votes': len(repr[userid])})
+                            mapping = {'votes': repr.count(userid)})
                 self.flash_messages.add(msg)
                 repr.disable_representative(userid)
         return HTTPFound(location = self.request.resource_url(self.context, 'representation'))